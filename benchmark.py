@@ -0,0 +1,540 @@
+import argparse
+import convert
+import datetime
+import extract
+import http.server
+import json
+import logging
+import multiprocessing
+import os
+import random
+import re
+import resource
+import serve
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import treelib_json_to_d3
+import urllib.parse
+import urllib.request
+
+BASE_ID = 'appBenchmark'
+USER_ID = 1
+AIRTABLE_PREFIX = '/airtable/v0'
+BETTERWORKS_PREFIX = '/betterworks/api/v1'
+# Real Airtable records carry many fields extract.py never reads
+UNUSED_AIRTABLE_FIELDS = {'Notes': 'Free text notes about this record. ' * 20,
+                          'Status': 'In progress',
+                          'Last Review': '2026-01-01'}
+
+
+class MockData(object):
+    """
+    A synthetic Airtable base and BetterWorks goal graph, shaped like
+    the real ones closely enough for extract.py to run against.
+
+    Airtable: airtable_fanout priorities, each with that many outcomes,
+    each outcome with that many KDs, and each KD with that many projects
+    and that many activities.  Every record also has the
+    UNUSED_AIRTABLE_FIELDS.
+
+    BetterWorks: bw_roots top-level goals owned by the benchmark user,
+    each the top of a goal tree bw_depth levels deep with bw_fanout
+    children per goal.
+    """
+
+    def __init__(self, airtable_fanout=4, bw_roots=3, bw_depth=4, bw_fanout=4):
+        self.created = datetime.datetime.now(datetime.timezone.utc)
+        self.tables = {table: [] for table in extract.AIRTABLE_TABLES}
+        self.make_airtable(airtable_fanout)
+        self.goals = {}
+        self.children = {}
+        self.roots = []
+        self.make_goals(bw_roots, bw_depth, bw_fanout)
+
+    def add_record(self, table, fields):
+        record = {'id': f'rec{table[:3]}{len(self.tables[table]):06d}',
+                  'fields': dict(fields, **UNUSED_AIRTABLE_FIELDS)}
+        self.tables[table].append(record)
+        return record['id']
+
+    def make_airtable(self, fanout):
+        for p in range(fanout):
+            priority = self.add_record('Priorities', {'ID': f'P{p}'})
+            for o in range(fanout):
+                outcome = self.add_record('Outcomes', {'Name': f'Outcome {p}.{o}', 'ID': f'O-{p}.{o}',
+                                                       'Department': f'Department {o}',
+                                                       'Priority': [priority]})
+                for k in range(fanout):
+                    kd = self.add_record('KDs', {'KD Budget Name': f'KD {p}.{o}.{k}', 'K-ID': f'K-{p}.{o}.{k}',
+                                                 'KD Description': 'A key deliverable. ' * 5,
+                                                 'Outcome': [outcome]})
+                    for n in range(fanout):
+                        self.add_record('Projects', {'Project Name': f'Project {p}.{o}.{k}.{n}', 'KD': [kd]})
+                        self.add_record('Activities', {'Activity': f'Activity {p}.{o}.{k}.{n}',
+                                                       'KeyDeliverable': [kd]})
+
+    def make_goals(self, roots, depth, fanout):
+        # (parent goal ID, level) for each goal still to be made
+        queue = [(None, 1)] * roots
+        for parent, level in queue:
+            goal_id = 1000 + len(self.goals)
+            self.goals[goal_id] = {'id': goal_id,
+                                   'name': f'Goal {goal_id}',
+                                   'children': [],
+                                   'is_key_result': level == depth,
+                                   'parent': {'id': parent} if parent else None,
+                                   'owner': {'user': {'name': f'Owner {goal_id % 17}'}},
+                                   'start': '2026-01-01',
+                                   'end': '2026-12-31'}
+            if parent:
+                self.goals[parent]['children'].append({'id': goal_id})
+                self.children.setdefault(parent, []).append(goal_id)
+            else:
+                self.roots.append(goal_id)
+            if level < depth:
+                queue.extend([(goal_id, level + 1)] * fanout)
+
+    def node_count(self):
+        return sum(len(records) for records in self.tables.values()), len(self.goals)
+
+
+class MockHandler(serve.KeepAliveHandler):
+    """
+    Answers the Airtable and BetterWorks endpoints that extract.py uses,
+    from the server's MockData, after the configured latency.  A
+    fraction of requests, chosen at random, get 429 Too Many Requests.
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, body, status=200, headers=None):
+        content = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        server = self.server
+        url = urllib.parse.urlparse(self.path)
+        params = urllib.parse.parse_qs(url.query)
+        if url.path == '/_stats':
+            with server.lock:
+                stats, server.stats = server.stats, {'requests': 0, 'throttled': 0, 'bytes': 0}
+            self.send_json(stats)
+            return
+
+        with server.lock:
+            server.stats['requests'] += 1
+            throttle = server.random.random() < server.throttle_rate
+            if throttle:
+                server.stats['throttled'] += 1
+        if server.latency:
+            time.sleep(server.latency)
+        if throttle:
+            self.send_json({'error': 'RATE_LIMIT_REACHED'}, 429, {'Retry-After': str(server.retry_after)})
+            return
+
+        if url.path.startswith(AIRTABLE_PREFIX):
+            body = self.airtable(url.path[len(AIRTABLE_PREFIX):], params)
+        elif url.path.startswith(BETTERWORKS_PREFIX):
+            body = self.betterworks(url.path[len(BETTERWORKS_PREFIX):], params)
+        else:
+            body = None
+        if body is None:
+            self.send_json({'error': 'NOT_FOUND'}, 404)
+            return
+        with server.lock:
+            server.stats['bytes'] += len(json.dumps(body))
+        self.send_json(body)
+
+    def page(self, items, params, page_size):
+        start = int(params.get('offset', params.get('page', ['0']))[0])
+        return items[start:start + page_size], start + page_size < len(items), start + page_size
+
+    def airtable(self, path, params):
+        data = self.server.data
+        if path == '/meta/bases':
+            return {'bases': [{'id': BASE_ID, 'name': 'Benchmark Base'}]}
+        match = re.fullmatch(r'/([^/]+)/([^/]+)', path)
+        if not match or match.group(1) != BASE_ID or match.group(2) not in data.tables:
+            return None
+        records = data.tables[match.group(2)]
+        formula = params.get('filterByFormula', [''])[0]
+        since = re.search(r"IS_AFTER\(LAST_MODIFIED_TIME\(\), '([^']+)'\)", formula)
+        if since:
+            since = datetime.datetime.strptime(since.group(1), '%Y-%m-%dT%H:%M:%S.000Z')
+            if since.replace(tzinfo=datetime.timezone.utc) > data.created:
+                records = []
+        page, more, offset = self.page(records, params, self.server.airtable_page_size)
+        fields = params.get('fields[]')
+        if fields:
+            page = [{'id': record['id'],
+                     'fields': {name: value for name, value in record['fields'].items() if name in fields}}
+                    for record in page]
+        body = {'records': page}
+        if more:
+            body['offset'] = str(offset)
+        return body
+
+    def betterworks(self, path, params):
+        data = self.server.data
+        if path.startswith('/users/'):
+            return {'id': USER_ID, 'name': 'Benchmark User'}
+        if path == '/goals/filter':
+            if 'parent' in params:
+                goal_ids = data.children.get(int(params['parent'][0]), [])
+            elif params.get('owner') == [str(USER_ID)]:
+                goal_ids = data.roots
+            else:
+                goal_ids = []
+            page, more, offset = self.page(goal_ids, params, self.server.bw_page_size)
+            body = {'results': [data.goals[goal_id] for goal_id in page], 'more': more}
+            if more:
+                query = {name: values[0] for name, values in params.items() if name != 'page'}
+                query['page'] = offset
+                body['nextURL'] = (f'http://{self.headers["Host"]}{BETTERWORKS_PREFIX}/goals/filter?'
+                                   f'{urllib.parse.urlencode(query)}')
+            return body
+        match = re.fullmatch(r'/goals/(\d+)/?', path)
+        if match and int(match.group(1)) in data.goals:
+            return data.goals[int(match.group(1))]
+        return {'reason': 'goal not found'}
+
+
+def run_mock_server(config, ready):
+    """
+    Build the mock data and serve it until killed.  Runs in its own
+    process, so the data doesn't count against the scenarios' memory.
+    Puts the server's base URL on the ready queue once it is listening.
+    """
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), MockHandler)
+    server.daemon_threads = True
+    server.data = MockData(config['airtable_fanout'], config['bw_roots'], config['bw_depth'], config['bw_fanout'])
+    server.latency = config['latency']
+    server.throttle_rate = config['throttle_rate']
+    server.retry_after = config['retry_after']
+    server.airtable_page_size = config['airtable_page_size']
+    server.bw_page_size = config['bw_page_size']
+    server.random = random.Random(config['seed'])
+    server.lock = threading.Lock()
+    server.stats = {'requests': 0, 'throttled': 0, 'bytes': 0}
+    ready.put((f'http://127.0.0.1:{server.server_address[1]}', server.data.node_count()))
+    server.serve_forever()
+
+
+######################################################################
+# Scenarios.  Each runs in a fresh process and returns how many nodes
+# it handled.
+######################################################################
+
+def configure_extract(config):
+    extract.AIRTABLE_API_URL = config['server_url'] + AIRTABLE_PREFIX
+    extract.BETTERWORKS_API_URL = config['server_url'] + BETTERWORKS_PREFIX
+    extract.AIRTABLE_REQUESTS_PER_SECOND = config['airtable_rate']
+    extract.ADD_NODE_TYPE_IN_NAME = True
+    extract.base_id = BASE_ID
+    if config['compact_tree']:
+        extract.tree_class = extract.CompactRootedTree
+    # every retry after a 429 waits the server's Retry-After, as in production
+    extract.configure_clients('benchmark', 'benchmark')
+
+
+def scenario_airtable(config):
+    configure_extract(config)
+    result_tree = extract.get_airtable_tree(extract.tree_class())
+    extract.save_tree(result_tree, config['paths']['airtable'])
+    return len(result_tree)
+
+
+def crawl_user(config, batch):
+    configure_extract(config)
+    user_id, user_name = extract.get_bw_user('benchmark@example.org')
+    crawler = extract.GoalCrawler(max_workers=config['max_workers'], batch=batch)
+    result_tree = extract.get_goals_for_user(user_id, extract.tree_class(), crawler)
+    extract.save_tree(result_tree, config['paths']['bw_user'])
+    return len(result_tree)
+
+
+def scenario_bw_user(config):
+    return crawl_user(config, batch=False)
+
+
+def scenario_bw_user_batch(config):
+    return crawl_user(config, batch=True)
+
+
+def convert_snapshot(config, output_type):
+    result_tree = convert.load_tree(config['paths']['airtable'])
+    with open(config['paths'][f'convert_{output_type}'], 'w') as output_file:
+        convert.walk_tree(result_tree, [convert.WRITERS[output_type](output_file)])
+    return len(result_tree)
+
+
+def scenario_convert_json(config):
+    return convert_snapshot(config, 'json')
+
+
+def scenario_convert_ndjson(config):
+    return convert_snapshot(config, 'ndjson')
+
+
+def scenario_convert_csv(config):
+    return convert_snapshot(config, 'csv')
+
+
+def scenario_convert_text(config):
+    return convert_snapshot(config, 'text')
+
+
+def scenario_d3_snapshot(config):
+    result_tree = treelib_json_to_d3.snapshot.Snapshot(config['paths']['airtable'])
+    output_dict = treelib_json_to_d3.snapshot_to_d3(result_tree, trim=30)
+    with open(config['paths']['d3'], 'w') as output_file:
+        output_file.write(json.dumps(output_dict))
+    return len(result_tree)
+
+
+def scenario_d3_json(config):
+    with open(config['paths']['convert_json']) as input_file:
+        output_dict = treelib_json_to_d3.treelib_to_d3(json.load(input_file), trim=30)
+    with open(config['paths']['d3'], 'w') as output_file:
+        output_file.write(json.dumps(output_dict))
+    return None
+
+
+def scenario_d3_stream(config):
+    with open(config['paths']['convert_json']) as input_file, open(config['paths']['d3'], 'w') as output_file:
+        treelib_json_to_d3.stream_treelib_to_d3(input_file, output_file, trim=30)
+    return None
+
+
+# In run order; later scenarios read files written by earlier ones
+SCENARIOS = {'airtable': scenario_airtable,
+             'bw_user': scenario_bw_user,
+             'bw_user_batch': scenario_bw_user_batch,
+             'convert_json': scenario_convert_json,
+             'convert_ndjson': scenario_convert_ndjson,
+             'convert_csv': scenario_convert_csv,
+             'convert_text': scenario_convert_text,
+             'd3_snapshot': scenario_d3_snapshot,
+             'd3_json': scenario_d3_json,
+             'd3_stream': scenario_d3_stream}
+NEEDS = {'convert_json': 'airtable', 'convert_ndjson': 'airtable', 'convert_csv': 'airtable',
+         'convert_text': 'airtable', 'd3_snapshot': 'airtable', 'd3_json': 'convert_json',
+         'd3_stream': 'convert_json'}
+
+
+def run_scenario(name, config, results):
+    """
+    Run one scenario and put its wall time, node count and peak RSS on
+    the results queue.  Called in a freshly spawned process, so peak RSS
+    covers only this scenario.
+    """
+    logging.basicConfig(level=config['log_level'], format='%(asctime)s %(levelname)-8s %(message)s')
+    start = time.perf_counter()
+    nodes = SCENARIOS[name](config)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != 'darwin':
+        peak_rss *= 1024
+    results.put({'wall_time': elapsed, 'nodes': nodes, 'peak_rss': peak_rss})
+
+
+def server_stats(server_url):
+    with urllib.request.urlopen(f'{server_url}/_stats') as response:
+        return json.loads(response.read())
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline):
+    """
+    Print each scenario's change from a results file saved by an
+    earlier run.
+    """
+    before = {result['scenario']: result for result in baseline['results']}
+    print(f'\nChange from {baseline.get("commit") or "baseline"}:')
+    for result in results:
+        old = before.get(result['scenario'])
+        if not old:
+            continue
+        changes = []
+        for key in ('wall_time', 'requests', 'peak_rss'):
+            if old[key]:
+                changes.append(f'{key} {(result[key] - old[key]) / old[key]:+.1%}')
+        print(f'{result["scenario"]:<16} {", ".join(changes)}')
+
+
+def main():
+    """
+    Benchmark extraction and conversion against local mock Airtable and
+    BetterWorks servers, without touching the real APIs.  Reports wall
+    time, requests made and peak memory for each scenario.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scenarios',
+                        nargs='+',
+                        choices=list(SCENARIOS),
+                        default=list(SCENARIOS),
+                        help='Which scenarios to run.  Prerequisite scenarios are added as needed.')
+
+    parser.add_argument('--airtable_fanout',
+                        type=int,
+                        default=4,
+                        help="""Records per parent at each level of the mock Airtable base.  The
+                        base has fanout ** 3 * (2 * fanout + 1) + fanout ** 2 + fanout records.""")
+
+    parser.add_argument('--airtable_page_size',
+                        type=int,
+                        default=100,
+                        help='Records per page from the mock Airtable.')
+
+    parser.add_argument('--airtable_rate',
+                        type=float,
+                        default=extract.AIRTABLE_REQUESTS_PER_SECOND,
+                        help='Airtable requests per second allowed by the client rate limiter.')
+
+    parser.add_argument('--bw_roots',
+                        type=int,
+                        default=3,
+                        help="Top-level goals owned by the mock BetterWorks user.")
+
+    parser.add_argument('--bw_depth',
+                        type=int,
+                        default=4,
+                        help='Levels in each mock BetterWorks goal tree.')
+
+    parser.add_argument('--bw_fanout',
+                        type=int,
+                        default=4,
+                        help='Children of each mock BetterWorks goal above the bottom level.')
+
+    parser.add_argument('--bw_page_size',
+                        type=int,
+                        default=30,
+                        help='Goals per page from the mock goals/filter endpoint.')
+
+    parser.add_argument('--latency',
+                        type=float,
+                        default=0.02,
+                        help='Seconds the mock servers wait before answering each request.')
+
+    parser.add_argument('--throttle_rate',
+                        type=float,
+                        default=0.0,
+                        help='Fraction of requests, chosen at random, answered with 429.')
+
+    parser.add_argument('--retry_after',
+                        type=float,
+                        default=0.5,
+                        help='Retry-After seconds sent with each 429.')
+
+    parser.add_argument('--max_workers',
+                        type=int,
+                        default=extract.GoalCrawler.DEFAULT_MAX_WORKERS,
+                        help='Maximum number of BetterWorks requests in flight at once.')
+
+    parser.add_argument('--compact_tree',
+                        action='store_true',
+                        help='Build extracted trees with the compact tree class.')
+
+    parser.add_argument('--seed',
+                        type=int,
+                        default=1,
+                        help='Random seed for 429 injection.')
+
+    parser.add_argument('--output',
+                        type=str,
+                        help='Save the results, with the settings and git commit, to this JSON file.')
+
+    parser.add_argument('--compare',
+                        type=str,
+                        help='Show the change from results saved earlier with --output.')
+
+    parser.add_argument('--debug',
+                        action='store_true',
+                        help="""Set true to see additional logging.""")
+
+    args = vars(parser.parse_args())
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)-8s %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S %z',
+        level=logging.DEBUG if args.get('debug') else logging.WARNING)
+
+    scenarios = set(args.get('scenarios'))
+    for name in list(scenarios):
+        while name in NEEDS:
+            name = NEEDS[name]
+            scenarios.add(name)
+    scenarios = [name for name in SCENARIOS if name in scenarios]
+
+    settings = {name: value for name, value in args.items()
+                if name not in ('scenarios', 'output', 'compare', 'debug')}
+
+    # spawn, not fork, so every scenario starts from a clean interpreter
+    # and its peak RSS is its own
+    context = multiprocessing.get_context('spawn')
+    ready = context.Queue()
+    server = context.Process(target=run_mock_server, args=(settings, ready), daemon=True)
+    server.start()
+    server_url, (airtable_records, bw_goals) = ready.get()
+    print(f'Mock Airtable base: {airtable_records} records; mock BetterWorks: {bw_goals} goals')
+
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        paths = {'airtable': 'airtable.snapshot', 'bw_user': 'bw_user.snapshot', 'convert_json': 'tree.json',
+                 'convert_ndjson': 'tree.ndjson', 'convert_csv': 'tree.csv', 'convert_text': 'tree.txt',
+                 'd3': 'tree.d3.json'}
+        config = dict(settings, server_url=server_url,
+                      paths={name: os.path.join(work_dir, path) for name, path in paths.items()},
+                      log_level=logging.DEBUG if args.get('debug') else logging.ERROR)
+        print(f'{"scenario":<16} {"nodes":>8} {"wall time":>10} {"requests":>9} {"429s":>6} {"peak RSS":>10}')
+        for name in scenarios:
+            queue = context.Queue()
+            process = context.Process(target=run_scenario, args=(name, config, queue))
+            process.start()
+            process.join()
+            if process.exitcode != 0:
+                server.terminate()
+                raise Exception(f'Scenario {name} failed with exit code {process.exitcode}')
+            result = dict(queue.get(), scenario=name)
+            stats = server_stats(server_url)
+            result.update(requests=stats['requests'], throttled=stats['throttled'],
+                          response_bytes=stats['bytes'])
+            results.append(result)
+            nodes = result['nodes'] if result['nodes'] is not None else ''
+            print(f'{name:<16} {nodes:>8} {result["wall_time"]:>9.2f}s {result["requests"]:>9} '
+                  f'{result["throttled"]:>6} {result["peak_rss"] / 2 ** 20:>8.1f}MB')
+    server.terminate()
+
+    if args.get('output'):
+        with open(args.get('output'), 'w') as output_file:
+            json.dump({'commit': git_commit(),
+                       'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                       'config': settings,
+                       'results': results}, output_file, indent=2)
+    if args.get('compare'):
+        with open(args.get('compare')) as baseline_file:
+            baseline = json.load(baseline_file)
+        compare(results, baseline)
+        if baseline.get('config') != settings:
+            print('Warning: the baseline was run with different settings.')
+
+
+if __name__ == '__main__':
+    main()
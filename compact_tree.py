@@ -0,0 +1,306 @@
+import array
+import json
+import sys
+import treelib
+
+
+def intern(value):
+    """
+    Intern strings, so repeated names, owners and node types are stored once.
+    """
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class CompactNode(object):
+    """
+    A lightweight view of one node in a CompactTree, with the attributes
+    of a treelib Node that the scripts use.  Views are made on demand
+    and hold no node state of their own.
+    """
+
+    __slots__ = ('tree', 'index')
+
+    def __init__(self, tree, index):
+        self.tree = tree
+        self.index = index
+
+    @property
+    def identifier(self):
+        return self.tree._ids[self.index]
+
+    @property
+    def tag(self):
+        return self.tree._tags[self.index]
+
+    @property
+    def data(self):
+        return self.tree._unpack(self.index)
+
+    def __lt__(self, other):
+        return self.tag < other.tag
+
+    def __repr__(self):
+        return f'CompactNode(tag={self.tag!r}, identifier={self.identifier!r})'
+
+
+class CompactTree(object):
+    """
+    A tree stored as parallel arrays indexed by node number, instead of
+    one treelib Node object (and data dict) per node.  Tags and string
+    data are interned.  Each node's data is kept as a tuple of values
+    plus a tuple of keys shared by every node with the same keys, and
+    turned back into a dict only when read.
+
+    Offers the parts of the treelib Tree interface that the scripts use,
+    raising the same treelib exceptions, so it can stand in for a Tree;
+    from_treelib() and to_treelib() convert between the two.  Removed
+    nodes leave unused slots behind rather than renumbering the rest.
+    """
+
+    DEPTH = treelib.Tree.DEPTH
+    WIDTH = treelib.Tree.WIDTH
+
+    def __init__(self):
+        self.root = None
+        self._ids = []
+        self._tags = []
+        self._parents = array.array('i')
+        # None for leaves, to save an empty list per node
+        self._children = []
+        self._data_keys = []
+        self._data_values = []
+        self._index = {}
+        # one tuple object per distinct set of data keys
+        self._key_tuples = {}
+
+    def _pack(self, index, data):
+        if data is None:
+            self._data_keys[index] = self._data_values[index] = None
+            return
+        keys = tuple(intern(key) for key in data)
+        self._data_keys[index] = self._key_tuples.setdefault(keys, keys)
+        self._data_values[index] = tuple(intern(value) for value in data.values())
+
+    def _unpack(self, index):
+        keys = self._data_keys[index]
+        return None if keys is None else dict(zip(keys, self._data_values[index]))
+
+    def _lookup(self, nid):
+        try:
+            return self._index[nid]
+        except KeyError:
+            raise treelib.exceptions.NodeIDAbsentError(f"Node '{nid}' is not in the tree")
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, nid):
+        return nid in self._index
+
+    def contains(self, nid):
+        return nid in self._index
+
+    def __getitem__(self, nid):
+        return CompactNode(self, self._lookup(nid))
+
+    def get_node(self, nid):
+        index = self._index.get(nid)
+        return None if index is None else CompactNode(self, index)
+
+    def create_node(self, tag=None, identifier=None, parent=None, data=None):
+        if identifier in self._index:
+            raise treelib.exceptions.DuplicatedNodeIdError(f"Can't create node with ID '{identifier}'")
+        if parent is None:
+            if self.root is not None:
+                raise treelib.exceptions.MultipleRootError('A tree takes one root merely.')
+            parent_index = -1
+        else:
+            parent_index = self._lookup(parent)
+        index = len(self._ids)
+        self._ids.append(identifier)
+        self._tags.append(intern(tag))
+        self._parents.append(parent_index)
+        self._children.append(None)
+        self._data_keys.append(None)
+        self._data_values.append(None)
+        self._pack(index, data)
+        self._index[identifier] = index
+        if parent_index < 0:
+            self.root = identifier
+        elif self._children[parent_index] is None:
+            self._children[parent_index] = [index]
+        else:
+            self._children[parent_index].append(index)
+        return CompactNode(self, index)
+
+    def update_node(self, nid, tag=None, data=None):
+        index = self._lookup(nid)
+        if tag is not None:
+            self._tags[index] = intern(tag)
+        if data is not None:
+            self._pack(index, data)
+
+    def children(self, nid):
+        return [CompactNode(self, child) for child in self._children[self._lookup(nid)] or ()]
+
+    def parent(self, nid):
+        parent = self._parents[self._lookup(nid)]
+        return None if parent < 0 else CompactNode(self, parent)
+
+    def move_node(self, source, destination):
+        index = self._lookup(source)
+        new_parent = self._lookup(destination)
+        if self.is_ancestor(source, destination):
+            raise treelib.exceptions.LoopError
+        old_parent = self._parents[index]
+        self._children[old_parent].remove(index)
+        self._parents[index] = new_parent
+        if self._children[new_parent] is None:
+            self._children[new_parent] = [index]
+        else:
+            self._children[new_parent].append(index)
+
+    def is_ancestor(self, ancestor, grandchild):
+        target = self._lookup(ancestor)
+        index = self._parents[self._lookup(grandchild)]
+        while index >= 0:
+            if index == target:
+                return True
+            index = self._parents[index]
+        return False
+
+    def remove_node(self, identifier):
+        """
+        Remove a node and all its descendents, and return how many were removed.
+        """
+        index = self._lookup(identifier)
+        parent = self._parents[index]
+        if parent >= 0:
+            self._children[parent].remove(index)
+        else:
+            self.root = None
+        removed = 0
+        stack = [index]
+        while stack:
+            index = stack.pop()
+            stack.extend(self._children[index] or ())
+            del self._index[self._ids[index]]
+            self._ids[index] = self._tags[index] = self._children[index] = None
+            self._data_keys[index] = self._data_values[index] = None
+            removed += 1
+        return removed
+
+    def _sorted_children(self, index, sorting=True):
+        children = self._children[index] or []
+        if sorting:
+            return sorted(children, key=self._tags.__getitem__)
+        return children
+
+    def expand_tree(self, nid=None, mode=DEPTH, sorting=True):
+        """
+        Yield the identifiers of nid and its descendents, depth first
+        (pre-order) or breadth first, with siblings in tag order unless
+        sorting is False.  Iterative, like the rest of this class.
+        """
+        start = self._lookup(self.root if nid is None else nid)
+        if mode == CompactTree.WIDTH:
+            queue = [start]
+            for index in queue:
+                yield self._ids[index]
+                queue.extend(self._sorted_children(index, sorting))
+        else:
+            stack = [start]
+            while stack:
+                index = stack.pop()
+                yield self._ids[index]
+                stack.extend(reversed(self._sorted_children(index, sorting)))
+
+    def all_nodes_itr(self):
+        return (CompactNode(self, index) for index in self._index.values())
+
+    def subtree(self, nid):
+        """
+        Return a new CompactTree holding copies of nid and its descendents.
+        """
+        new_tree = self.__class__.__new__(self.__class__)
+        CompactTree.__init__(new_tree)
+        for node_id in self.expand_tree(nid, mode=CompactTree.WIDTH, sorting=False):
+            index = self._index[node_id]
+            parent = None if node_id == nid else self._ids[self._parents[index]]
+            new_tree.create_node(self._tags[index], identifier=node_id, parent=parent,
+                                 data=self._unpack(index))
+        return new_tree
+
+    def to_dict(self, nid=None, with_data=False, sort=True):
+        """
+        The same nested dict as treelib's Tree.to_dict().
+        """
+        start = self._lookup(self.root if nid is None else nid)
+        result = []
+        stack = [(start, result)]
+        while stack:
+            index, siblings = stack.pop()
+            tag = self._tags[index]
+            children = self._sorted_children(index, sort)
+            data = self._unpack(index)
+            if children:
+                child_list = []
+                node_dict = {tag: {'children': child_list}}
+                if with_data:
+                    node_dict[tag]['data'] = data
+                stack.extend((child, child_list) for child in reversed(children))
+            elif with_data:
+                node_dict = {tag: {'data': data}}
+            else:
+                node_dict = tag
+            siblings.append(node_dict)
+        return result[0]
+
+    def to_json(self, with_data=False, sort=True):
+        return json.dumps(self.to_dict(with_data=with_data, sort=sort))
+
+    @classmethod
+    def from_treelib(cls, tree):
+        """
+        Return a CompactTree, or subclass, copy of a treelib Tree (or
+        anything else with root, get_node() and children(), such as a
+        Snapshot).  A subclass whose constructor creates a root node
+        gets that root's tag, identifier and data replaced.
+        """
+        new_tree = cls()
+        root = tree.get_node(tree.root)
+        if new_tree.root is None:
+            new_tree.create_node(root.tag, identifier=root.identifier, data=root.data)
+        else:
+            index = new_tree._index.pop(new_tree.root)
+            new_tree._ids[index] = new_tree.root = root.identifier
+            new_tree._index[root.identifier] = index
+            new_tree.update_node(root.identifier, tag=root.tag, data=root.data)
+        queue = [root.identifier]
+        for node_id in queue:
+            for child in tree.children(node_id):
+                new_tree.create_node(child.tag, identifier=child.identifier, parent=node_id, data=child.data)
+                queue.append(child.identifier)
+        return new_tree
+
+    def to_treelib(self, tree=None):
+        """
+        Copy this tree into tree, a new or root-only treelib Tree, and return it.
+        """
+        if tree is None:
+            tree = treelib.Tree()
+        root_index = self._index[self.root]
+        root_data = self.get_node(self.root).data
+        if tree.root is None:
+            tree.create_node(self._tags[root_index], identifier=self.root, data=root_data)
+        else:
+            tree.update_node(tree.root, tag=self._tags[root_index], data=root_data)
+            if tree.root != self.root:
+                tree.update_node(tree.root, identifier=self.root)
+        for node_id in self.expand_tree(mode=CompactTree.WIDTH, sorting=False):
+            if node_id == self.root:
+                continue
+            index = self._index[node_id]
+            tree.create_node(self._tags[index], identifier=node_id,
+                             parent=self._ids[self._parents[index]], data=self.get_node(node_id).data)
+        return tree
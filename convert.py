@@ -1,5 +1,12 @@
 import argparse
+import csv
+import datetime
+import json
+import os
+import logging
 import pickle
+import snapshot
+import sqlite3
 import treelib
 import sys
 
@@ -19,10 +26,455 @@ class RootedTree(treelib.Tree):
         self.create_node('root', identifier=RootedTree.ROOT_ID)
 
 
+class TreeWriter(object):
+    """
+    Base class for output formats that are written while the tree is
+    walked, rather than built up in memory first.  walk_tree() calls
+    enter() for each node on the way down and leave() on the way back
+    up.  parent_id is None for the root; is_last has one flag per level
+    below the root, saying whether the node at that level is the last of
+    its siblings; children is the node's children in output order.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def start(self):
+        pass
+
+    def enter(self, node, parent_id, is_last, children):
+        pass
+
+    def leave(self, node, children):
+        pass
+
+    def finish(self):
+        self.stream.flush()
+
+
+class JsonWriter(TreeWriter):
+    """
+    The same hierarchical JSON as treelib's to_json(with_data=True).
+    """
+
+    def __init__(self, stream):
+        super(JsonWriter, self).__init__(stream)
+        # for each open list of children, whether anything is in it yet
+        self.has_siblings = []
+
+    def enter(self, node, parent_id, is_last, children):
+        if self.has_siblings:
+            if self.has_siblings[-1]:
+                self.stream.write(', ')
+            self.has_siblings[-1] = True
+        tag = node.tag if isinstance(node.tag, str) else str(node.tag)
+        if children:
+            self.stream.write(f'{{{json.dumps(tag)}: {{"children": [')
+            self.has_siblings.append(False)
+        else:
+            self.stream.write(f'{{{json.dumps(tag)}: {{"data": {json.dumps(node.data)}}}}}')
+
+    def leave(self, node, children):
+        if children:
+            self.has_siblings.pop()
+            self.stream.write(f'], "data": {json.dumps(node.data)}}}}}')
+
+    def finish(self):
+        self.stream.write('\n')
+        super(JsonWriter, self).finish()
+
+
+class NdjsonWriter(TreeWriter):
+    """
+    One JSON object per node per line, each naming its parent.
+    """
+
+    def enter(self, node, parent_id, is_last, children):
+        self.stream.write(json.dumps({'id': node.identifier,
+                                      'name': node.tag,
+                                      'parent_id': parent_id,
+                                      'data': node.data}) + '\n')
+
+
+class CsvWriter(TreeWriter):
+    """
+    A flat list of nodes, with the parent of each.
+    """
+
+    COLUMNS = ['id', 'name', 'node_type', 'parent_id', 'owner', 'start', 'end']
+
+    def start(self):
+        self.writer = csv.writer(self.stream)
+        self.writer.writerow(CsvWriter.COLUMNS)
+
+    def enter(self, node, parent_id, is_last, children):
+        data = node.data or {}
+        self.writer.writerow([node.identifier, node.tag, data.get('node_type'), parent_id,
+                              data.get('owner'), data.get('start'), data.get('end')])
+
+
+class TextWriter(TreeWriter):
+    """
+    The same ascii-art tree as treelib's show().
+    """
+
+    def enter(self, node, parent_id, is_last, children):
+        if parent_id is None:
+            prefix = ''
+        else:
+            leading = ''.join('\u2502   ' if not last else '    ' for last in is_last[:-1])
+            prefix = leading + ('\u2514\u2500\u2500 ' if is_last[-1] else '\u251c\u2500\u2500 ')
+        self.stream.write(f'{prefix}{node.tag}\n')
+
+    def finish(self):
+        # show() ends with a blank line
+        self.stream.write('\n')
+        super(TextWriter, self).finish()
+
+
+class GraphvizWriter(TreeWriter):
+    """
+    The same dot graph as treelib's to_graphviz(shape='box'), written as
+    the tree is walked: each node is declared and its edge from its
+    parent drawn as it is entered, rather than every node and then every
+    edge, which dot doesn't mind.  A node walked under more than one
+    parent (see multi_parent) is declared once, with an edge from each
+    parent; a duplicated subtree adds no edges of its own the second
+    time, since they were drawn the first.
+    """
+
+    def __init__(self, stream):
+        super(GraphvizWriter, self).__init__(stream)
+        self.declared = set()
+        # depth of the duplicated subtree being walked again, if any
+        self.repeat_depth = None
+
+    def start(self):
+        self.stream.write('digraph tree {\n')
+
+    def enter(self, node, parent_id, is_last, children):
+        depth = len(is_last)
+        if self.repeat_depth is not None:
+            if depth > self.repeat_depth:
+                return
+            self.repeat_depth = None
+        if node.identifier in self.declared:
+            if not isinstance(node, ReferenceNode):
+                self.repeat_depth = depth
+        elif not isinstance(node, ReferenceNode):
+            # a ReferenceNode's node is declared when it's walked for real
+            self.declared.add(node.identifier)
+            tag = str(node.tag).replace('"', '\\"')
+            self.stream.write(f'\t"{node.identifier}" [label="{tag}", shape=box]\n')
+        if parent_id is not None:
+            self.stream.write(f'\t"{parent_id}" -> "{node.identifier}"\n')
+
+    def finish(self):
+        self.stream.write('}\n')
+        super(GraphvizWriter, self).finish()
+
+
+class SqliteWriter(TreeWriter):
+    """
+    Adds the tree to a SQLite database as one more snapshot, so that a
+    database can hold the history of many extractions.  Tables:
+
+    snapshots: one row per tree loaded, with its source file and times.
+        extracted_at is the tree's own sync time if it has one, or
+        else the source file's modification time.
+    nodes: one row per node, with its parent, depth, and the common data
+        fields as indexed columns (node_type, owner, start_date,
+        end_date, code), plus all of its data as JSON for
+        json_extract().
+    closure: one row per (ancestor, descendant) pair, including each
+        node paired with itself at distance 0, so subtree and rollup
+        queries are a join on an index rather than a recursive walk.
+
+    All rows carry the snapshot_id.  Indexes are created once the first
+    snapshot is in, which is quicker than keeping them up to date row
+    by row.
+    """
+
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS snapshots (
+               snapshot_id INTEGER PRIMARY KEY,
+               source TEXT,
+               extracted_at TEXT,
+               loaded_at TEXT)""",
+        # IDs are left untyped: Airtable's are strings, BetterWorks' integers
+        """CREATE TABLE IF NOT EXISTS nodes (
+               snapshot_id INTEGER NOT NULL REFERENCES snapshots,
+               id NOT NULL,
+               name TEXT,
+               parent_id,
+               depth INTEGER,
+               node_type TEXT,
+               owner TEXT,
+               start_date TEXT,
+               end_date TEXT,
+               code TEXT,
+               data TEXT,
+               PRIMARY KEY (snapshot_id, id))""",
+        """CREATE TABLE IF NOT EXISTS closure (
+               snapshot_id INTEGER NOT NULL REFERENCES snapshots,
+               ancestor_id NOT NULL,
+               descendant_id NOT NULL,
+               distance INTEGER NOT NULL,
+               PRIMARY KEY (snapshot_id, ancestor_id, descendant_id)) WITHOUT ROWID""",
+    ]
+
+    INDEXES = [
+        'CREATE INDEX IF NOT EXISTS nodes_parent ON nodes (snapshot_id, parent_id)',
+        'CREATE INDEX IF NOT EXISTS nodes_node_type ON nodes (snapshot_id, node_type)',
+        'CREATE INDEX IF NOT EXISTS nodes_owner ON nodes (snapshot_id, owner)',
+        'CREATE INDEX IF NOT EXISTS nodes_start_date ON nodes (snapshot_id, start_date)',
+        'CREATE INDEX IF NOT EXISTS nodes_end_date ON nodes (snapshot_id, end_date)',
+        'CREATE INDEX IF NOT EXISTS nodes_code ON nodes (snapshot_id, code)',
+        # one node across the history of snapshots
+        'CREATE INDEX IF NOT EXISTS nodes_id ON nodes (id, snapshot_id)',
+        'CREATE INDEX IF NOT EXISTS closure_descendant ON closure (snapshot_id, descendant_id, distance)',
+    ]
+
+    # rows to collect before each executemany
+    BATCH_SIZE = 10000
+
+    def __init__(self, connection, source, synced_at=None):
+        super(SqliteWriter, self).__init__(None)
+        self.connection = connection
+        self.source = source
+        self.synced_at = synced_at
+        self.snapshot_id = None
+        # identifiers from the root down to the node being entered
+        self.path = []
+        self.nodes = []
+        self.closure = []
+
+    def start(self):
+        for statement in SqliteWriter.SCHEMA:
+            self.connection.execute(statement)
+        extracted_at = self.synced_at or datetime.datetime.fromtimestamp(os.path.getmtime(self.source),
+                                                                         datetime.timezone.utc)
+        loaded_at = datetime.datetime.now(datetime.timezone.utc)
+        cursor = self.connection.execute(
+            'INSERT INTO snapshots (source, extracted_at, loaded_at) VALUES (?, ?, ?)',
+            (self.source, extracted_at.isoformat(), loaded_at.isoformat()))
+        self.snapshot_id = cursor.lastrowid
+
+    def enter(self, node, parent_id, is_last, children):
+        node_id = node.identifier
+        depth = len(is_last)
+        del self.path[depth:]
+        self.path.append(node_id)
+        data = node.data or {}
+        self.nodes.append((self.snapshot_id, node_id, str(node.tag), parent_id, depth,
+                           data.get('node_type'), data.get('owner'), data.get('start'), data.get('end'),
+                           data.get('code'), json.dumps(data)))
+        for distance, ancestor_id in enumerate(reversed(self.path)):
+            self.closure.append((self.snapshot_id, ancestor_id, node_id, distance))
+        if len(self.closure) >= SqliteWriter.BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        # A node walked under more than one parent (see multi_parent) is
+        # stored once, with closure rows for every path to it
+        self.connection.executemany('INSERT OR IGNORE INTO nodes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', self.nodes)
+        self.connection.executemany('INSERT OR IGNORE INTO closure VALUES (?, ?, ?, ?)', self.closure)
+        self.nodes.clear()
+        self.closure.clear()
+
+    def finish(self):
+        self.flush()
+        for statement in SqliteWriter.INDEXES:
+            self.connection.execute(statement)
+        self.connection.commit()
+
+
+def write_sqlite(input_files, database, multi_parent='first'):
+    """
+    Add each tree in input_files to the SQLite database as a snapshot.
+    """
+    connection = sqlite3.connect(database)
+    try:
+        for input_file in input_files:
+            tree = load_tree(input_file)
+            writer = SqliteWriter(connection, input_file, tree_synced_at(tree))
+            walk_tree(tree, [writer], multi_parent)
+            logging.info(f'Added {input_file} to {database} as snapshot {writer.snapshot_id}')
+    finally:
+        connection.close()
+
+
+MULTI_PARENT_MODES = ['first', 'duplicate', 'reference']
+
+
+class ReferenceNode(object):
+    """
+    Stands in for a node under one of its other parents when
+    multi_parent is 'reference': the same identifier and tag, no
+    children, and data naming the node it refers to.
+    """
+
+    def __init__(self, node):
+        self.identifier = node.identifier
+        self.tag = node.tag
+        self.data = {'reference': node.identifier}
+
+
+def children_function(tree, multi_parent='first'):
+    """
+    Return a function giving a node's children in tag order, as treelib
+    sorts them.  Airtable records linked to more than one parent are
+    stored once, under the first, with the others listed in their data
+    as other_parent_ids.  multi_parent says what to do with those:
+    'first' ignores them, 'duplicate' repeats the node and its whole
+    subtree under each as it is walked, and 'reference' puts a
+    ReferenceNode under each.  Links only point up to the table above,
+    so duplicating can't loop.
+    """
+    # parent ID -> nodes that list it in other_parent_ids
+    other_children = {}
+    if multi_parent != 'first':
+        for node in tree.all_nodes_itr():
+            for parent_id in (node.data or {}).get('other_parent_ids', ()):
+                if parent_id in tree:
+                    other_children.setdefault(parent_id, []).append(node)
+
+    def sorted_children(node):
+        if isinstance(node, ReferenceNode):
+            return []
+        children = tree.children(node.identifier)
+        others = other_children.get(node.identifier)
+        if others:
+            if multi_parent == 'reference':
+                others = [ReferenceNode(other) for other in others]
+            children = children + others
+        return sorted(children, key=lambda child: child.tag)
+
+    return sorted_children
+
+
+def walk_tree(tree, writers, multi_parent='first'):
+    """
+    Walk the tree depth first, with each node's children in tag order
+    as treelib sorts them, feeding every writer as it goes.  Iterative,
+    so deep trees can't hit the recursion limit.  See children_function
+    for multi_parent.
+    """
+    sorted_children = children_function(tree, multi_parent)
+
+    for writer in writers:
+        writer.start()
+
+    root = tree.get_node(tree.root)
+    children = sorted_children(root)
+    for writer in writers:
+        writer.enter(root, None, [], children)
+    stack = [(root, children, iter(enumerate(children)), [])]
+    while stack:
+        node, children, remaining, is_last = stack[-1]
+        next_child = next(remaining, None)
+        if next_child is None:
+            stack.pop()
+            for writer in writers:
+                writer.leave(node, children)
+            continue
+        index, child = next_child
+        child_is_last = is_last + [index == len(children) - 1]
+        grandchildren = sorted_children(child)
+        for writer in writers:
+            writer.enter(child, node.identifier, child_is_last, grandchildren)
+        stack.append((child, grandchildren, iter(enumerate(grandchildren)), child_is_last))
+
+    for writer in writers:
+        writer.finish()
+
+
+def load_tree(input_file):
+    """
+    Open a tree saved by extract.py.  Snapshot files are read lazily
+    through mmap; older pickled Treelib files are still accepted, but
+    unpickling runs arbitrary code, so only load ones you made yourself.
+    """
+    if snapshot.is_snapshot(input_file):
+        return snapshot.Snapshot(input_file)
+    logging.warning(f'{input_file} is a legacy pickle file; re-run extract.py to get a snapshot')
+    with open(input_file, 'rb') as file:
+        return pickle.load(file)
+
+
+def tree_synced_at(tree):
+    """
+    Return when tree was extracted, as extract.py recorded it, or None
+    for trees saved without a sync time.
+    """
+    if isinstance(tree, snapshot.Snapshot):
+        synced_at = tree.metadata.get('synced_at')
+        return datetime.datetime.fromisoformat(synced_at) if synced_at else None
+    return getattr(tree, 'synced_at', None)
+
+
+WRITERS = {'json': JsonWriter,
+           'ndjson': NdjsonWriter,
+           'csv': CsvWriter,
+           'text': TextWriter,
+           'graphviz': GraphvizWriter}
+
+OUTPUT_TYPES = list(WRITERS) + ['d3', 'sqlite']
+
+
+def write_outputs(input_file, outputs, multi_parent='first', trim=30, max_depth=None, overload_name=False):
+    """
+    Load input_file once and write it in every (output type, path) of
+    outputs from a single walk of the tree.  A path of '-' is stdout.
+    sqlite adds the tree to the database at path, as write_sqlite does.
+    trim, max_depth and overload_name are for d3, as in
+    treelib_json_to_d3.py.
+    """
+    tree = load_tree(input_file)
+    if not tree:
+        raise Exception(f'Could not load anything from {input_file}')
+
+    writers = []
+    files = []
+    try:
+        for output_type, path in outputs:
+            if output_type == 'sqlite':
+                connection = sqlite3.connect(path)
+                files.append(connection)
+                writers.append(SqliteWriter(connection, input_file, tree_synced_at(tree)))
+                continue
+            if path == '-':
+                stream = sys.stdout
+            else:
+                # csv writes its own line endings
+                stream = open(path, 'w', encoding='utf-8', newline='' if output_type == 'csv' else None)
+                files.append(stream)
+            if output_type == 'd3':
+                # imported here, since treelib_json_to_d3 imports this module
+                import treelib_json_to_d3
+                writers.append(treelib_json_to_d3.D3Writer(stream, trim, max_depth, overload_name))
+            else:
+                writers.append(WRITERS[output_type](stream))
+        walk_tree(tree, writers, multi_parent)
+    finally:
+        for file in files:
+            file.close()
+
+
+def exit_on_broken_pipe():
+    """
+    Exit after stdout's reader, e.g. head, stopped early.  stdout is
+    pointed at devnull first so the interpreter doesn't fail flushing it
+    at exit.
+    """
+    os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    sys.exit(1)
+
+
 def main():
     """
-    Load a pickled Treelib file and output it in any of several forms: JSON,
-    csv, text, or Graphviz dot.
+    Load a tree snapshot file and output it in any of several forms: JSON,
+    csv, text, Graphviz dot, d3 json or SQLite, or several of them at once.
     """
     ######################################################################
     # Initialize
@@ -33,18 +485,61 @@ def main():
     parser.add_argument('input_file',
                         type=str,
                         nargs='+',
-                        help="""Name of serialized treelib json file.""")
+                        help="""Name of tree snapshot file from extract.py.""")
 
     parser.add_argument('--output_type',
-                        choices=['text', 'json', 'csv', 'graphviz'],
+                        choices=OUTPUT_TYPES,
                         default='json',
                         help="""Output format; pipe to file to
                         save. Text is an ascii-art representation of a
                         tree.  JSON is a complete data dump in
                         hierarchical JSON, including all node data.
+                        ndjson is one JSON object per node per line.
                         csv is a flattened dump of all nodes, i.e.,
                         with parent node for each row.  Graphviz is the
-                        dot file format.""")
+                        dot file format.  d3 is the json treelib_json_to_d3.py
+                        writes; see --trim and --max_depth.  sqlite adds every input file to
+                        the database in --output_file as a snapshot, with
+                        indexed columns and an ancestor/descendant table
+                        for querying subtrees.""")
+
+    parser.add_argument('--multi_parent',
+                        choices=MULTI_PARENT_MODES,
+                        default='first',
+                        help="""What to do with Airtable records linked to more than one
+                        parent, which are stored once under the first: show them only
+                        there (first), repeat them and their subtrees under every
+                        parent (duplicate), or put a reference node naming them under
+                        the other parents (reference).  For sqlite, duplicate stores
+                        each node once with every path to it in the closure table.""")
+
+    parser.add_argument('--output_file',
+                        type=str,
+                        help="""SQLite database for --output_type sqlite.  Created
+                        if missing; otherwise the new snapshots are added to
+                        those already in it.""")
+
+    parser.add_argument('--output',
+                        nargs=2,
+                        action='append',
+                        metavar=('TYPE', 'PATH'),
+                        help="""Write the tree as TYPE (any --output_type) to PATH, or to
+                        stdout if PATH is -.  Repeat for more outputs; the tree is
+                        loaded and walked once for all of them.  Overrides
+                        --output_type.""")
+
+    parser.add_argument('--trim',
+                        type=int,
+                        help='For d3, limit node titles to this many characters.',
+                        default=30)
+
+    parser.add_argument('--max_depth',
+                        type=int,
+                        help='For d3, truncate the tree after this many levels.')
+
+    parser.add_argument('--overload_name',
+                        action='store_true',
+                        help='For d3, prefix node names with their node type and owner.')
 
     args = vars(parser.parse_args())
     input_file = args.get('input_file')[0]
@@ -59,43 +554,28 @@ def main():
             'Specify an input file.'
         )
 
-    with open(input_file, 'r') as file:
-        result_tree = pickle.load(open(input_file, 'rb'))
-
-    breakpoint()
-    if not result_tree:
-        raise Exception(f'Could not load anything from {file}')
-
-    if output_type == 'json':
-        print(result_tree.to_json(with_data=True))
-    elif output_type == 'csv':
-        import csv
-        nodes = result_tree.nodes
-        writer = csv.writer(sys.stdout)
-        writer.writerow(['id', 'name', 'node_type', 'parent_id', 'owner', 'start', 'end'])
-        for key in nodes.keys():
-            node = nodes[key]
-            id = node.identifier
-            name = node.tag
-            if id != -1:
-                parent_id = result_tree.parent(id).identifier
-            else:
-                parent_id = None
-            node_type = None
-            owner = None
-            start = None
-            end = None
-            if node.data:
-                node_type = node.data.get('node_type')
-                owner = node.data.get('owner')
-                start = node.data.get('start')
-                end = node.data.get('end')
-            row = [id, name, node_type, parent_id, owner, start, end]
-            writer.writerow(row)
-    elif output_type == 'graphviz':
-        result_tree.to_graphviz(shape=u'box')
+    outputs = args.get('output')
+    if outputs:
+        for output_type, path in outputs:
+            if output_type not in OUTPUT_TYPES:
+                parser.error(f'--output type must be one of {", ".join(OUTPUT_TYPES)}, not {output_type!r}')
+            if output_type == 'sqlite' and path == '-':
+                parser.error('--output sqlite needs a database file, not -')
+        if len(args.get('input_file')) > 1:
+            parser.error('--output takes a single input file')
+    elif output_type == 'sqlite':
+        if not args.get('output_file'):
+            raise Exception('--output_type sqlite needs a database file in --output_file')
+        write_sqlite(args.get('input_file'), args.get('output_file'), args.get('multi_parent'))
+        return
     else:
-        result_tree.show()
+        outputs = [(output_type, '-')]
+
+    try:
+        write_outputs(input_file, outputs, args.get('multi_parent'),
+                      args.get('trim'), args.get('max_depth'), args.get('overload_name'))
+    except BrokenPipeError:
+        exit_on_broken_pipe()
 
 
 if __name__ == '__main__':
@@ -72,15 +72,27 @@ treeJSON = d3.json("flare.json", function(error, treeData) {
         }
     }
 
-    // Call visit function to establish maxLabelLength
-    visit(treeData, function(d) {
-        totalNodes++;
-        maxLabelLength = Math.max(d.name.length, maxLabelLength);
-        d.name += d.children ? '  ' + '◼️'.repeat(d.children.length) : '';
+    // Nodes cut off by treelib_json_to_d3.py --shard_dir have a "shard"
+    // file holding their children, fetched the first time they are expanded
 
-    }, function(d) {
-        return d.children && d.children.length > 0 ? d.children : null;
-    });
+    function hasHiddenChildren(d) {
+        return d._children || d.shard;
+    }
+
+    // Establish maxLabelLength and mark each node with its child count
+
+    function prepareNodes(subtree) {
+        visit(subtree, function(d) {
+            totalNodes++;
+            maxLabelLength = Math.max(d.name.length, maxLabelLength);
+            var childCount = d.children ? d.children.length : (d.child_count || 0);
+            d.name += childCount ? '  ' + '◼️'.repeat(childCount) : '';
+
+        }, function(d) {
+            return d.children && d.children.length > 0 ? d.children : null;
+        });
+    }
+    prepareNodes(treeData);
 
 
     // sort the tree according to the node names
@@ -359,11 +371,40 @@ treeJSON = d3.json("flare.json", function(error, treeData) {
 
     function click(d) {
         if (d3.event.defaultPrevented) return; // click suppressed
+        if (d.shard) {
+            loadShard(d);
+            return;
+        }
         d = toggleChildren(d);
         update(d);
         centerNode(d);
     }
 
+    // Fetch the children of a sharded node, show them, and collapse
+    // everything below them as the initial tree is collapsed.
+
+    function loadShard(d) {
+        var shard = d.shard;
+        d.shard = null;
+        d3.json(shard, function(error, children) {
+            if (error) {
+                console.error("could not load " + shard, error);
+                d.shard = shard;
+                return;
+            }
+            children.forEach(function(child) {
+                prepareNodes(child);
+                collapse(child);
+            });
+            // keep any nodes dropped onto d before it was loaded
+            d.children = (d.children || d._children || []).concat(children);
+            d._children = null;
+            sortTree();
+            update(d);
+            centerNode(d);
+        });
+    }
+
     function update(source) {
         // Compute the new height, function counts total children of root node and sets tree height accordingly.
         // This prevents the layout looking squashed when new nodes are made visible or looking sparse when nodes are removed
@@ -415,17 +456,17 @@ treeJSON = d3.json("flare.json", function(error, treeData) {
             .attr('class', 'nodeCircle')
             .attr("r", 0)
             .style("fill", function(d) {
-                return d._children ? "lightsteelblue" : "#fff";
+                return hasHiddenChildren(d) ? "lightsteelblue" : "#fff";
             });
 
         nodeEnter.append("text")
             .attr("x", function(d) {
-                return d.children || d._children ? -10 : 10;
+                return d.children || hasHiddenChildren(d) ? -10 : 10;
             })
             .attr("dy", ".35em")
             .attr('class', 'nodeText')
             .attr("text-anchor", function(d) {
-                return d.children || d._children ? "end" : "start";
+                return d.children || hasHiddenChildren(d) ? "end" : "start";
             })
             .text(function(d) {
                 return d.name;
@@ -449,10 +490,10 @@ treeJSON = d3.json("flare.json", function(error, treeData) {
         // Update the text to reflect whether node has children or not.
         node.select('text')
             .attr("x", function(d) {
-                return d.children || d._children ? -10 : 10;
+                return d.children || hasHiddenChildren(d) ? -10 : 10;
             })
             .attr("text-anchor", function(d) {
-                return d.children || d._children ? "end" : "start";
+                return d.children || hasHiddenChildren(d) ? "end" : "start";
             })
             .text(function(d) {
                 return d.name;
@@ -462,7 +503,7 @@ treeJSON = d3.json("flare.json", function(error, treeData) {
         node.select("circle.nodeCircle")
             .attr("r", 4.5)
             .style("fill", function(d) {
-                return d._children ? "lightsteelblue" : "#fff";
+                return hasHiddenChildren(d) ? "lightsteelblue" : "#fff";
             });
 
         // Transition nodes to their new position.
@@ -1,27 +1,53 @@
 import argparse
+import compact_tree
+import concurrent.futures
+import datetime
+import http_cache
+import http_client
+import json
 import logging
 import os
 import pprint
-import requests
+import profiling
+import queue
+import snapshot
 import sys
+import threading
+import time
 import treelib
 
+AIRTABLE_API_URL = 'https://api.airtable.com/v0'
+BETTERWORKS_API_URL = 'https://app.betterworks.com/api/v1'
+
+# How long, in seconds, a cached response from each source stays fresh
+CACHE_TTL = {'airtable': 60 * 60,
+             'betterworks': 60 * 60}
+
+# Airtable allows 5 requests per second per base
+AIRTABLE_REQUESTS_PER_SECOND = 5
+
 
 class Goal(object):
     """
     This is a partial representation of a BetterWorks Goal.  All items
     in BetterWorks are called goals in the API, regardless of UI
-    presentation, so follow that convention here.
+    presentation, so follow that convention here.  Only the IDs of the
+    children are kept, not their API payloads, and they are saved in
+    the node data whether or not the children end up in the tree.
+    modified is the goal's modification stamp, if the API gave one.
     """
 
-    def __init__(self, id, name, parent_id, children, owner, start, end, is_key_result=False):
+    __slots__ = ('name', 'id', 'parent_id', 'child_ids', 'owner', 'start', 'end', 'node_type', 'modified')
+
+    def __init__(self, id, name, parent_id, children, owner, start, end, is_key_result=False, modified=None):
         self.name = name
         self.id = id
         self.parent_id = parent_id
-        self.children = children
+        self.child_ids = tuple(int(child['id']) for child in children or ())
         self.owner = owner
         self.start = start
         self.end = end
+        self.modified = modified
         if is_key_result:
             self.node_type = 'Key Result'
         else:
@@ -37,7 +63,9 @@ class Goal(object):
                 'parent_id': self.parent_id,
                 'owner': self.owner,
                 'start': self.start,
-                'end': self.end}
+                'end': self.end,
+                'modified': self.modified,
+                'child_ids': list(self.child_ids)}
 
 
 class RootedTree(treelib.Tree):
@@ -53,218 +81,756 @@ class RootedTree(treelib.Tree):
     def __init__(self):
         super(RootedTree, self).__init__()
         self.create_node('root', identifier=RootedTree.ROOT_ID)
+        # When the tree's source was last read, if the source supports
+        # incremental syncs
+        self.synced_at = None
 
 
-def get_airtable_table(table):
+class CompactRootedTree(compact_tree.CompactTree):
     """
-    Returns a list of records from an Airtable table.  Each record
-    is a json object.
+    A RootedTree kept in a CompactTree's arrays instead of treelib
+    objects, for extractions too big to hold comfortably otherwise.
+    """
+
+    ROOT_ID = RootedTree.ROOT_ID
+
+    def __init__(self):
+        super(CompactRootedTree, self).__init__()
+        self.create_node('root', identifier=RootedTree.ROOT_ID)
+        self.synced_at = None
+
+
+# The tree class main() builds results in; see --compact_tree
+tree_class = RootedTree
+
+# Timings and counts for this run; see --profile
+run_profile = profiling.RunProfile()
+
+
+def save_tree(result_tree, path):
+    """
+    Save a tree, and when its source was last synced, as a snapshot file.
+    """
+    metadata = {}
+    if getattr(result_tree, 'synced_at', None):
+        metadata['synced_at'] = result_tree.synced_at.isoformat()
+    snapshot.write_snapshot(result_tree, path, metadata)
+
+
+def load_tree(path):
+    """
+    Load a snapshot file saved by save_tree() as a RootedTree, or a
+    CompactRootedTree if that is what this run uses.
+    """
+    saved = snapshot.Snapshot(path)
+    if tree_class is CompactRootedTree:
+        result_tree = CompactRootedTree.from_treelib(saved)
+    else:
+        result_tree = saved.to_tree(RootedTree())
+    synced_at = saved.metadata.get('synced_at')
+    if synced_at:
+        result_tree.synced_at = datetime.datetime.fromisoformat(synced_at)
+    saved.close()
+    return result_tree
+
+
+class Checkpoint(object):
+    """
+    The progress of a long extraction, kept in a file so that a run that
+    dies part way through can be carried on with --resume instead of
+    started again.  The file is a line of JSON with key, which describes
+    the extraction, then one line per entry the extraction add()s as it
+    goes: a page of Airtable records, or a BetterWorks goal.  Entries are
+    only ever appended, and flushed at most every interval seconds, so
+    nothing is written twice or kept in memory for the next save.
+
+    With resume, entries() yields those an earlier run with the same key
+    saved, and add() appends after them.  A last line cut short by a crash
+    is dropped.
+    """
+
+    DEFAULT_INTERVAL = 60
+
+    def __init__(self, path, key, interval=DEFAULT_INTERVAL, resume=False):
+        self.path = path
+        self.key = key
+        self.interval = interval
+        self.resume = resume
+        self.file = None
+        # where the entries an earlier run saved end, once read
+        self.end = None
+        self.saved_at = time.monotonic()
+
+    @staticmethod
+    def parse(line):
+        if not line.endswith(b'\n'):
+            return None
+        try:
+            return json.loads(line)
+        except ValueError:
+            return None
+
+    def entries(self):
+        """
+        Yield the entries saved by an earlier run, if resuming and there
+        is one.  Call it, to the end, before add().
+        """
+        if not self.resume:
+            return
+        try:
+            file = open(self.path, 'rb')
+        except FileNotFoundError:
+            logging.warning(f'No checkpoint in {self.path}; starting from the beginning')
+            return
+        with file:
+            header = self.parse(file.readline())
+            if header is None:
+                logging.warning(f'{self.path} is empty or unreadable; starting from the beginning')
+                return
+            if header.get('key') != self.key:
+                raise Exception(f'{self.path} is a checkpoint for a different extraction: {header.get("key")}')
+            logging.info(f'Resuming from {self.path}')
+            self.end = file.tell()
+            for line in file:
+                entry = self.parse(line)
+                if entry is None:
+                    logging.warning(f'Dropping an incomplete entry at the end of {self.path}')
+                    break
+                self.end += len(line)
+                yield entry
+
+    def add(self, entry):
+        """
+        Append an entry, flushing the file if interval seconds have
+        passed since it was last flushed.
+        """
+        if self.file is None:
+            if self.end is None:
+                self.file = open(self.path, 'wb')
+                self.file.write(json.dumps({'key': self.key}).encode() + b'\n')
+            else:
+                self.file = open(self.path, 'r+b')
+                self.file.truncate(self.end)
+                self.file.seek(self.end)
+        self.file.write(json.dumps(entry).encode() + b'\n')
+        run_profile.count('checkpoint', 'entries')
+        if time.monotonic() - self.saved_at >= self.interval:
+            self.save()
+
+    def save(self):
+        """
+        Flush the entries added so far to the file.
+        """
+        if self.file is None:
+            return
+        self.file.flush()
+        self.saved_at = time.monotonic()
+        run_profile.count('checkpoint', 'saves')
+        logging.debug(f'Saved checkpoint {self.path}')
+
+    def close(self):
+        if self.file is not None:
+            self.save()
+            self.file.close()
+            self.file = None
+
+    def remove(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def configure_clients(airtable_api_key=None, betterworks_api_token=None, cache=None):
+    """
+    Set up the module's API clients, one per service, for the rest of
+    the run.
+    """
+    global airtable_client
+    airtable_client = http_client.ServiceClient(
+        'airtable',
+        AIRTABLE_API_URL,
+        {'Authorization': f'Bearer {airtable_api_key}'},
+        rate_limiter=http_client.TokenBucket(AIRTABLE_REQUESTS_PER_SECOND),
+        cache=cache,
+        cache_ttl=CACHE_TTL['airtable'])
+
+    global betterworks_client
+    betterworks_client = http_client.ServiceClient(
+        'betterworks',
+        BETTERWORKS_API_URL,
+        {'Authorization': f'APIToken {betterworks_api_token}'},
+        cache=cache,
+        cache_ttl=CACHE_TTL['betterworks'])
+
+    run_profile.add_client(airtable_client)
+    run_profile.add_client(betterworks_client)
+
+
+def iter_airtable_pages(table, params=None, offset=None, cached=True):
+    """
+    Yield the records of an Airtable table a page at a time, as each
+    page arrives, with the offset of the next page, or None after the
+    last.  Each record is a json object.  params, if given, are sent
+    with every page request, e.g. to filter or project the records.
+    cached=False bypasses the response cache.
+
+    offset, from an earlier run, starts from that page instead of the
+    first.  Airtable offsets expire, so if it is refused, the table is
+    fetched from the start and records from before offset come again.
     """
 
-    url = f'https://api.airtable.com/v0/{base_id}/{table}'
+    url = f'{base_id}/{table}'
     # Because Airtable truncates any response at 100 items, be
     # ready to handle potential pagination.
-    expect_more_results = True
-    result_list = []
-    params = None
-    while expect_more_results:
-        logging.debug(f'making request to {url} with airtable_headers\
-        {airtable_headers} and params {params}')
-        response = requests.get(url, headers=airtable_headers, params=params)
-        results = response.json()['records']
-        if results:
-            result_list.extend(results)
-        else:
-            e = response.get('reason', 'reason not specified')
+    resuming = bool(offset)
+    page_params = dict(params or {}, offset=offset) if offset else params
+    while True:
+        response = airtable_client.get_json(url, page_params, cached=cached)
+        results = response.get('records')
+        if results is None:
+            e = response.get('error', 'reason not specified')
+            if resuming:
+                logging.warning(f'Could not resume {table} from its saved offset ({e}); fetching it from the start')
+                resuming = False
+                page_params = params
+                continue
             raise Exception(f'Table retrieval search failed for reason {e}')
+        resuming = False
+        run_profile.count('airtable pages', table)
+        run_profile.count('airtable records', table, len(results))
+        offset = response.get('offset')
+        yield results, offset
 
-        offset = response.json().get('offset')
-        if offset:
-            params = {'offset': offset}
-        else:
-            expect_more_results = False
-
-    return result_list
+        if not offset:
+            return
+        page_params = dict(params or {}, offset=offset)
 
 
-def get_airtable_tree(result_tree=RootedTree()):
+def get_airtable_table(table, params=None, cached=True):
     """
-    Retrieve a work breakdown tree from Airtable.  The specific table
-    and relationship structure is hard-coded into this function.  each
-    table has a list of children and the matching table has a list of
-    parents.  Working from the top down, by adding children, means
-    adding placeholder nodes that have to be updated later.  And the
-    children field won't be present in the API results (without extra
-    hoops) if the child field is hidden in the default view.  Working
-    as we go, meaning to add all nodes in one level, and then go to the
-    next table/level and add all those nodes, et al, seems simpler and
-    for Airtable requires no extra API calls.  So let's do that.
+    Returns a list of records from an Airtable table.  Each record
+    is a json object.  params and cached are as for iter_airtable_pages.
     """
+    return [record for page, offset in iter_airtable_pages(table, params, cached=cached) for record in page]
 
-    base_name = base_id
-    url = f'https://api.airtable.com/v0/meta/bases'
-    logging.debug(f'making request to {url} with airtable_headers {airtable_headers}')
-    response = requests.get(url, headers=airtable_headers)
-    results = response.json()['bases']
-    if results:
-        # assume that if anything comes back, it is a valid api response and base_id is unique
-        base_dict = [base for base in results if base['id'] in base_id]
-        base_name = base_dict[0]['name']
-    root_node = result_tree.get_node(RootedTree.ROOT_ID)
-    root_node.tag = base_name
 
-    ######################################################################
-    # Priorities
-    ######################################################################
+def iter_airtable_tables(tables, params=None, offsets=None):
+    """
+    Fetch the tables at once, a thread each under the shared rate limit,
+    and yield (table, page of records, offset of the next page) as pages
+    come in from any of them, so the caller can work on one page while
+    the next downloads.  Only the fields in AIRTABLE_FIELDS are
+    requested.  offsets may give a table -> offset to carry on from, as
+    for iter_airtable_pages.
+
+    A failed fetch is raised here, as is anything raised while waiting,
+    such as KeyboardInterrupt.  The other tables then stop after the
+    page they are on, and the pages already downloaded are yielded
+    before the exception, so the caller can still keep them.
+    """
+    pages = queue.Queue()
+    offsets = offsets or {}
+    stop = threading.Event()
+
+    def fetch(table):
+        try:
+            table_params = dict(params or {}, **{'fields[]': AIRTABLE_FIELDS[table]})
+            for page, offset in iter_airtable_pages(table, table_params, offsets.get(table)):
+                pages.put((table, page, offset))
+                if stop.is_set():
+                    return
+            pages.put((table, None, None))
+        except BaseException as e:
+            pages.put((table, e, None))
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(len(tables), 1))
+    try:
+        for table in tables:
+            executor.submit(fetch, table)
+        remaining = len(tables)
+        while remaining:
+            table, page, offset = pages.get()
+            if page is None:
+                remaining -= 1
+            elif isinstance(page, BaseException):
+                raise page
+            else:
+                yield table, page, offset
+    except GeneratorExit:
+        raise
+    except BaseException:
+        stop.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+        while True:
+            try:
+                table, page, offset = pages.get_nowait()
+            except queue.Empty:
+                break
+            if page is not None and not isinstance(page, BaseException):
+                yield table, page, offset
+        raise
+    finally:
+        # also when the caller stops early
+        stop.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+# The Airtable tables to extract, in parent-before-child order.  For each:
+#   table: the table name in the base
+#   node_type: the node_type its nodes get
+#   label: the prefix for node names when ADD_NODE_TYPE_IN_NAME is set
+#   name_field: the field holding the node name; default_name, if given,
+#     is used when it is missing, otherwise the record is an error
+#   code_field: optional field with a short code, put in the name and data
+#   parent_table, parent_field: the table each record hangs from and the
+#     link field pointing there; None for the top table
+#   data_fields: node data key -> field, for anything else to keep
+# Only these fields are downloaded.  --airtable_schema replaces this with
+# the same structure read from a JSON file.
+AIRTABLE_SCHEMA = [
+    {'table': 'Priorities',
+     'node_type': 'MTP Priority',
+     'label': 'Priority',
+     'name_field': 'ID',
+     'parent_table': None,
+     'parent_field': None},
+    {'table': 'Outcomes',
+     'node_type': 'MTP Outcome',
+     'label': 'Outcome',
+     'name_field': 'Name',
+     'code_field': 'ID',
+     'parent_table': 'Priorities',
+     'parent_field': 'Priority',
+     'data_fields': {'department': 'Department'}},
+    {'table': 'KDs',
+     'node_type': 'MTP Key Deliverable',
+     'label': 'KD',
+     'name_field': 'KD Budget Name',
+     'code_field': 'K-ID',
+     'parent_table': 'Outcomes',
+     'parent_field': 'Outcome',
+     'data_fields': {'description': 'KD Description'}},
+    {'table': 'Projects',
+     'node_type': 'Projects',
+     'label': 'Project',
+     'name_field': 'Project Name',
+     'default_name': 'no name',
+     'parent_table': 'KDs',
+     'parent_field': 'KD'},
+    {'table': 'Activities',
+     'node_type': 'Activities',
+     'label': 'Activity',
+     'name_field': 'Activity',
+     'default_name': 'no name',
+     'parent_table': 'KDs',
+     'parent_field': 'KeyDeliverable'},
+]
+
+
+def set_airtable_schema(schema):
+    """
+    Use schema, in the form of AIRTABLE_SCHEMA, for the rest of the run,
+    and set up the lookups derived from it.
+    """
+    tables = []
+    for table_schema in schema:
+        parent_table = table_schema.get('parent_table')
+        if parent_table is not None and parent_table not in tables:
+            raise Exception(f'Airtable schema lists {table_schema["table"]} before its parent table {parent_table}')
+        tables.append(table_schema['table'])
+
+    global AIRTABLE_SCHEMA, AIRTABLE_TABLE_SCHEMAS, AIRTABLE_TABLES, AIRTABLE_NODE_TYPES
+    global AIRTABLE_PARENT_TABLES, AIRTABLE_NAME_FIELDS, AIRTABLE_FIELDS
+    AIRTABLE_SCHEMA = schema
+    AIRTABLE_TABLE_SCHEMAS = {table_schema['table']: table_schema for table_schema in schema}
+    AIRTABLE_TABLES = tables
+    AIRTABLE_NODE_TYPES = {table_schema['table']: table_schema['node_type'] for table_schema in schema}
+    AIRTABLE_PARENT_TABLES = {table_schema['table']: table_schema.get('parent_table') for table_schema in schema}
+    AIRTABLE_NAME_FIELDS = {table_schema['table']: table_schema['name_field'] for table_schema in schema}
+    # the fields[] to ask for from each table
+    AIRTABLE_FIELDS = {}
+    for table_schema in schema:
+        fields = [table_schema['name_field'], table_schema.get('code_field'), table_schema.get('parent_field')]
+        fields.extend(table_schema.get('data_fields', {}).values())
+        AIRTABLE_FIELDS[table_schema['table']] = [field for field in fields if field]
+
+
+set_airtable_schema(AIRTABLE_SCHEMA)
+
+# How far back before the last sync to look for modified records, to
+# allow for clock skew between us and Airtable
+AIRTABLE_SYNC_OVERLAP = datetime.timedelta(minutes=5)
+
+
+def airtable_record_to_node(table, record):
+    """
+    Return the name, parent ID and data for an Airtable record, given
+    the table it came from, following that table's AIRTABLE_SCHEMA
+    entry.  Any parents after the first are listed in the data as
+    other_parent_ids.
+    """
+    table_schema = AIRTABLE_TABLE_SCHEMAS[table]
+    fields = record['fields']
 
-    priorities = get_airtable_table('Priorities')
-    for priority in priorities:
-        id = priority['id']
-        name = priority['fields']['ID']
+    if 'default_name' in table_schema:
+        name = fields.get(table_schema['name_field'], table_schema['default_name'])
+    else:
+        name = fields[table_schema['name_field']]
+    data = {key: fields.get(field) for key, field in table_schema.get('data_fields', {}).items()}
+    code_field = table_schema.get('code_field')
+    if code_field:
+        code = fields.get(code_field, '')
+        data['code'] = code
         if ADD_NODE_TYPE_IN_NAME:
-            name = 'Priority: ' + name
-        data = {'node_type': 'MTP Priority'}
+            name = f'{table_schema["label"]}: {code}: {name}'
+    elif ADD_NODE_TYPE_IN_NAME:
+        name = f'{table_schema["label"]}: {name}'
+    data['node_type'] = table_schema['node_type']
+
+    parent_field = table_schema.get('parent_field')
+    if not parent_field:
+        return name, RootedTree.ROOT_ID, data
+
+    try:
+        # there may be more than one; the first is the parent in the
+        # tree, and the rest are kept so exporters can show them too
+        parent_id = fields[parent_field][0]
+    except Exception:
+        parent_label = AIRTABLE_TABLE_SCHEMAS[table_schema['parent_table']]['label']
+        logging.warning(f'{table} record "{name}" is an orphan because {parent_label} is missing')
+        parent_id = RootedTree.ROOT_ID
+    else:
+        if len(fields[parent_field]) > 1:
+            data['other_parent_ids'] = fields[parent_field][1:]
+    return name, parent_id, data
+
+
+def add_airtable_node(result_tree, table, name, id, parent_id, data):
+    """
+    Add a node from table to the tree under parent_id, or under the
+    root as an orphan if that parent is not in the tree.
+    """
+    try:
+        result_tree.create_node(
+            name,
+            identifier=id,
+            parent=parent_id,
+            data=data)
+        logging.debug(f'Added {name}, parent {parent_id}')
+    except treelib.exceptions.NodeIDAbsentError:
         result_tree.create_node(
             name,
             identifier=id,
             parent=RootedTree.ROOT_ID,
             data=data)
-        logging.debug(f'Added {priority}, parent is root')
+        logging.warning(f'Adding {name} as an orphan because {parent_id} not found')
+        parent_id = RootedTree.ROOT_ID
+    run_profile.count('airtable nodes added', table)
+    if parent_id == RootedTree.ROOT_ID and table != AIRTABLE_TABLES[0]:
+        run_profile.count('airtable nodes orphaned', table)
 
-    ######################################################################
-    # Outcomes
-    ######################################################################
 
-    outcomes = get_airtable_table('Outcomes')
-    for outcome in outcomes:
-        id = outcome['id']
-        name = outcome['fields']['Name']
-        code = outcome['fields']['ID']
-        if ADD_NODE_TYPE_IN_NAME:
-            name = f'Outcome: {code}: {name}'
-        department = outcome['fields'].get('Department')
-        data = {'department': department, 'code': code, 'node_type': 'MTP Outcome'}
-        try:
-            parent_id = outcome['fields']['Priority'][0]
-        except Exception:
-            logging.warning(f'Outcome "{name}" is an orphan')
-            parent_id = RootedTree.ROOT_ID
-        try:
-            result_tree.create_node(
-                name,
-                identifier=id,
-                parent=parent_id,
-                data=data)
-        except Exception as e:
-            logging.warning(f'Failed to add {outcome} because {e}')
+def airtable_tables_to_fetch(max_depth=None, skip_node_types=()):
+    """
+    Return the Airtable tables needed for a tree at most max_depth levels
+    deep (counting from the root), leaving out any table whose name or
+    node_type is in skip_node_types, and the tables below it.
+    """
+    def depth(table):
+        parent = AIRTABLE_PARENT_TABLES[table]
+        return 1 if parent is None else depth(parent) + 1
 
-    ######################################################################
-    # Key Deliverables
-    ######################################################################
+    def skipped(table):
+        return (table in skip_node_types or AIRTABLE_NODE_TYPES[table] in skip_node_types
+                or bool(AIRTABLE_PARENT_TABLES[table]) and skipped(AIRTABLE_PARENT_TABLES[table]))
 
-    deliverables = get_airtable_table('KDs')
-    for deliverable in deliverables:
-        id = deliverable['id']
-        name = deliverable['fields']['KD Budget Name']
-        code = deliverable['fields'].get('K-ID', '')
-        if ADD_NODE_TYPE_IN_NAME:
-            name = f'KD: {code}: {name}'
-        description = deliverable['fields'].get('KD Description')
-        data = {'description': description,
-                'code': code,
-                'node_type': 'MTP Key Deliverable'}
-        try:
-            parent_id = deliverable['fields']['Outcome'][0]
-        except Exception:
-            logging.warning(f'KD "{name}" is an orphan because Outcome is missing')
-            parent_id = RootedTree.ROOT_ID
-        try:
-            result_tree.create_node(
-                name,
-                identifier=id,
-                parent=parent_id,
-                data=data)
-        except Exception as e:
-            logging.warning(f'Failed to add {deliverable} because {e}')
+    return [table for table in AIRTABLE_TABLES
+            if not (max_depth and depth(table) > max_depth) and not skipped(table)]
 
-    ######################################################################
-    # Projects
-    ######################################################################
 
-    projects = get_airtable_table('Projects')
-    for project in projects:
-        id = project['id']
-        name = project['fields'].get('Project Name', 'no name')
-        if ADD_NODE_TYPE_IN_NAME:
-            name = f'Project: {name}'
-        data = {'node_type': 'Projects'}
-        try:
-            parent_id = project['fields']['KD'][0]
-        except Exception:
-            logging.warning(f'Project "{name}" is an orphan because KD is missing')
-            parent_id = RootedTree.ROOT_ID
+class AirtableTreeBuilder(object):
+    """
+    Adds Airtable records to a tree in whatever order they arrive.  A
+    record whose parent isn't in the tree yet is parked until the
+    parent is added, then attached with any of its own parked
+    children.  finish() makes orphans of records whose parent never
+    came.
+
+    With root_id, only that record and its descendents are kept, with
+    the record just under the root and at most max_depth levels in all.
+    """
 
-        # maybe move this try/except to a subroutine
-        try:
-            result_tree.create_node(
-                name,
-                identifier=id,
-                parent=parent_id,
-                data=data)
-        except treelib.exceptions.NodeIDAbsentError:
+    def __init__(self, result_tree, root_id=None, max_depth=None):
+        self.result_tree = result_tree
+        self.root_id = root_id
+        self.max_depth = max_depth
+        # parent ID -> [(table, name, record ID, data)] waiting for it
+        self.parked = {}
+        # record ID -> depth, for the records kept under root_id
+        self.depths = {}
+
+    def add(self, table, record):
+        name, parent_id, data = airtable_record_to_node(table, record)
+        id = record['id']
+        if id == self.root_id:
             parent_id = RootedTree.ROOT_ID
-            result_tree.create_node(
-                name,
-                identifier=id,
-                parent=parent_id,
-                data=data)
-            logging.warning(f'Adding {project} as an orphan because KD not found')
+        if parent_id != RootedTree.ROOT_ID and not self.result_tree.contains(parent_id):
+            self.parked.setdefault(parent_id, []).append((table, name, id, data))
+            return
+        self.attach(table, name, id, parent_id, data)
+
+    def attach(self, table, name, id, parent_id, data):
+        """
+        Add a record to the tree, followed by the records parked waiting
+        for it, and theirs in turn.
+        """
+        waiting = [(table, name, id, parent_id, data)]
+        while waiting:
+            table, name, id, parent_id, data = waiting.pop()
+            if self.root_id is not None:
+                if id == self.root_id:
+                    self.depths[id] = 1
+                elif parent_id in self.depths and not (self.max_depth and self.depths[parent_id] >= self.max_depth):
+                    self.depths[id] = self.depths[parent_id] + 1
+                else:
+                    continue
+            add_airtable_node(self.result_tree, table, name, id, parent_id, data)
+            for child in self.parked.pop(id, ()):
+                child_table, child_name, child_id, child_data = child
+                waiting.append((child_table, child_name, child_id, id, child_data))
+
+    def finish(self):
+        """
+        Add the records still parked, whose parents never arrived, as
+        orphans, or drop them if only root_id's subtree is wanted.
+        """
+        if self.root_id is not None:
+            if self.root_id not in self.depths:
+                logging.warning(f'{self.root_id} is not a record in any table fetched')
+            self.parked.clear()
+            return
+        # Start from the tops of the parked chains, so records parked on
+        # other parked records still end up under them
+        parked_ids = {id for records in self.parked.values() for table, name, id, data in records}
+        missing = [parent_id for parent_id in self.parked if parent_id not in parked_ids]
+        for parent_id in missing:
+            for table, name, id, data in self.parked.pop(parent_id):
+                # add_airtable_node() puts it under the root
+                self.attach(table, name, id, parent_id, data)
+        # anything left is parked in a loop of parent links
+        while self.parked:
+            parent_id, records = self.parked.popitem()
+            for table, name, id, data in records:
+                self.attach(table, name, id, parent_id, data)
+
+
+def get_airtable_tree(result_tree=RootedTree(), tables=None, root_id=None, max_depth=None, checkpoint=None):
+    """
+    Retrieve a work breakdown tree from Airtable.  The specific table
+    and relationship structure is hard-coded into this function.  each
+    table has a list of children and the matching table has a list of
+    parents.  Working from the top down, by adding children, means
+    adding placeholder nodes that have to be updated later.  And the
+    children field won't be present in the API results (without extra
+    hoops) if the child field is hidden in the default view.  So work
+    from the parent links instead: every table is fetched at once, and
+    each page of records is added as it comes in, with AirtableTreeBuilder
+    holding back any record until its parent is there.  Only records
+    whose parent never turns up become orphans.
+
+    Only the given tables are fetched, or all of them if tables is None,
+    and only the fields the schema uses.  With root_id, only that record
+    and its descendents are kept, with the record just under the root;
+    max_depth then counts levels from there.  The API can't select
+    records by ancestor, so this saves tree size but not requests.
+
+    With checkpoint, each page is added to it, with the offset of the
+    next page of its table.  A resumed run adds the saved records and
+    fetches only the pages still to come.
+    """
 
-    ######################################################################
-    # Activities
-    ######################################################################
+    synced_at = datetime.datetime.now(datetime.timezone.utc)
+    base_name = base_id
+    results = airtable_client.get_json('meta/bases')['bases']
+    if results:
+        # assume that if anything comes back, it is a valid api response and base_id is unique
+        base_dict = [base for base in results if base['id'] in base_id]
+        base_name = base_dict[0]['name']
+    result_tree.update_node(RootedTree.ROOT_ID, tag=base_name)
+
+    if tables is None:
+        tables = AIRTABLE_TABLES
+    builder = AirtableTreeBuilder(result_tree, root_id, max_depth)
+    # table -> offset of its next page; tables that aren't in it haven't
+    # started, and those with no offset are done
+    progress = {}
+    # table -> IDs of the records saved for it, for tables still in progress
+    resumed_ids = {}
+    if checkpoint:
+        resumed = 0
+        with run_profile.phase('airtable assembly'):
+            for entry in checkpoint.entries():
+                if 'synced_at' in entry:
+                    # a resumed tree is only as new as the first records fetched for it
+                    synced_at = datetime.datetime.fromisoformat(entry['synced_at'])
+                    continue
+                table = entry['table']
+                for record in entry['records']:
+                    builder.add(table, record)
+                resumed_ids.setdefault(table, set()).update(record['id'] for record in entry['records'])
+                progress[table] = entry['offset']
+                resumed += len(entry['records'])
+        if checkpoint.end is None:
+            checkpoint.add({'synced_at': synced_at.isoformat()})
+        for table, offset in progress.items():
+            if not offset:
+                del resumed_ids[table]
+        if progress:
+            logging.info(f'Resumed {resumed} records from {len(progress)} tables')
+        tables = [table for table in tables if table not in progress or progress[table]]
+
+    pages = iter_airtable_tables(tables, offsets=progress)
+    try:
+        while True:
+            # fetch time is only the time spent waiting for the next page
+            with run_profile.phase('airtable fetch'):
+                table, page, offset = next(pages, (None, None, None))
+            if table is None:
+                break
+            if table in resumed_ids:
+                # in case its saved offset had expired and it started again
+                page = [record for record in page if record['id'] not in resumed_ids[table]]
+            with run_profile.phase('airtable assembly'):
+                for record in page:
+                    builder.add(table, record)
+            if checkpoint:
+                checkpoint.add({'table': table, 'records': page, 'offset': offset})
+    except BaseException:
+        if checkpoint:
+            checkpoint.save()
+        raise
+    with run_profile.phase('airtable assembly'):
+        builder.finish()
+
+    result_tree.synced_at = synced_at
+    return result_tree
 
-    activities = get_airtable_table('Activities')
-    for activity in activities:
-        id = activity['id']
-        name = activity['fields'].get('Activity', 'no name')
-        if ADD_NODE_TYPE_IN_NAME:
-            name = f'Activity: {name}'
-        data = {'node_type': 'Activities'}
-        try:
-            parent_id = activity['fields']['KeyDeliverable'][0]
-            # there may be more than one; for now, just use the first
-        except Exception:
-            logging.warning(f'Activity "{name}" is an orphan because KD is missing')
-            parent_id = RootedTree.ROOT_ID
-        try:
-            result_tree.create_node(
-                name,
-                identifier=id,
-                parent=parent_id,
-                data=data)
-        except treelib.exceptions.NodeIDAbsentError:
-            parent_id = RootedTree.ROOT_ID
-            result_tree.create_node(
-                name,
-                identifier=id,
-                parent=parent_id,
-                data=data)
-            logging.warning(f'Adding {activity} as an orphan because KD not found')
 
+def sync_airtable_tree(result_tree):
+    """
+    Bring a tree from an earlier airtable extraction up to date, in
+    place.  Each table is asked only for records modified since the
+    last sync, and those are inserted, updated or moved to their new
+    parent.  Deletions are found by listing the IDs still in each table,
+    which only downloads one field per record.  Children of a deleted
+    record become orphans, as they would in a full extraction.
+
+    Orphans whose missing parent has since been created stay under the
+    root until their own record changes or a full extraction is run.
+    """
+    if not getattr(result_tree, 'synced_at', None):
+        raise Exception('The previous tree has no sync time; run a full extraction first.')
+    synced_at = datetime.datetime.now(datetime.timezone.utc)
+    since = (result_tree.synced_at - AIRTABLE_SYNC_OVERLAP).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+    formula = f"IS_AFTER(LAST_MODIFIED_TIME(), '{since}')"
+
+    table_of_type = {node_type: table for table, node_type in AIRTABLE_NODE_TYPES.items()}
+    existing_ids = {table: set() for table in AIRTABLE_TABLES}
+    for node in result_tree.all_nodes_itr():
+        if node.data and node.data.get('node_type') in table_of_type:
+            existing_ids[table_of_type[node.data['node_type']]].add(node.identifier)
+
+    with run_profile.phase('airtable fetch'):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(AIRTABLE_TABLES)) as executor:
+            changed_records = {table: executor.submit(get_airtable_table, table,
+                                                      {'filterByFormula': formula, 'fields[]': AIRTABLE_FIELDS[table]})
+                               for table in AIRTABLE_TABLES}
+            # always fresh: with the same params every sync, a cached
+            # listing would hide records deleted since it was cached
+            listed_records = {table: executor.submit(get_airtable_table, table,
+                                                     {'fields[]': [AIRTABLE_NAME_FIELDS[table]]}, cached=False)
+                              for table in AIRTABLE_TABLES}
+            changed_records = {table: future.result() for table, future in changed_records.items()}
+            listed_records = {table: future.result() for table, future in listed_records.items()}
+
+    with run_profile.phase('airtable assembly'):
+        # Apply changes only once every fetch is in, and table by table, so
+        # new parents are in place before their children
+        deleted_ids = set()
+        for table in AIRTABLE_TABLES:
+            changed = changed_records[table]
+            logging.info(f'{len(changed)} records in {table} changed since {since}')
+            for record in changed:
+                id = record['id']
+                name, parent_id, data = airtable_record_to_node(table, record)
+                if not result_tree.contains(id):
+                    add_airtable_node(result_tree, table, name, id, parent_id, data)
+                    continue
+                result_tree.update_node(id, tag=name, data=data)
+                run_profile.count('airtable nodes updated', table)
+                current_parent_id = result_tree.parent(id).identifier
+                if current_parent_id != parent_id:
+                    if not result_tree.contains(parent_id):
+                        if current_parent_id == RootedTree.ROOT_ID:
+                            # already an orphan
+                            continue
+                        logging.warning(f'Moving {name} to root as an orphan because {parent_id} not found')
+                        parent_id = RootedTree.ROOT_ID
+                    result_tree.move_node(id, parent_id)
+                    run_profile.count('airtable nodes moved', table)
+                    logging.debug(f'Moved {name} to parent {parent_id}')
+
+            current_ids = {record['id'] for record in listed_records[table]}
+            deleted_ids.update(existing_ids[table] - current_ids)
+
+        for id in deleted_ids:
+            if not result_tree.contains(id):
+                continue
+            for child in result_tree.children(id):
+                if child.identifier not in deleted_ids:
+                    logging.warning(f'Moving {child.tag} to root as an orphan because its parent was deleted')
+                    result_tree.move_node(child.identifier, RootedTree.ROOT_ID)
+            result_tree.remove_node(id)
+        logging.info(f'Removed {len(deleted_ids)} deleted records')
+
+    result_tree.synced_at = synced_at
     return result_tree
 
 
+# Fields goal_from_payload() reads.  Goals from goals/filter that lack
+# any of these are fetched again individually.
+BETTERWORKS_GOAL_FIELDS = ('id', 'name', 'children', 'is_key_result', 'parent', 'owner', 'start', 'end')
+
+# goals/filter parameter for selecting the children of one goal
+BETTERWORKS_PARENT_FILTER = 'parent'
+
+# Goal payload fields that may hold a modification or version stamp, in
+# order of preference
+BETTERWORKS_MODIFIED_FIELDS = ('modified', 'updated_at', 'updated', 'version')
+
+
 def get_goal_as_object(goal_id):
     """
     Retrieve a single BW goal by ID.  Maybe this should be a class method?
     """
-    url = f'https://app.betterworks.com/api/v1/goals/{goal_id}/'
     try:
-        response = requests.get(url, headers=betterworks_headers)
-        results = response.json()
+        results = betterworks_client.get_json(f'goals/{goal_id}/')
     except Exception as e:
         logging.warning(f'Could not retrieve goal {goal_id}: {e}')
+        run_profile.count('betterworks goals', 'failed')
+        return None
+    if 'id' not in results:
+        logging.warning(f'Could not retrieve goal {goal_id}: {results}')
+        run_profile.count('betterworks goals', 'failed')
+        return None
+    run_profile.count('betterworks goals', 'fetched one at a time')
+    return goal_from_payload(results)
+
+
+def goal_from_payload(results):
+    """
+    Build a Goal from a goal as returned by the BW API.
+    """
     goal_id = int(results.get('id'))
     goal_name = results.get('name')
     # categories = results.get('categories')
@@ -277,96 +843,449 @@ def get_goal_as_object(goal_id):
         owner = ''
     start = results.get('start')
     end = results.get('end')
+    modified = next((results[field] for field in BETTERWORKS_MODIFIED_FIELDS if results.get(field) is not None), None)
     if parent:
         parent_id = parent.get('id')
     else:
         parent_id = RootedTree.ROOT_ID
-    goal = Goal(goal_id, goal_name, parent_id, children, owner, start, end, is_key_result)
+    goal = Goal(goal_id, goal_name, parent_id, children, owner, start, end, is_key_result, modified)
     return goal
 
 
-def get_goal_as_tree(goal_id, result_tree=RootedTree()):
+def goal_from_node(node):
     """
-    Retrieve a BW goal and all descendents.  Return as a tree, added to an
-    existing tree if passed in.
+    Rebuild a Goal from its node in a saved tree.
+    """
+    data = node.data
+    return Goal(data['id'], data['name'], data['parent_id'], [{'id': child_id} for child_id in data['child_ids']],
+                data['owner'], data['start'], data['end'], data['node_type'] == 'Key Result', data.get('modified'))
+
+
+def goal_to_checkpoint(goal):
+    """
+    Return a Goal as a dict of JSON types, for a Checkpoint entry.
+    """
+    return goal.as_dict()
+
+
+def goal_from_checkpoint(item):
+    """
+    Rebuild a Goal saved by goal_to_checkpoint().
+    """
+    return Goal(item['id'], item['name'], item['parent_id'], [{'id': child_id} for child_id in item['child_ids']],
+                item['owner'], item['start'], item['end'], item['node_type'] == 'Key Result', item['modified'])
+
+
+def iter_filtered_goal_pages(params):
+    """
+    Yield the goal payloads from the BW goals/filter endpoint for params
+    a page at a time, following pagination.
+    """
+    url = 'goals/filter'
+
+    # Because BetterWorks truncates any response at 30 items, be
+    # ready to handle potential pagination.
+    expect_more_results = True
+    while expect_more_results:
+        response = betterworks_client.get_json(url, params)
+        results = response.get('results')
+        if results is None:
+            e = response.get('reason', 'reason not specified')
+            raise Exception(f'Goals search failed for reason {e}')
+        yield results
+
+        more = response.get('more')
+        url = response.get('nextURL')
+        if not (more and url):
+            expect_more_results = False
+
+
+def get_filtered_goals(params):
+    """
+    Return the goals payloads from the BW goals/filter endpoint for
+    params, following pagination.
+    """
+    return [payload for page in iter_filtered_goal_pages(params) for payload in page]
+
+
+def get_child_goal_payloads(goal_id):
+    """
+    Return the payloads of every goal whose parent is goal_id, in bulk
+    pages from goals/filter.  Returns an empty list if the search fails,
+    so the caller can fall back to fetching goals one at a time, and
+    None if it returns goals with another parent, which means the
+    endpoint doesn't filter by BETTERWORKS_PARENT_FILTER at all.  That
+    is noticed on the first page, before paging through unrelated goals.
     """
-    goal = get_goal_as_object(goal_id)
-    if not goal:
-        logging.warning(f'Looked for {goal_id} but did not get result')
-        return
+    payloads = []
+    try:
+        for page in iter_filtered_goal_pages({BETTERWORKS_PARENT_FILTER: goal_id}):
+            for payload in page:
+                parent_id = (payload.get('parent') or {}).get('id')
+                if parent_id is None or int(parent_id) != int(goal_id):
+                    logging.warning(f'goals/filter by {BETTERWORKS_PARENT_FILTER}={goal_id} returned goal '
+                                    f'{payload.get("id")} with parent {parent_id}')
+                    return None
+            payloads.extend(page)
+    except Exception as e:
+        logging.warning(f'Could not retrieve children of goal {goal_id} in bulk: {e}')
+        return []
+    run_profile.count('betterworks goals', 'fetched in bulk', len(payloads))
+    return payloads
 
+
+def add_goal_to_tree(goal, result_tree):
+    """
+    Add a single goal to the tree under its parent, falling back to the
+    root if the parent is not (yet) in the tree.
+    """
     try:
         # Add the goal to the tree
         # Data is added as dict because treelib.to_json can't serialize objects
         result_tree.create_node(
             repr(goal),
-            identifier=int(goal_id),
+            identifier=int(goal.id),
             parent=int(goal.parent_id),
             data=goal.as_dict())
         logging.debug(f'Added {repr(goal)}, parent {goal.parent_id}')
+        run_profile.count('betterworks nodes', 'added')
     except treelib.exceptions.NodeIDAbsentError as e:
         # Allow special cases where there is no parent or parent is mangled
         # This is a separate branch because we can't know ahead of time if it's needed
         result_tree.create_node(
             goal.name,
-            identifier=goal_id,
+            identifier=int(goal.id),
             parent=RootedTree.ROOT_ID,
             data=goal.as_dict())
         logging.warning(f'Added "{repr(goal)}" as an orphan because {e}')
+        run_profile.count('betterworks nodes', 'added')
+        run_profile.count('betterworks nodes', 'orphaned')
     except treelib.exceptions.DuplicatedNodeIdError:
-        logging.debug(f'Saw {goal_id} again; did not add')
+        logging.debug(f'Saw {goal.id} again; did not add')
+        run_profile.count('betterworks nodes', 'duplicates')
     except Exception as e:
-        logging.error(f'failed to add {pprint.pprint(goal)} because {e}')
+        logging.error(f'failed to add {pprint.pformat(goal.as_dict())} because {e}')
+        run_profile.count('betterworks nodes', 'failed')
 
-    for child in goal.children:
-        child_goal_id = child['id']
-        result_tree = get_goal_as_tree(child_goal_id, result_tree)
-
-    return result_tree
 
+class GoalCrawler(object):
+    """
+    Breadth-first crawler for BetterWorks goal trees.  Each frontier of
+    child goal IDs is fetched in parallel, with at most max_workers
+    requests in flight, and the results are added to the tree in
+    frontier order, so parents are in place before their children.
+    Iterative rather than recursive, so a deep alignment chain can't
+    hit Python's recursion limit.
+
+    One crawler should be used for a whole run.  It remembers every goal
+    ID it has queued, so a subtree reachable through several alignments,
+    users or starting goals is only fetched once, and a goal that aligns
+    to one of its own ancestors is reported as a cycle instead of being
+    crawled forever.  It also keeps every goal it fetched, so trees for
+    other starting points in what was crawled can be built afterwards
+    without fetching anything.
+
+    With batch set, the children of each goal in a level are requested
+    together in pages from goals/filter, instead of with one goals/{id}
+    request each.  Goals the bulk search doesn't return, or returns
+    without all of BETTERWORKS_GOAL_FIELDS, are fetched one at a time.
+    If the bulk search returns goals with other parents, batch is turned
+    off for the rest of the run.
+
+    previous_tree, a tree saved by an earlier crawl, makes this a
+    refresh: a goal whose modification stamp and child IDs are the same
+    as in previous_tree has its stored descendents taken from there
+    instead of fetched.  This trusts BetterWorks to change a goal's stamp
+    or children whenever its subtree changes in a way that matters;
+    anything else is picked up by the next full crawl.
+
+    max_depth stops the crawl at that many levels below the root, and
+    goals whose node_type is in skip_node_types are left out along with
+    everything below them, so no requests are spent on what a report
+    won't show.
+
+    With checkpoint, every goal fetched is added to it.  A crawler
+    resuming from it takes the saved goals instead of fetching
+    them as the crawl reaches them again, so it retraces the earlier
+    run's steps without requests, and builds the same tree, before
+    fetching anything new.  Goals that failed are tried again.
+    """
 
-def get_goals_for_user(user_id, result_tree=RootedTree()):
+    DEFAULT_MAX_WORKERS = 8
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, batch=False, previous_tree=None,
+                 max_depth=None, skip_node_types=(), checkpoint=None):
+        self.max_workers = max_workers
+        self.batch = batch
+        self.previous_tree = previous_tree
+        self.max_depth = max_depth
+        self.skip_node_types = set(skip_node_types)
+        self.seen = set()
+        # goal ID -> ID of the goal it was first reached from, for cycle reports
+        self.reached_from = {}
+        # goal ID -> Goal, for every goal fetched
+        self.goals = {}
+        self.fetches = 0
+        self.batched_fetches = 0
+        self.skipped_fetches = 0
+        self.reused = 0
+        # goal ID -> Goal taken from previous_tree, for goals below an
+        # unchanged one that the crawl has yet to reach
+        self.unchanged = {}
+        self.cycles = 0
+        self.failures = 0
+        self.checkpoint = checkpoint
+        # goal ID -> Goal fetched by the run being resumed, that this
+        # crawl has yet to reach
+        self.resumed = {}
+        if checkpoint:
+            for entry in checkpoint.entries():
+                item = entry['goal']
+                self.resumed[item['id']] = goal_from_checkpoint(item)
+
+    def is_ancestor(self, goal_id, descendent_id):
+        """
+        True if goal_id is on the crawl path that led to descendent_id.
+        """
+        while descendent_id is not None:
+            if descendent_id == goal_id:
+                return True
+            descendent_id = self.reached_from.get(descendent_id)
+        return False
+
+    def enqueue(self, goal_id, frontier, reached_from=None):
+        """
+        Add goal_id to frontier unless it has already been queued in this run.
+        """
+        if goal_id in self.seen:
+            self.skipped_fetches += 1
+            if reached_from is not None and self.is_ancestor(goal_id, reached_from):
+                self.cycles += 1
+                logging.warning(f'Goal {reached_from} aligns to its own ancestor {goal_id}; not following the cycle')
+            else:
+                logging.debug(f'Saw {goal_id} again; did not fetch')
+            return
+        self.seen.add(goal_id)
+        self.reached_from[goal_id] = reached_from
+        frontier.append(goal_id)
+
+    def fetch_frontier(self, frontier, executor, payloads):
+        """
+        Return the goals for the IDs in frontier, in the same order.
+        payloads may hold goal payloads that have already been fetched,
+        keyed by ID.
+        """
+        goals = {}
+        for goal_id in frontier:
+            if goal_id in self.unchanged:
+                goals[goal_id] = self.unchanged.pop(goal_id)
+                self.reused += 1
+                run_profile.count('betterworks goals', 'reused from previous tree')
+            elif goal_id in self.resumed:
+                goals[goal_id] = self.resumed.pop(goal_id)
+                run_profile.count('betterworks goals', 'resumed from checkpoint')
+
+        if self.batch:
+            children_by_parent = {}
+            for goal_id in frontier:
+                if goal_id not in payloads and goal_id not in goals and self.reached_from[goal_id] is not None:
+                    children_by_parent.setdefault(self.reached_from[goal_id], []).append(goal_id)
+            # A bulk search only saves requests for a goal with several new children
+            parents = [parent_id for parent_id, children in children_by_parent.items() if len(children) > 1]
+            unfiltered = False
+            for child_payloads in executor.map(get_child_goal_payloads, parents):
+                if child_payloads is None:
+                    unfiltered = True
+                    continue
+                for payload in child_payloads:
+                    payloads[int(payload['id'])] = payload
+            if unfiltered:
+                logging.warning('goals/filter does not seem to filter by parent; '
+                                'fetching goals one at a time for the rest of the run')
+                self.batch = False
+
+        for goal_id in frontier:
+            if goal_id in goals:
+                continue
+            payload = payloads.pop(goal_id, None)
+            if payload and all(field in payload for field in BETTERWORKS_GOAL_FIELDS):
+                goals[goal_id] = goal_from_payload(payload)
+                self.batched_fetches += 1
+                self.record(goals[goal_id])
+        missing = [goal_id for goal_id in frontier if goal_id not in goals]
+        self.fetches += len(missing)
+        # map() keeps results in frontier order, whatever order the
+        # responses come back in
+        for goal_id, goal in zip(missing, executor.map(get_goal_as_object, missing)):
+            goals[goal_id] = goal
+            if goal:
+                self.record(goal)
+            else:
+                self.failures += 1
+        return [goals[goal_id] for goal_id in frontier]
+
+    def record(self, goal):
+        """
+        Add a goal just fetched to the checkpoint, if there is one.
+        """
+        if self.checkpoint:
+            self.checkpoint.add({'goal': goal_to_checkpoint(goal)})
+
+    def crawl(self, goal_ids, result_tree, payloads=None):
+        """
+        Retrieve the goals in goal_ids and all their descendents, and
+        add them to result_tree.  In batch mode, payloads may hold
+        already-fetched payloads for some of goal_ids, keyed by ID.
+        """
+        payloads = dict(payloads or {}) if self.batch else {}
+        frontier = []
+        for goal_id in goal_ids:
+            self.enqueue(int(goal_id), frontier)
+        # goal_ids are at depth 1, just under the root
+        depth = 1
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                while frontier:
+                    logging.debug(f'fetching frontier of {len(frontier)} goals')
+                    next_frontier = []
+                    reused = {goal_id for goal_id in frontier if goal_id in self.unchanged}
+                    with run_profile.phase('betterworks fetch'):
+                        goals = self.fetch_frontier(frontier, executor, payloads)
+                    with run_profile.phase('betterworks assembly'):
+                        for goal_id, goal in zip(frontier, goals):
+                            if not goal:
+                                logging.warning(f'Looked for {goal_id} but did not get result')
+                                continue
+                            if goal.node_type in self.skip_node_types:
+                                run_profile.count('betterworks goals', f'skipped {goal.node_type}')
+                                continue
+                            self.goals[goal_id] = goal
+                            add_goal_to_tree(goal, result_tree)
+                            if self.max_depth and depth >= self.max_depth:
+                                continue
+                            self.queue_unchanged_children(goal, goal_id in reused)
+                            for child_id in goal.child_ids:
+                                self.enqueue(child_id, next_frontier, reached_from=goal_id)
+                    frontier = next_frontier
+                    depth += 1
+                    # Drop bulk results for goals that turned out not to be needed
+                    payloads.clear()
+        except BaseException:
+            if self.checkpoint:
+                self.checkpoint.save()
+            raise
+        return result_tree
+
+    def queue_unchanged_children(self, goal, from_previous):
+        """
+        If goal is unchanged since previous_tree was saved, or was itself
+        taken from previous_tree, put its children that are stored under
+        it in self.unchanged, so they are taken from previous_tree
+        instead of fetched when the crawl reaches them.  Children that
+        aren't stored there, because the earlier crawl stopped above
+        them, skipped them or placed them under another parent, are
+        fetched as usual.  Snapshots from before child IDs were saved
+        in the node data are never reused.
+        """
+        previous = self.previous_tree
+        if previous is None or not previous.contains(goal.id):
+            return
+        if not from_previous:
+            data = previous.get_node(goal.id).data or {}
+            if goal.modified is None or data.get('modified') != goal.modified:
+                return
+            # Any change to the children means the stored subtree is out of date
+            if 'child_ids' not in data or tuple(data['child_ids']) != goal.child_ids:
+                return
+        for child in previous.children(goal.id):
+            if child.identifier in goal.child_ids and child.identifier not in self.seen and \
+                    'child_ids' in (child.data or {}):
+                self.unchanged[child.identifier] = goal_from_node(child)
+
+    def build_tree(self, goal_ids, result_tree):
+        """
+        Add the goals in goal_ids and all their descendents to
+        result_tree, from the goals already fetched, in the same order
+        and places crawl() would have put them in had it started from
+        goal_ids alone.  Goals that were never fetched are left out.
+        """
+        seen = set()
+        frontier = []
+        for goal_id in goal_ids:
+            if goal_id not in seen:
+                seen.add(goal_id)
+                frontier.append(goal_id)
+        depth = 1
+        while frontier:
+            next_frontier = []
+            for goal_id in frontier:
+                goal = self.goals.get(goal_id)
+                if not goal:
+                    continue
+                add_goal_to_tree(goal, result_tree)
+                if self.max_depth and depth >= self.max_depth:
+                    continue
+                for child_id in goal.child_ids:
+                    if child_id not in seen:
+                        seen.add(child_id)
+                        next_frontier.append(child_id)
+            frontier = next_frontier
+            depth += 1
+        return result_tree
+
+    def report(self):
+        """
+        Log a one-line summary of the crawl.
+        """
+        logging.info(f'Fetched {self.fetches} goals one at a time and {self.batched_fetches} in bulk; '
+                     f'avoided {self.skipped_fetches} repeat fetches; reused {self.reused} unchanged goals; '
+                     f'found {self.cycles} alignment cycles; {self.failures} goals failed')
+
+
+def get_goal_as_tree(goal_id, result_tree=RootedTree(), crawler=None):
     """
-    Return a tree of BW goals that this user_id owns and all their descendents.
+    Retrieve a BW goal and all descendents.  Return as a tree, added to an
+    existing tree if passed in.
     """
+    if crawler is None:
+        crawler = GoalCrawler()
+    return crawler.crawl([goal_id], result_tree)
 
-    url = f'https://app.betterworks.com/api/v1/goals/filter'
-    params = {'owner': user_id}
 
-    # Because BetterWorks truncates any response at 30 items, be
-    # ready to handle potential pagination.
-    expect_more_results = True
-    while expect_more_results:
-        try:
-            logging.debug(f'making request to {url} with betterworks_headers\
-            {betterworks_headers} and params {params}')
-            response = requests.get(url, headers=betterworks_headers, params=params)
-            results = response.json().get('results')
-            if not results:
-                e = response.get('reason', 'reason not specified')
-                raise Exception(f'Goals search failed for reason {e}')
-            for item in results:
-                goal_id = int(item['id'])
-                result_tree = get_goal_as_tree(goal_id, result_tree)
-        except Exception as e:
-            raise Exception(f'Goals search failed for reason {e}')
+def get_owned_goal_payloads(user_id):
+    """
+    Return the payloads of the goals this user_id owns, keyed by goal ID.
+    """
+    try:
+        results = get_filtered_goals({'owner': user_id})
+    except Exception as e:
+        raise Exception(f'Goals search failed for reason {e}')
+    if not results:
+        raise Exception(f'Goals search failed for reason: no goals found for {user_id}')
+    payloads = {int(item['id']): item for item in results}
+    run_profile.count('betterworks goals', 'found by owner', len(payloads))
+    return payloads
 
-        more = response.json().get('more')
-        url = response.json().get('nextURL')
-        if not (more and url):
-            expect_more_results = False
 
-    return result_tree
+def get_goals_for_user(user_id, result_tree=RootedTree(), crawler=None):
+    """
+    Return a tree of BW goals that this user_id owns and all their descendents.
+    """
+    payloads = get_owned_goal_payloads(user_id)
+
+    # Crawl all of the user's top-level goals together, so the first
+    # frontier is fetched in parallel too
+    if crawler is None:
+        crawler = GoalCrawler()
+    return crawler.crawl(list(payloads), result_tree, payloads)
 
 
 def get_bw_user(userstring):
     """
     Search for user by email or user id, and return tuple of userid and name
     """
-    url = f'https://app.betterworks.com/api/v1/users/{userstring}'
     try:
-        response = requests.get(url, headers=betterworks_headers)
-        results = response.json()
+        results = betterworks_client.get_json(f'users/{userstring}')
         name = results.get('name')
         id = results.get('id')
     except Exception as e:
@@ -374,10 +1293,60 @@ def get_bw_user(userstring):
     return id, name
 
 
+def read_users_file(path):
+    """
+    Return the user emails or IDs listed in a file, one per line.
+    Blank lines and lines starting with # are skipped.
+    """
+    with open(path) as file:
+        lines = (line.strip() for line in file)
+        return [line for line in lines if line and not line.startswith('#')]
+
+
+def get_goals_for_users(user_identifiers, crawler=None, max_workers=GoalCrawler.DEFAULT_MAX_WORKERS):
+    """
+    Return a dict of user identifier -> (user name, tree of the goals
+    that user owns and all their descendents), for many users at once.
+
+    The users and their owned goals are looked up concurrently, and the
+    union of their goal trees is crawled once, so goals that several
+    users' goals align to are only fetched once.  Each user's tree is
+    then built from the crawler's goals, as get_goals_for_user would
+    have built it.  Users who can't be found, or own no goals, are
+    logged and left out.
+    """
+    if crawler is None:
+        crawler = GoalCrawler(max_workers=max_workers)
+
+    def look_up(user_identifier):
+        try:
+            user_id, user_name = get_bw_user(user_identifier)
+            return user_name, get_owned_goal_payloads(user_id)
+        except Exception as e:
+            logging.error(f'Skipping user {user_identifier}: {e}')
+            return None
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        users = dict(zip(user_identifiers, executor.map(look_up, user_identifiers)))
+    users = {user: found for user, found in users.items() if found}
+
+    payloads = {}
+    for user_name, owned in users.values():
+        payloads.update(owned)
+    crawler.crawl(list(payloads), tree_class(), payloads)
+
+    results = {}
+    for user_identifier, (user_name, owned) in users.items():
+        result_tree = crawler.build_tree(list(owned), tree_class())
+        result_tree.update_node(RootedTree.ROOT_ID, tag=user_name)
+        results[user_identifier] = (user_name, result_tree)
+    return results
+
+
 def main():
     """
     Retrieve some hierarchical data from WMF's work tracking systems.  Save it
-    in a pickled Treelib file.
+    in a tree snapshot file.
     """
     ######################################################################
     # Initialize
@@ -385,7 +1354,7 @@ def main():
 
     parser = argparse.ArgumentParser()
     parser.add_argument('type',
-                        choices=['bw_user', 'bw_goal', 'airtable'],
+                        choices=['bw_user', 'bw_users', 'bw_goal', 'airtable'],
                         help='What type of data should be retrieved?')
 
     parser.add_argument('identifier',
@@ -394,7 +1363,8 @@ def main():
                         help="""What is the identifier for the type of data?  For airtable,
                         use base ID.  For bw_goal, provide a BetterWorks Goal ID.
                         For bw_user, provide an email address, BetterWorks User ID,
-                        or space-delimited list of one or both types.""")
+                        or space-delimited list of one or both types.  For bw_users,
+                        provide a file listing one email address or User ID per line.""")
 
     parser.add_argument('--betterworks_api_token',
                         metavar='BETTERWORKS_API_TOKEN',
@@ -411,7 +1381,111 @@ def main():
     parser.add_argument('--output_file',
                         type=str,
                         help='File name for output',
-                        default='pickle.json')
+                        default='tree.snapshot')
+
+    parser.add_argument('--output_pattern',
+                        type=str,
+                        help="""For bw_users, file name for each user's output, with {user}
+                        replaced by the email address or ID from the users file.""",
+                        default='{user}.snapshot')
+
+    parser.add_argument('--incremental',
+                        metavar='PREVIOUS_FILE',
+                        type=str,
+                        help="""For airtable, update the tree saved in PREVIOUS_FILE
+                        by an earlier run with only the records changed since then,
+                        instead of extracting the whole base.  For bw_user and bw_goal,
+                        only crawl below goals whose modification stamp or children
+                        changed since PREVIOUS_FILE was saved, and reuse the rest.""")
+
+    parser.add_argument('--cache_dir', '--cache-dir',
+                        type=str,
+                        help="""Directory for the local API response cache.  Caching is
+                        off unless this is set.  Defaults to environment variable
+                        WORK_TRACKING_CACHE_DIR.""",
+                        default=os.getenv('WORK_TRACKING_CACHE_DIR'))
+
+    parser.add_argument('--no_cache', '--no-cache',
+                        action='store_true',
+                        help='Ignore the response cache and fetch everything from the APIs.')
+
+    parser.add_argument('--cache_max_mb',
+                        type=int,
+                        help='Evict least recently used cache entries beyond this size.',
+                        default=http_cache.ResponseCache.DEFAULT_MAX_BYTES // (1024 * 1024))
+
+    parser.add_argument('--batch_fetch',
+                        action='store_true',
+                        help="""Fetch each level of BetterWorks goals in bulk pages from the
+                        goals/filter endpoint instead of one request per goal.""")
+
+    parser.add_argument('--compact_tree',
+                        action='store_true',
+                        help="""Build the tree in compact arrays rather than treelib objects,
+                        to save memory on very large extractions.""")
+
+    parser.add_argument('--max_workers',
+                        type=int,
+                        help='Maximum number of BetterWorks requests in flight at once.',
+                        default=GoalCrawler.DEFAULT_MAX_WORKERS)
+
+    parser.add_argument('--profile',
+                        metavar='JSON_FILE',
+                        nargs='?',
+                        const='-',
+                        help="""Report where the run's time went: phase timings, requests,
+                        bytes, retries, rate-limit waits and latency histograms per endpoint,
+                        and nodes added or orphaned per table.  Logged as a summary, or
+                        written to JSON_FILE if one is given.""")
+
+    parser.add_argument('--airtable_schema',
+                        metavar='JSON_FILE',
+                        type=str,
+                        help="""For airtable, read the tables, fields, parent links and node
+                        types to extract from JSON_FILE, a list laid out like
+                        AIRTABLE_SCHEMA in extract.py, instead of using the built-in one.""")
+
+    parser.add_argument('--max_depth',
+                        type=int,
+                        help="""Extract only this many levels below the root.  For airtable,
+                        tables below that depth are not fetched at all; for bw_user, bw_users
+                        and bw_goal, the crawl does not descend any further.""")
+
+    parser.add_argument('--skip_node_types',
+                        nargs='+',
+                        default=[],
+                        metavar='NODE_TYPE',
+                        help="""Leave out nodes of these types and everything below them,
+                        e.g. Activities Projects (Airtable table names or node types)
+                        or 'Key Result'.  Skipped Airtable tables are not fetched.""")
+
+    parser.add_argument('--root',
+                        metavar='RECORD_ID',
+                        type=str,
+                        help="""For airtable, keep only this record and its descendents.
+                        For BetterWorks, use bw_goal instead.""")
+
+    parser.add_argument('--checkpoint',
+                        action='store_true',
+                        help="""Save the progress of the extraction to --checkpoint_file as it
+                        goes, so that it can be carried on with --resume if the run dies.""")
+
+    parser.add_argument('--checkpoint_file',
+                        type=str,
+                        help="""Where to save progress with --checkpoint.  Defaults to the output
+                        file name plus .checkpoint.  Removed once the output is saved.""")
+
+    parser.add_argument('--checkpoint_seconds',
+                        type=int,
+                        help="""Flush progress to --checkpoint_file at least this often while
+                        fetching.""",
+                        default=Checkpoint.DEFAULT_INTERVAL)
+
+    parser.add_argument('--resume',
+                        action='store_true',
+                        help="""Carry on from --checkpoint_file, left by an earlier run of the
+                        same extraction that didn't finish, without repeating the requests
+                        it completed.  Implies --checkpoint.""")
 
     parser.add_argument('--debug',
                         action='store_true',
@@ -420,14 +1494,16 @@ def main():
     args = vars(parser.parse_args())
 
     airtable_api_key = args.get('airtable_api_key')
-    global airtable_headers
-    airtable_headers = {'Authorization': f'Bearer {airtable_api_key}'}
-
     betterworks_api_token = args.get('betterworks_api_token')
-    global betterworks_headers
-    betterworks_headers = {'Authorization': f'APIToken {betterworks_api_token}'}
 
     output_file = args.get('output_file')
+    max_workers = args.get('max_workers')
+    max_depth = args.get('max_depth')
+    skip_node_types = args.get('skip_node_types')
+    root_id = args.get('root')
+    if args.get('compact_tree'):
+        global tree_class
+        tree_class = CompactRootedTree
     global DEBUG
     DEBUG = args.get('debug')
     if DEBUG:
@@ -436,6 +1512,25 @@ def main():
             datefmt='%Y-%m-%d %H:%M:%S %z',
             level=logging.DEBUG,
             stream=sys.stdout)
+    else:
+        logging.basicConfig(
+            format='%(asctime)s %(levelname)-8s %(message)s',
+            datefmt='%Y-%m-%d %H:%M:%S %z',
+            level=logging.INFO)
+
+    response_cache = None
+    cache_dir = args.get('cache_dir')
+    if cache_dir and not args.get('no_cache'):
+        response_cache = http_cache.ResponseCache(
+            cache_dir, max_bytes=args.get('cache_max_mb') * 1024 * 1024)
+    configure_clients(airtable_api_key, betterworks_api_token, response_cache)
+
+    checkpoint = None
+    if args.get('checkpoint') or args.get('resume'):
+        checkpoint_key = {name: args.get(name) for name in
+                          ('type', 'identifier', 'airtable_schema', 'max_depth', 'skip_node_types', 'root')}
+        checkpoint = Checkpoint(args.get('checkpoint_file') or f'{output_file}.checkpoint', checkpoint_key,
+                                args.get('checkpoint_seconds'), args.get('resume'))
 
     ######################################################################
     # Fetch the data
@@ -453,39 +1548,95 @@ def main():
             raise Exception(
                 'AIRTABLE_API_KEY must be in the environment, or specified in the command line.'  # NOQA
             )
+        schema_file = args.get('airtable_schema')
+        if schema_file:
+            with open(schema_file) as file:
+                set_airtable_schema(json.load(file))
         global base_id  # avoid a bunch of passing around base_id
         base_id = identifier[0]
-        result_tree = get_airtable_tree()
+        previous_file = args.get('incremental')
+        if previous_file:
+            if max_depth or skip_node_types or root_id:
+                raise Exception('--incremental updates the whole previous tree, so it does not work with '
+                                '--max_depth, --skip_node_types or --root')
+            with run_profile.phase('load'):
+                result_tree = load_tree(previous_file)
+            result_tree = sync_airtable_tree(result_tree)
+        else:
+            # Relative to --root the depth of each table isn't known in
+            # advance, so then every table is fetched
+            tables = airtable_tables_to_fetch(None if root_id else max_depth, skip_node_types)
+            result_tree = get_airtable_tree(tree_class(), tables, root_id, max_depth, checkpoint)
     else:
         if not betterworks_api_token:
             raise Exception(
                 'BETTERWORKS_API_TOKEN must be in the environment, or specified in the command line.'  # NOQA
             )
-        result_tree = RootedTree()
-        root_node = result_tree.get_node(RootedTree.ROOT_ID)
-        root_node.tag = 'root'
-        if fetch_type == 'bw_user':
+        if root_id:
+            raise Exception('--root is for airtable; to extract the tree under one goal, use bw_goal')
+        result_tree = tree_class()
+        previous_tree = None
+        previous_file = args.get('incremental')
+        if previous_file:
+            if fetch_type == 'bw_users':
+                raise Exception('--incremental takes one previous tree, so it does not work with bw_users')
+            with run_profile.phase('load'):
+                previous_tree = load_tree(previous_file)
+        crawler = GoalCrawler(max_workers=max_workers, batch=args.get('batch_fetch'), previous_tree=previous_tree,
+                              max_depth=max_depth, skip_node_types=skip_node_types, checkpoint=checkpoint)
+        if fetch_type == 'bw_users':
+            user_identifiers = []
+            for users_file in identifier:
+                user_identifiers.extend(read_users_file(users_file))
+            user_trees = get_goals_for_users(user_identifiers, crawler, max_workers)
+            outputs = {args.get('output_pattern').format(user=user_identifier): user_tree
+                       for user_identifier, (user_name, user_tree) in user_trees.items()}
+        elif fetch_type == 'bw_user':
             for user_identifier in identifier:
                 user_id, user_name = get_bw_user(user_identifier)
-                result_tree = get_goals_for_user(user_id, result_tree)
+                result_tree = get_goals_for_user(user_id, result_tree, crawler)
                 if len(identifier) == 1:
-                    root_node = result_tree.get_node(RootedTree.ROOT_ID)
-                    root_node.tag = user_name
+                    result_tree.update_node(RootedTree.ROOT_ID, tag=user_name)
         else:  # assume retrieval by goal ID
             for goal_id in identifier:
-                result_tree = get_goal_as_tree(goal_id, result_tree)
+                result_tree = get_goal_as_tree(goal_id, result_tree, crawler)
                 if len(identifier) == 1:
-                    root_node = result_tree.get_node(RootedTree.ROOT_ID)
-                    root_node.tag = identifier
+                    result_tree.update_node(RootedTree.ROOT_ID, tag=goal_id)
+        crawler.report()
+        if checkpoint and crawler.failures:
+            # keep it, so that a resumed run only retries the failures
+            checkpoint.close()
+            logging.warning(f'{crawler.failures} goals could not be fetched; run again with --resume '
+                            'to retry only those')
+            checkpoint = None
 
     ######################################################################
     # Output the data
     ######################################################################
 
-    breakpoint()
-    import pickle
-    logging.debug(f'dumping serialized json')
-    pickle.dump(result_tree, open(output_file, 'wb'))
+    profile_output = args.get('profile')
+    if profile_output != '-':
+        # otherwise the profile summary covers these
+        airtable_client.report()
+        betterworks_client.report()
+    if response_cache:
+        logging.info(f'Response cache: {response_cache.hits} hits, {response_cache.misses} misses')
+        response_cache.close()
+
+    if fetch_type != 'bw_users':
+        outputs = {output_file: result_tree}
+    with run_profile.phase('save'):
+        for path, result_tree in outputs.items():
+            logging.debug(f'writing snapshot to {path}')
+            save_tree(result_tree, path)
+    if checkpoint:
+        checkpoint.remove()
+
+    if profile_output == '-':
+        for line in run_profile.summary():
+            logging.info(line)
+    elif profile_output:
+        run_profile.write_json(profile_output)
 
 
 if __name__ == '__main__':
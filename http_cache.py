@@ -0,0 +1,147 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+
+class ResponseCache(object):
+    """
+    A small on-disk cache of decoded JSON API responses, kept in a
+    SQLite file so repeated extractions within the TTL don't have to go
+    back to Airtable or BetterWorks.  Entries are keyed by URL and
+    request parameters.  When the cache grows past max_bytes, the least
+    recently used entries are evicted until it is a tenth below that.
+
+    Safe to share between the crawler's worker threads.  Writes are
+    committed in batches, every COMMIT_EVERY changes or COMMIT_SECONDS,
+    and at close(), rather than one disk sync per request; a crash can
+    only lose recently cached responses.  Hits just note the time in
+    memory, and the used_at column catches up with the next commit.
+    """
+
+    FILENAME = 'responses.sqlite'
+    DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+    COMMIT_EVERY = 200
+    COMMIT_SECONDS = 5
+    # fraction of max_bytes to evict down to
+    EVICT_TO = 0.9
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, ResponseCache.FILENAME)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute("""CREATE TABLE IF NOT EXISTS responses (
+                                key TEXT PRIMARY KEY,
+                                source TEXT,
+                                url TEXT,
+                                body TEXT,
+                                size INTEGER,
+                                fetched_at REAL,
+                                used_at REAL)""")
+        self._db.execute('CREATE INDEX IF NOT EXISTS responses_used_at ON responses (used_at)')
+        self._db.commit()
+        self._total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        # key -> time of the latest hit, not yet written to used_at
+        self._used = {}
+        self._pending = 0
+        self._committed_at = time.monotonic()
+
+    @staticmethod
+    def make_key(url, params=None):
+        params = sorted((params or {}).items())
+        return hashlib.sha256(json.dumps([url, params], default=str).encode('utf-8')).hexdigest()
+
+    def get(self, url, params=None, ttl=None):
+        """
+        Return the cached response body for url and params, or None if
+        there isn't one younger than ttl seconds.
+        """
+        key = ResponseCache.make_key(url, params)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute('SELECT body, fetched_at FROM responses WHERE key = ?',
+                                   (key,)).fetchone()
+            if row is None or (ttl is not None and now - row[1] > ttl):
+                self.misses += 1
+                return None
+            self._used[key] = now
+            self.hits += 1
+            self._changed()
+        logging.debug(f'cache hit for {url} with params {params}')
+        return json.loads(row[0])
+
+    def put(self, source, url, params, body):
+        """
+        Store a decoded response body, then evict old entries if the
+        cache is over its size limit.
+        """
+        key = ResponseCache.make_key(url, params)
+        text = json.dumps(body)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            if row:
+                self._total -= row[0]
+            self._db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)',
+                             (key, source, url, text, len(text), now, now))
+            self._used.pop(key, None)
+            self._total += len(text)
+            if self._total > self.max_bytes:
+                self._evict()
+            self._changed()
+
+    def _changed(self):
+        """
+        Count one change, and commit if a batch is due.  Call with the
+        lock held.
+        """
+        self._pending += 1
+        if self._pending >= ResponseCache.COMMIT_EVERY or \
+                time.monotonic() - self._committed_at >= ResponseCache.COMMIT_SECONDS:
+            self._commit()
+
+    def _commit(self):
+        if self._used:
+            self._db.executemany('UPDATE responses SET used_at = ? WHERE key = ?',
+                                 [(used_at, key) for key, used_at in self._used.items()])
+            self._used.clear()
+        self._db.commit()
+        self._pending = 0
+        self._committed_at = time.monotonic()
+
+    def _evict(self):
+        """
+        Delete least recently used entries until the cache is down to
+        EVICT_TO of max_bytes, so that it isn't over again at the next put.
+        """
+        # eviction goes by used_at, so bring it up to date first
+        self._commit()
+        target = self.max_bytes * ResponseCache.EVICT_TO
+        cursor = self._db.execute('SELECT key, size FROM responses ORDER BY used_at')
+        evicted = []
+        while self._total > target:
+            rows = cursor.fetchmany(100)
+            if not rows:
+                break
+            for key, size in rows:
+                if self._total <= target:
+                    break
+                evicted.append((key,))
+                self._total -= size
+        cursor.close()
+        self._db.executemany('DELETE FROM responses WHERE key = ?', evicted)
+        logging.debug(f'evicted {len(evicted)} cached responses')
+
+    def close(self):
+        with self._lock:
+            self._commit()
+            self._db.close()
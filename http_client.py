@@ -0,0 +1,262 @@
+import bisect
+import logging
+import random
+import re
+import requests
+import threading
+import time
+import urllib.parse
+
+
+class TokenBucket(object):
+    """
+    Thread-safe token bucket rate limiter.  Every request takes a token,
+    tokens refill at rate per second up to capacity, and acquire()
+    blocks until one is available.  pause() stops all callers for a
+    while, e.g. when the server answers 429 Too Many Requests.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now >= self.paused_until:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                else:
+                    wait = self.paused_until - now
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.updated = self.paused_until
+            self.tokens = 0
+
+
+class EndpointStats(object):
+    """
+    Request count, errors, retries, bytes received, latencies, and time
+    spent waiting on the rate limit or backing off, for one endpoint.
+    """
+
+    # upper bounds, in seconds, of the latency histogram buckets
+    LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf'))
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.bytes = 0
+        self.rate_limited = 0.0
+        self.backoff = 0.0
+        self.latencies = []
+
+    def histogram(self):
+        """
+        Return the number of requests in each latency bucket, as a list
+        parallel to LATENCY_BUCKETS.
+        """
+        counts = [0] * len(EndpointStats.LATENCY_BUCKETS)
+        for latency in self.latencies:
+            counts[bisect.bisect_left(EndpointStats.LATENCY_BUCKETS, latency)] += 1
+        return counts
+
+    def percentiles(self):
+        latencies = sorted(self.latencies)
+        if not latencies:
+            return {}
+        return {'mean': sum(latencies) / len(latencies),
+                'p50': latencies[len(latencies) // 2],
+                'p95': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+                'max': latencies[-1]}
+
+    def as_dict(self):
+        return {'requests': self.requests,
+                'errors': self.errors,
+                'retries': self.retries,
+                'bytes': self.bytes,
+                'rate_limited_seconds': self.rate_limited,
+                'backoff_seconds': self.backoff,
+                'latency': self.percentiles(),
+                'latency_histogram': {('inf' if bound == float('inf') else str(bound)): count
+                                      for bound, count in zip(EndpointStats.LATENCY_BUCKETS, self.histogram())}}
+
+    def summary(self):
+        text = f'{self.requests} requests, {self.errors} errors, {self.retries} retries, {self.bytes} bytes'
+        if self.rate_limited or self.backoff:
+            text += f', {self.rate_limited:.1f}s rate limited, {self.backoff:.1f}s backing off'
+        latency = self.percentiles()
+        if not latency:
+            return text
+        return (f'{text}, latency mean {latency["mean"]:.3f}s p50 {latency["p50"]:.3f}s '
+                f'p95 {latency["p95"]:.3f}s max {latency["max"]:.3f}s')
+
+
+class ServiceClient(object):
+    """
+    All requests to one API service go through one of these.  It owns a
+    pooled keep-alive Session carrying the service's auth headers, sets
+    connect and read timeouts, retries connection errors and 5xx
+    responses with jittered exponential backoff, waits out 429s, and
+    keeps latency statistics per endpoint.  An optional ResponseCache
+    and TokenBucket are consulted before each request.
+
+    Safe to share between threads.
+    """
+
+    DEFAULT_TIMEOUT = (5, 60)  # seconds to connect, seconds to read
+    DEFAULT_MAX_RETRIES = 4
+    DEFAULT_BACKOFF = 0.5
+    MAX_BACKOFF = 30
+    DEFAULT_RETRY_AFTER = 30
+    DEFAULT_POOL_SIZE = 16
+    RETRY_STATUSES = {500, 502, 503, 504}
+
+    def __init__(self, name, base_url, headers, rate_limiter=None, cache=None, cache_ttl=None,
+                 timeout=DEFAULT_TIMEOUT, max_retries=DEFAULT_MAX_RETRIES,
+                 backoff=DEFAULT_BACKOFF, pool_size=DEFAULT_POOL_SIZE):
+        self.name = name
+        self.base_url = base_url.rstrip('/') + '/'
+        self.rate_limiter = rate_limiter
+        self.cache = cache
+        self.cache_ttl = cache_ttl
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.stats = {}
+        self._stats_lock = threading.Lock()
+
+    def url(self, path):
+        """
+        Resolve a path against the service's base URL.  Absolute URLs,
+        such as pagination links, are returned unchanged.
+        """
+        return urllib.parse.urljoin(self.base_url, path)
+
+    @staticmethod
+    def endpoint(url):
+        """
+        Group URLs for statistics by path, with numeric IDs collapsed.
+        """
+        path = urllib.parse.urlparse(url).path
+        return re.sub(r'/\d+(?=/|$)', '/{id}', path)
+
+    def endpoint_stats(self, url):
+        key = ServiceClient.endpoint(url)
+        with self._stats_lock:
+            if key not in self.stats:
+                self.stats[key] = EndpointStats()
+            return self.stats[key]
+
+    def retry_delay(self, attempt):
+        """
+        Full-jitter exponential backoff.
+        """
+        return random.uniform(0, min(ServiceClient.MAX_BACKOFF, self.backoff * 2 ** attempt))
+
+    @staticmethod
+    def retry_after(response):
+        """
+        Return how many seconds a 429 response asks us to wait.
+        """
+        try:
+            return float(response.headers.get('Retry-After', ServiceClient.DEFAULT_RETRY_AFTER))
+        except ValueError:
+            # an HTTP date rather than a number of seconds
+            return ServiceClient.DEFAULT_RETRY_AFTER
+
+    def get_json(self, path, params=None, cached=True):
+        """
+        GET path and return the decoded JSON body.  Client errors are
+        returned as they are, so callers can report the service's own
+        reason; server and connection errors are retried, and raised
+        once retries run out.  cached=False always asks the service, and
+        leaves the cache alone, for answers that must be current.
+        """
+        url = self.url(path)
+        if self.cache and cached:
+            body = self.cache.get(url, params, ttl=self.cache_ttl)
+            if body is not None:
+                return body
+
+        stats = self.endpoint_stats(url)
+        attempt = 0
+        while True:
+            if self.rate_limiter:
+                waited = time.monotonic()
+                self.rate_limiter.acquire()
+                waited = time.monotonic() - waited
+                with self._stats_lock:
+                    stats.rate_limited += waited
+            logging.debug(f'making request to {url} with params {params}')
+            start = time.monotonic()
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout)
+                error = None
+            except (requests.ConnectionError, requests.Timeout) as e:
+                response = None
+                error = e
+            elapsed = time.monotonic() - start
+            with self._stats_lock:
+                stats.requests += 1
+                stats.latencies.append(elapsed)
+                if response is not None:
+                    stats.bytes += len(response.content)
+
+            if response is not None and response.status_code == 429:
+                reason = 'HTTP 429'
+                delay = ServiceClient.retry_after(response)
+            elif response is not None and response.status_code not in ServiceClient.RETRY_STATUSES:
+                break
+            else:
+                with self._stats_lock:
+                    stats.errors += 1
+                reason = error or f'HTTP {response.status_code}'
+                delay = self.retry_delay(attempt)
+
+            if attempt >= self.max_retries:
+                raise Exception(f'{self.name} request to {url} failed after {attempt + 1} attempts: {reason}')
+            logging.warning(f'{self.name} request to {url} failed with {reason}; retrying in {delay:.1f} seconds')
+            if reason == 'HTTP 429' and self.rate_limiter:
+                # hold back every thread using this service, not just
+                # this one; the wait is counted when acquiring next time
+                self.rate_limiter.pause(delay)
+            else:
+                time.sleep(delay)
+            attempt += 1
+            with self._stats_lock:
+                stats.retries += 1
+                if reason == 'HTTP 429' and not self.rate_limiter:
+                    stats.rate_limited += delay
+                elif reason != 'HTTP 429':
+                    stats.backoff += delay
+
+        body = response.json()
+        if self.cache and cached and response.ok:
+            self.cache.put(self.name, url, params, body)
+        return body
+
+    def report(self):
+        """
+        Log latency statistics for each endpoint used.
+        """
+        for endpoint, stats in sorted(self.stats.items()):
+            logging.info(f'{self.name} {endpoint}: {stats.summary()}')
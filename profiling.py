@@ -0,0 +1,80 @@
+import contextlib
+import json
+import threading
+import time
+
+
+class RunProfile(object):
+    """
+    Where one extraction run spends its time.  Collects wall time per
+    phase, named counters in groups (such as nodes added or orphaned per
+    Airtable table), and the per-endpoint request statistics of the
+    ServiceClients used, and reports them as text or JSON.
+
+    Counting is cheap and always on; reporting is up to the caller.
+    Safe to share between threads.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.phases = {}
+        self.counters = {}
+        self.clients = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Add the wall time of the with block to phase name.  Phases may
+        be entered more than once, e.g. once per crawl level.
+        """
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - start
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0) + elapsed
+
+    def count(self, group, name, n=1):
+        with self._lock:
+            counters = self.counters.setdefault(group, {})
+            counters[name] = counters.get(name, 0) + n
+
+    def add_client(self, client):
+        """
+        Include a ServiceClient's endpoint statistics in the report.
+        """
+        self.clients.append(client)
+
+    def as_dict(self):
+        return {'wall_seconds': time.monotonic() - self.started,
+                'phases': dict(self.phases),
+                'counters': {group: dict(counters) for group, counters in self.counters.items()},
+                'endpoints': {client.name: {endpoint: stats.as_dict()
+                                            for endpoint, stats in sorted(client.stats.items())}
+                              for client in self.clients if client.stats}}
+
+    def summary(self):
+        """
+        Return the report as lines of text.
+        """
+        report = self.as_dict()
+        lines = [f'Total wall time {report["wall_seconds"]:.2f}s']
+        for name, seconds in self.phases.items():
+            lines.append(f'  {name}: {seconds:.2f}s')
+        for group, counters in report['counters'].items():
+            lines.append(f'{group}:')
+            for name, count in counters.items():
+                lines.append(f'  {name}: {count}')
+        for client in self.clients:
+            for endpoint, stats in sorted(client.stats.items()):
+                lines.append(f'{client.name} {endpoint}: {stats.summary()}')
+                histogram = ', '.join(f'<={bound}s: {count}' for bound, count
+                                      in stats.as_dict()['latency_histogram'].items() if count)
+                lines.append(f'  latency histogram {histogram}')
+        return lines
+
+    def write_json(self, path):
+        with open(path, 'w') as file:
+            json.dump(self.as_dict(), file, indent=2)
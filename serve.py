@@ -0,0 +1,346 @@
+import argparse
+import convert
+import gzip
+import hashlib
+import http.server
+import io
+import json
+import logging
+import os
+import shlex
+import snapshot
+import subprocess
+import sys
+import threading
+import time
+import treelib_json_to_d3
+import urllib.parse
+
+# URL suffix -> Content-Type of each rendering
+FORMATS = {'json': 'application/json',
+           'ndjson': 'application/x-ndjson',
+           'csv': 'text/csv; charset=utf-8',
+           'txt': 'text/plain; charset=utf-8',
+           'd3.json': 'application/json'}
+
+# Bodies smaller than this aren't worth gzipping
+GZIP_MIN_BYTES = 1024
+
+
+class Rendering(object):
+    """
+    One precomputed response: the body, its gzipped form, and ETags
+    derived from the body, so that an unchanged tree keeps its ETags
+    across refreshes.  The gzipped form has its own strong ETag, since
+    its bytes differ from the body's.
+    """
+
+    __slots__ = ('body', 'gzipped', 'etag', 'gzip_etag', 'content_type')
+
+    def __init__(self, body, content_type):
+        self.body = body
+        self.gzipped = gzip.compress(body) if len(body) >= GZIP_MIN_BYTES else None
+        digest = hashlib.blake2b(body, digest_size=16).hexdigest()
+        self.etag = f'"{digest}"'
+        self.gzip_etag = f'"{digest}-gzip"'
+        self.content_type = content_type
+
+
+def render_tree(tree, formats, trim, max_depth, multi_parent):
+    """
+    Return format -> Rendering for tree, with every rendering written
+    in one walk of the tree.
+    """
+    streams = {output_type: io.StringIO() for output_type in formats}
+    writers = {'json': convert.JsonWriter, 'ndjson': convert.NdjsonWriter,
+               'csv': convert.CsvWriter, 'txt': convert.TextWriter}
+    convert.walk_tree(tree, [treelib_json_to_d3.D3Writer(stream, trim, max_depth) if output_type == 'd3.json'
+                             else writers[output_type](stream)
+                             for output_type, stream in streams.items()],
+                      multi_parent)
+    return {output_type: Rendering(stream.getvalue().encode('utf-8'), FORMATS[output_type])
+            for output_type, stream in streams.items()}
+
+
+class Source(object):
+    """
+    One tree kept up to date by re-running extract.py with
+    extract_args every refresh_seconds, in a background thread.  Each
+    new tree is rendered in full before it replaces the old renderings
+    in a single assignment, so requests always see one complete
+    version.  If an extraction fails, the last good version is kept.
+
+    The snapshot lives in data_dir as NAME.snapshot, and is loaded at
+    startup if it is there, so a restart serves the last tree straight
+    away.  With incremental, each refresh passes it to extract.py as
+    --incremental.
+    """
+
+    def __init__(self, name, extract_args, data_dir, refresh_seconds, render_options, incremental=False):
+        self.name = name
+        self.extract_args = extract_args
+        self.snapshot_file = os.path.join(data_dir, f'{name}.snapshot')
+        self.refresh_seconds = refresh_seconds
+        self.render_options = render_options
+        self.incremental = incremental
+        # format -> Rendering; replaced whole, never changed in place
+        self.renderings = {}
+        self.refreshed_at = None
+        self.last_error = None
+        self.refresh_requested = threading.Event()
+
+    def load(self):
+        """
+        Render the snapshot file and swap the result in.
+        """
+        tree = convert.load_tree(self.snapshot_file)
+        try:
+            renderings = render_tree(tree, **self.render_options)
+            node_count = len(tree)
+        finally:
+            # legacy pickled trees have nothing to close
+            if isinstance(tree, snapshot.Snapshot):
+                tree.close()
+        self.renderings = renderings
+        self.refreshed_at = time.time()
+        logging.info(f'{self.name}: serving {node_count} nodes from {self.snapshot_file}')
+
+    def refresh(self):
+        """
+        Run extract.py into a temporary file, move it over the snapshot
+        file and load it.
+        """
+        temporary_file = f'{self.snapshot_file}.new'
+        command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'extract.py')]
+        command.extend(shlex.split(self.extract_args))
+        command.extend(['--output_file', temporary_file])
+        if self.incremental and os.path.exists(self.snapshot_file):
+            command.extend(['--incremental', self.snapshot_file])
+        logging.info(f'{self.name}: refreshing')
+        started = time.monotonic()
+        result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        if result.returncode:
+            raise Exception(f'extract.py exited with {result.returncode}: {result.stderr.strip()[-500:]}')
+        # the old snapshot stays readable by anyone who has it open
+        os.replace(temporary_file, self.snapshot_file)
+        self.load()
+        logging.info(f'{self.name}: refreshed in {time.monotonic() - started:.1f}s')
+
+    def run(self):
+        """
+        Refresh now and then every refresh_seconds, or sooner when
+        refresh_requested is set, until the process ends.
+        """
+        while True:
+            try:
+                self.refresh()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                logging.error(f'{self.name}: refresh failed, still serving the previous tree: {e}')
+            self.refresh_requested.wait(self.refresh_seconds)
+            self.refresh_requested.clear()
+
+    def status(self):
+        return {'refreshed_at': self.refreshed_at,
+                'last_error': self.last_error,
+                'formats': {output_type: {'path': f'/{self.name}.{output_type}', 'etag': rendering.etag,
+                                          'bytes': len(rendering.body)}
+                            for output_type, rendering in self.renderings.items()}}
+
+
+class KeepAliveHandler(http.server.BaseHTTPRequestHandler):
+    """
+    A request handler that keeps connections open between requests and
+    sends small responses without delay.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    # headers and body go out in separate writes; without this, Nagle's
+    # algorithm and delayed ACKs add ~40ms to every keep-alive response
+    disable_nagle_algorithm = True
+
+
+class ServeHandler(KeepAliveHandler):
+    """
+    GET /NAME.FORMAT returns a source's precomputed rendering, or 304
+    if If-None-Match has its current ETag.  GET / lists the sources and
+    their state.  HEAD sends the same headers as GET without the body.
+    POST /NAME/refresh starts a refresh now.
+    """
+
+    def log_message(self, format, *args):
+        logging.debug(f'{self.address_string()} {format % args}')
+
+    def send_body(self, status, content, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(content)
+
+    def send_json(self, body, status=200):
+        self.send_body(status, json.dumps(body).encode('utf-8'), 'application/json')
+
+    def do_GET(self):
+        sources = self.server.sources
+        path = urllib.parse.urlparse(self.path).path
+        if path == '/':
+            self.send_json({name: source.status() for name, source in sources.items()})
+            return
+
+        name, _, output_type = path.lstrip('/').partition('.')
+        source = sources.get(name)
+        # read the renderings once, in case a refresh swaps them meanwhile
+        rendering = source.renderings.get(output_type) if source else None
+        if rendering is None:
+            if source and output_type in FORMATS and not source.renderings:
+                self.send_json({'error': f'{name} has not been extracted yet'}, 503)
+            else:
+                self.send_json({'error': 'not found'}, 404)
+            return
+
+        use_gzip = rendering.gzipped and 'gzip' in self.headers.get('Accept-Encoding', '')
+        headers = {'ETag': rendering.gzip_etag if use_gzip else rendering.etag, 'Cache-Control': 'no-cache',
+                   'Vary': 'Accept-Encoding'}
+        # either encoding of the same body is still fresh
+        client_tags = {tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')}
+        if client_tags & {rendering.etag, rendering.gzip_etag}:
+            self.send_response(304)
+            for header, value in headers.items():
+                self.send_header(header, value)
+            self.end_headers()
+            return
+        if use_gzip:
+            headers['Content-Encoding'] = 'gzip'
+            self.send_body(200, rendering.gzipped, rendering.content_type, headers)
+        else:
+            self.send_body(200, rendering.body, rendering.content_type, headers)
+
+    def do_HEAD(self):
+        # send_body() leaves the body out of HEAD responses
+        self.do_GET()
+
+    def do_POST(self):
+        name, _, action = urllib.parse.urlparse(self.path).path.strip('/').partition('/')
+        source = self.server.sources.get(name)
+        if not source or action != 'refresh':
+            self.send_json({'error': 'not found'}, 404)
+            return
+        source.refresh_requested.set()
+        self.send_json({'refreshing': name}, 202)
+
+
+def main():
+    """
+    Keep extracted trees in memory and serve them over HTTP in every
+    output format, re-extracting each on a schedule in the background,
+    so dashboards get current data without waiting for a crawl.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--source',
+                        nargs=2,
+                        action='append',
+                        required=True,
+                        metavar=('NAME', 'EXTRACT_ARGS'),
+                        help="""A tree to serve, as a name for its URLs and the arguments to
+                        give extract.py, e.g. --source plan "airtable appXXXXXXXXXXXXXX".
+                        Repeat for more trees.""")
+
+    parser.add_argument('--refresh_minutes',
+                        type=float,
+                        help='How often to re-extract each tree.',
+                        default=60)
+
+    parser.add_argument('--incremental',
+                        action='store_true',
+                        help="""Refresh each tree by passing its last snapshot to extract.py
+                        as --incremental, rather than extracting it from scratch.""")
+
+    parser.add_argument('--data_dir',
+                        type=str,
+                        help="""Directory for the snapshot files.  Snapshots already there
+                        are served at startup, before the first refresh finishes.""",
+                        default='serve_data')
+
+    parser.add_argument('--host',
+                        type=str,
+                        help='Address to listen on.',
+                        default='127.0.0.1')
+
+    parser.add_argument('--port',
+                        type=int,
+                        default=8000)
+
+    parser.add_argument('--formats',
+                        nargs='+',
+                        choices=list(FORMATS),
+                        default=list(FORMATS),
+                        help='Renderings to precompute and serve.')
+
+    parser.add_argument('--trim',
+                        type=int,
+                        help='For d3.json, limit node titles to this many characters.',
+                        default=30)
+
+    parser.add_argument('--max_depth',
+                        type=int,
+                        help='For d3.json, truncate the tree after this many levels.')
+
+    parser.add_argument('--multi_parent',
+                        choices=convert.MULTI_PARENT_MODES,
+                        default='first',
+                        help='How to show Airtable records with more than one parent; see convert.py.')
+
+    parser.add_argument('--debug',
+                        action='store_true',
+                        help="""Set true to see additional logging.""")
+
+    args = vars(parser.parse_args())
+
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)-8s %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S %z',
+        level=logging.DEBUG if args.get('debug') else logging.INFO)
+
+    data_dir = args.get('data_dir')
+    os.makedirs(data_dir, exist_ok=True)
+    render_options = {'formats': args.get('formats'),
+                      'trim': args.get('trim'),
+                      'max_depth': args.get('max_depth'),
+                      'multi_parent': args.get('multi_parent')}
+    sources = {}
+    for name, extract_args in args.get('source'):
+        if not name or '.' in name or '/' in name:
+            parser.error(f'source name {name!r} must be non-empty and have no "." or "/"')
+        if 'bw_users' in shlex.split(extract_args):
+            # bw_users writes a snapshot per user to --output_pattern, not one
+            # to --output_file, so there would be nothing to serve
+            parser.error(f'source {name!r}: bw_users extractions cannot be served; use bw_goal or bw_user')
+        sources[name] = Source(name, extract_args, data_dir, args.get('refresh_minutes') * 60,
+                               render_options, args.get('incremental'))
+
+    for source in sources.values():
+        if os.path.exists(source.snapshot_file):
+            try:
+                source.load()
+            except Exception as e:
+                logging.warning(f'{source.name}: could not load {source.snapshot_file}: {e}')
+        threading.Thread(target=source.run, name=source.name, daemon=True).start()
+
+    server = http.server.ThreadingHTTPServer((args.get('host'), args.get('port')), ServeHandler)
+    server.sources = sources
+    logging.info(f'Serving {", ".join(sources)} on http://{args.get("host")}:{args.get("port")}/')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
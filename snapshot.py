@@ -0,0 +1,379 @@
+"""
+A compact, versioned binary file for a whole tree, replacing pickled
+treelib objects.  Nodes are numbered breadth first from the root, which
+is node 0, so every parent comes before its children.
+
+    header      magic, version, counts, and the offset of each section
+    strings     offsets into a UTF-8 blob; every identifier, tag, data
+                key and data value is stored once here
+    ids         per node, the string index of its JSON-encoded identifier
+    tags        per node, the string index of its tag
+    parents     per node, the parent's node index (-1 for the root)
+    children    CSR layout: child_offsets[i]:child_offsets[i + 1] is the
+                slice of child_indexes holding node i's children
+    data        CSR layout as for children, over parallel arrays of key
+                string indexes and JSON-encoded value string indexes;
+                data_flags[i] is 1 if node i has a data dict at all
+    hashes      per node, a 16-byte digest of its subtree: its identifier,
+                tag and data, and its children's digests in sorted order,
+                so two nodes with equal digests have identical subtrees
+                (version 2 and later)
+
+All integers are little-endian.  Snapshot reads the file through mmap
+and only decodes the nodes that are asked for.
+"""
+import array
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+
+
+MAGIC = b'WTSNAP\0\0'
+VERSION = 2
+
+# magic, version, node count, string count, data pair count, metadata
+# string index, a reserved word, then the offset of each section in SECTIONS
+HEADER = struct.Struct('<8sIIIIII12Q')
+SECTIONS = ('string_offsets', 'string_blob', 'ids', 'tags', 'parents',
+            'child_offsets', 'child_indexes', 'data_offsets', 'data_keys', 'data_values', 'data_flags',
+            'hashes')
+TYPECODES = {'string_offsets': 'Q', 'ids': 'I', 'tags': 'I', 'parents': 'i',
+             'child_offsets': 'I', 'child_indexes': 'I', 'data_offsets': 'I',
+             'data_keys': 'I', 'data_values': 'I', 'data_flags': 'B', 'hashes': 'B'}
+NO_METADATA = 0xFFFFFFFF
+HASH_SIZE = 16
+
+# Header layout and sections of each version that can still be read
+HEADERS = {1: struct.Struct('<8sIIIIII11Q'), 2: HEADER}
+VERSION_SECTIONS = {1: SECTIONS[:-1], 2: SECTIONS}
+
+
+def is_snapshot(path):
+    """
+    True if the file at path starts like a snapshot.
+    """
+    with open(path, 'rb') as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def node_digest(identifier, tag, data, child_digests):
+    """
+    Return the subtree digest of a node, given the digests of its
+    children in any order.
+    """
+    tag = tag if isinstance(tag, str) else str(tag)
+    content = json.dumps([identifier, tag, data], sort_keys=True, default=str).encode('utf-8')
+    digest = hashlib.blake2b(content, digest_size=HASH_SIZE)
+    for child_digest in sorted(child_digests):
+        digest.update(child_digest)
+    return digest.digest()
+
+
+def subtree_digests(tree):
+    """
+    Return a dict of identifier -> subtree digest for every node of a
+    treelib-style tree, computed as write_snapshot() stores them.
+    """
+    order = [tree.get_node(tree.root)]
+    parent_position = [None]
+    for position, node in enumerate(order):
+        for child in tree.children(node.identifier):
+            order.append(child)
+            parent_position.append(position)
+    child_digests = [[] for node in order]
+    digests = {}
+    for position in range(len(order) - 1, -1, -1):
+        node = order[position]
+        digest = node_digest(node.identifier, node.tag, node.data, child_digests[position])
+        digests[node.identifier] = digest
+        if parent_position[position] is not None:
+            child_digests[parent_position[position]].append(digest)
+    return digests
+
+
+def write_snapshot(tree, path, metadata=None):
+    """
+    Save a treelib-style tree (anything with root, get_node() and
+    children()) to path.  metadata is an optional JSON-serializable dict
+    of tree-level information, such as when the source was last synced.
+    The file is written to a temporary name and then moved into place.
+    """
+    strings = {}
+
+    def intern(text):
+        index = strings.get(text)
+        if index is None:
+            index = strings[text] = len(strings)
+        return index
+
+    arrays = {name: array.array(typecode) for name, typecode in TYPECODES.items()}
+    arrays['child_offsets'].append(0)
+    arrays['data_offsets'].append(0)
+
+    order = [tree.get_node(tree.root)]
+    index_of = {order[0].identifier: 0}
+    parent_index = [-1]
+    position = 0
+    while position < len(order):
+        node = order[position]
+        arrays['ids'].append(intern(json.dumps(node.identifier)))
+        arrays['tags'].append(intern(node.tag if isinstance(node.tag, str) else str(node.tag)))
+        arrays['parents'].append(parent_index[position])
+        for child in tree.children(node.identifier):
+            index_of[child.identifier] = len(order)
+            order.append(child)
+            parent_index.append(position)
+            arrays['child_indexes'].append(index_of[child.identifier])
+        arrays['child_offsets'].append(len(arrays['child_indexes']))
+        data = node.data
+        if isinstance(data, dict):
+            arrays['data_flags'].append(1)
+            for key, value in data.items():
+                arrays['data_keys'].append(intern(str(key)))
+                arrays['data_values'].append(intern(json.dumps(value)))
+        else:
+            arrays['data_flags'].append(0)
+        arrays['data_offsets'].append(len(arrays['data_keys']))
+        position += 1
+
+    # Subtree digests, leaves first; nodes are in breadth first order, so
+    # every child comes after its parent
+    child_digests = [[] for node in order]
+    digests = [None] * len(order)
+    for position in range(len(order) - 1, -1, -1):
+        node = order[position]
+        digests[position] = node_digest(node.identifier, node.tag, node.data, child_digests[position])
+        if parent_index[position] >= 0:
+            child_digests[parent_index[position]].append(digests[position])
+    arrays['hashes'].frombytes(b''.join(digests))
+
+    metadata_index = intern(json.dumps(metadata)) if metadata else NO_METADATA
+    blob = bytearray()
+    for text in strings:
+        arrays['string_offsets'].append(len(blob))
+        blob.extend(text.encode('utf-8'))
+    arrays['string_offsets'].append(len(blob))
+    sections = dict(arrays, string_blob=blob)
+
+    if sys.byteorder != 'little':
+        for values in arrays.values():
+            values.byteswap()
+
+    offsets = []
+    offset = HEADER.size
+    for name in SECTIONS:
+        # align every section to 8 bytes so mmap views can be cast in place
+        offset += -offset % 8
+        offsets.append(offset)
+        offset += len(memoryview(sections[name]).cast('B'))
+
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION, len(order), len(strings),
+                               len(arrays['data_keys']), metadata_index, 0, *offsets))
+        for name, offset in zip(SECTIONS, offsets):
+            file.write(b'\0' * (offset - file.tell()))
+            file.write(memoryview(sections[name]).cast('B'))
+    os.replace(temp_path, path)
+
+
+class SnapshotNode(object):
+    """
+    A lazily decoded view of one node, with the attributes of a treelib
+    Node that the reports use.
+    """
+
+    __slots__ = ('snapshot', 'index', '_identifier', '_data')
+
+    def __init__(self, snapshot, index):
+        self.snapshot = snapshot
+        self.index = index
+        self._identifier = None
+        self._data = None
+
+    @property
+    def identifier(self):
+        if self._identifier is None:
+            self._identifier = json.loads(self.snapshot.string(self.snapshot.ids[self.index]))
+            self.snapshot.remember(self._identifier, self.index)
+        return self._identifier
+
+    @property
+    def tag(self):
+        return self.snapshot.string(self.snapshot.tags[self.index])
+
+    @property
+    def data(self):
+        if self._data is None and self.snapshot.data_flags[self.index]:
+            snapshot = self.snapshot
+            start, end = snapshot.data_offsets[self.index], snapshot.data_offsets[self.index + 1]
+            self._data = {snapshot.string(snapshot.data_keys[i]): json.loads(snapshot.string(snapshot.data_values[i]))
+                          for i in range(start, end)}
+        return self._data
+
+    def __lt__(self, other):
+        return self.tag < other.tag
+
+    def __repr__(self):
+        return f'SnapshotNode(tag={self.tag!r}, identifier={self.identifier!r})'
+
+
+class Snapshot(object):
+    """
+    A read-only tree loaded from a snapshot file through mmap.  Nothing
+    is decoded until asked for, and nothing decoded is kept, so walking
+    the whole tree takes no more memory than the nodes the caller holds
+    on to.  Supports the parts of the treelib Tree interface that the
+    reports use: root, get_node(), children(), parent(), all_nodes_itr()
+    and len().
+    """
+
+    # identifiers of the most recently decoded nodes to remember, since
+    # a walk usually asks for the children of a node it was just given
+    RECENT_IDS = 4096
+
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = struct.unpack_from('<8sI', self.mmap)
+        if magic != MAGIC:
+            raise Exception(f'{path} is not a snapshot file')
+        if version not in HEADERS:
+            raise Exception(f'{path} is snapshot version {version}; this code reads up to {VERSION}')
+        self.version = version
+        header = HEADERS[version].unpack_from(self.mmap)
+        self.node_count, string_count, data_count, metadata_index, _ = header[2:7]
+        lengths = {'string_offsets': string_count + 1, 'ids': self.node_count, 'tags': self.node_count,
+                   'parents': self.node_count, 'child_offsets': self.node_count + 1,
+                   'child_indexes': max(self.node_count - 1, 0), 'data_offsets': self.node_count + 1,
+                   'data_keys': data_count, 'data_values': data_count, 'data_flags': self.node_count,
+                   'hashes': self.node_count * HASH_SIZE}
+        view = memoryview(self.mmap)
+        offsets = dict(zip(VERSION_SECTIONS[version], header[7:]))
+        # snapshots from before subtree digests were stored have none
+        self.hashes = None
+        for name, typecode in TYPECODES.items():
+            if name not in offsets:
+                continue
+            size = struct.calcsize(typecode)
+            section = view[offsets[name]:offsets[name] + lengths[name] * size]
+            if sys.byteorder == 'little':
+                setattr(self, name, section.cast(typecode))
+            else:
+                values = array.array(typecode, section)
+                values.byteswap()
+                setattr(self, name, values)
+        self.blob_offset = offsets['string_blob']
+        self.metadata = json.loads(self.string(metadata_index)) if metadata_index != NO_METADATA else {}
+        # identifier -> node index, for the last RECENT_IDS decoded
+        self.recent_ids = {}
+        # node indexes sorted by the bytes of their JSON identifiers, for
+        # finding any other identifier; built the first time it's needed
+        self.id_order = None
+        self.root = self.node(0).identifier
+
+    def string(self, index):
+        return self.string_bytes(index).decode('utf-8')
+
+    def string_bytes(self, index):
+        start = self.blob_offset + self.string_offsets[index]
+        end = self.blob_offset + self.string_offsets[index + 1]
+        return self.mmap[start:end]
+
+    def node(self, index):
+        return SnapshotNode(self, index)
+
+    def remember(self, nid, index):
+        if nid not in self.recent_ids:
+            if len(self.recent_ids) >= Snapshot.RECENT_IDS:
+                del self.recent_ids[next(iter(self.recent_ids))]
+            self.recent_ids[nid] = index
+
+    def lookup(self, nid):
+        """
+        Return the node index for identifier nid, or raise KeyError.
+        Recently decoded identifiers are known; anything else is a
+        binary search of id_order, reading identifiers from the file.
+        """
+        index = self.recent_ids.get(nid)
+        if index is not None:
+            return index
+        if self.id_order is None:
+            self.id_order = array.array('I', sorted(range(self.node_count),
+                                                    key=lambda index: self.string_bytes(self.ids[index])))
+        target = json.dumps(nid).encode('utf-8')
+        low, high = 0, self.node_count
+        while low < high:
+            middle = (low + high) // 2
+            if self.string_bytes(self.ids[self.id_order[middle]]) < target:
+                low = middle + 1
+            else:
+                high = middle
+        if low == self.node_count or self.string_bytes(self.ids[self.id_order[low]]) != target:
+            raise KeyError(nid)
+        self.remember(nid, self.id_order[low])
+        return self.id_order[low]
+
+    def __len__(self):
+        return self.node_count
+
+    def __contains__(self, nid):
+        try:
+            self.lookup(nid)
+            return True
+        except KeyError:
+            return False
+
+    def get_node(self, nid):
+        return self.node(self.lookup(nid))
+
+    def children(self, nid):
+        index = self.lookup(nid)
+        return [self.node(child) for child in
+                self.child_indexes[self.child_offsets[index]:self.child_offsets[index + 1]]]
+
+    def parent(self, nid):
+        parent = self.parents[self.lookup(nid)]
+        return self.node(parent) if parent >= 0 else None
+
+    def subtree_digest(self, nid):
+        """
+        Return the stored digest of nid's subtree, or None if this
+        snapshot predates them.
+        """
+        if self.hashes is None:
+            return None
+        index = self.lookup(nid)
+        return bytes(self.hashes[index * HASH_SIZE:(index + 1) * HASH_SIZE])
+
+    def all_nodes_itr(self):
+        return (self.node(index) for index in range(self.node_count))
+
+    def to_tree(self, tree):
+        """
+        Copy the snapshot into tree, an empty treelib Tree or one with
+        only a root node, and return it.
+        """
+        root = self.node(0)
+        if tree.root is None:
+            tree.create_node(root.tag, identifier=root.identifier, data=root.data)
+        else:
+            tree.update_node(tree.root, tag=root.tag, data=root.data)
+            if tree.root != root.identifier:
+                tree.update_node(tree.root, identifier=root.identifier)
+        for index in range(1, self.node_count):
+            node = self.node(index)
+            tree.create_node(node.tag, identifier=node.identifier,
+                             parent=self.node(self.parents[index]).identifier, data=node.data)
+        return tree
+
+    def close(self):
+        self.recent_ids.clear()
+        for name in TYPECODES:
+            values = getattr(self, name)
+            if isinstance(values, memoryview):
+                values.release()
+        self.mmap.close()
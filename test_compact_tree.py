@@ -0,0 +1,155 @@
+import random
+import unittest
+
+import treelib
+
+import compact_tree
+import extract
+
+
+def build(tree, operations):
+    """
+    Apply (method name, args, kwargs) operations to tree, and return it.
+    """
+    for name, args, kwargs in operations:
+        getattr(tree, name)(*args, **kwargs)
+    return tree
+
+
+def random_operations(rng, size):
+    """
+    Operations that build a random tree of size nodes under
+    RootedTree's root, and the identifiers of those nodes.
+    """
+    operations = []
+    identifiers = [extract.RootedTree.ROOT_ID]
+    for number in range(size):
+        # a mix of Airtable-style string and BetterWorks-style integer IDs
+        identifier = number if number % 2 else f'rec{number}'
+        # repeated tags, so sorting has ties to keep in order
+        operations.append(('create_node', (f'node {rng.randrange(size // 2 + 1)}',),
+                           {'identifier': identifier, 'parent': rng.choice(identifiers),
+                            'data': rng.choice([None, {'node_type': 'Outcomes', 'owner': rng.choice('AB')},
+                                                {'node_type': 'Goal', 'start': '2026-01-01', 'end': None}])}))
+        identifiers.append(identifier)
+    return operations, identifiers[1:]
+
+
+class CompactTreeTest(unittest.TestCase):
+
+    def assertSameTree(self, compact, tree):
+        self.assertEqual(compact.root, tree.root)
+        self.assertEqual(len(compact), len(tree))
+        for with_data in (False, True):
+            for sort in (False, True):
+                self.assertEqual(compact.to_dict(with_data=with_data, sort=sort),
+                                 tree.to_dict(with_data=with_data, sort=sort))
+        for node in tree.all_nodes_itr():
+            identifier = node.identifier
+            self.assertIn(identifier, compact)
+            self.assertEqual(compact.get_node(identifier).tag, node.tag)
+            self.assertEqual(compact.get_node(identifier).data, node.data)
+            parent = tree.parent(identifier)
+            compact_parent = compact.parent(identifier)
+            self.assertEqual(compact_parent.identifier if compact_parent else None,
+                             parent.identifier if parent else None)
+            self.assertEqual([child.identifier for child in compact.children(identifier)],
+                             [child.identifier for child in tree.children(identifier)])
+
+    def random_trees(self, seed, size=60):
+        rng = random.Random(seed)
+        operations, identifiers = random_operations(rng, size)
+        return (build(extract.CompactRootedTree(), operations), build(extract.RootedTree(), operations),
+                identifiers, rng)
+
+    def test_create_node(self):
+        for seed in range(20):
+            with self.subTest(seed=seed):
+                compact, tree, identifiers, rng = self.random_trees(seed)
+                self.assertSameTree(compact, tree)
+                self.assertIsInstance(compact.get_node(identifiers[0]), compact_tree.CompactNode)
+                self.assertIsNone(compact.get_node('missing'))
+
+    def test_traversal(self):
+        compact, tree, identifiers, rng = self.random_trees(1, 200)
+        for nid in [None, identifiers[0], identifiers[5]]:
+            for mode in (treelib.Tree.DEPTH, treelib.Tree.WIDTH):
+                for sorting in (True, False):
+                    with self.subTest(nid=nid, mode=mode, sorting=sorting):
+                        self.assertEqual(list(compact.expand_tree(nid, mode=mode, sorting=sorting)),
+                                         list(tree.expand_tree(nid, mode=mode, sorting=sorting)))
+        self.assertEqual(sorted(map(str, (node.identifier for node in compact.all_nodes_itr()))),
+                         sorted(map(str, (node.identifier for node in tree.all_nodes_itr()))))
+
+    def test_subtree(self):
+        compact, tree, identifiers, rng = self.random_trees(2, 100)
+        for nid in [tree.root] + identifiers[:10]:
+            with self.subTest(nid=nid):
+                self.assertSameTree(compact.subtree(nid), tree.subtree(nid))
+
+    def test_update_move_and_remove(self):
+        for seed in range(20):
+            compact, tree, identifiers, rng = self.random_trees(seed)
+            for change in range(20):
+                identifier = rng.choice(identifiers)
+                kind = rng.choice(['rename', 'data', 'move', 'remove'])
+                if not tree.contains(identifier):
+                    continue
+                if kind == 'rename':
+                    operations = [('update_node', (identifier,), {'tag': f'renamed {change}'})]
+                elif kind == 'data':
+                    operations = [('update_node', (identifier,), {'data': {'owner': 'C'}})]
+                elif kind == 'move':
+                    below = set(tree.subtree(identifier).nodes)
+                    destination = rng.choice([other for other in [tree.root] + identifiers
+                                              if tree.contains(other) and other not in below])
+                    operations = [('move_node', (identifier, destination), {})]
+                else:
+                    operations = [('remove_node', (identifier,), {})]
+                build(compact, operations)
+                build(tree, operations)
+                with self.subTest(seed=seed, change=change, kind=kind):
+                    self.assertSameTree(compact, tree)
+
+    def test_errors(self):
+        compact, tree, identifiers, rng = self.random_trees(3, 20)
+        child = compact.children(compact.root)[0].identifier
+        cases = [
+            (treelib.exceptions.DuplicatedNodeIdError, lambda t: t.create_node('x', identifier=child, parent=t.root)),
+            (treelib.exceptions.NodeIDAbsentError, lambda t: t.create_node('x', identifier='new', parent='missing')),
+            (treelib.exceptions.MultipleRootError, lambda t: t.create_node('x', identifier='another root')),
+            (treelib.exceptions.LoopError, lambda t: t.move_node(t.root, child)),
+            (treelib.exceptions.NodeIDAbsentError, lambda t: t.children('missing')),
+            (treelib.exceptions.NodeIDAbsentError, lambda t: t['missing']),
+        ]
+        for error, operation in cases:
+            for candidate in (compact, tree):
+                with self.subTest(error=error, tree=type(candidate).__name__):
+                    with self.assertRaises(error):
+                        operation(candidate)
+
+    def test_round_trip(self):
+        for seed in range(10):
+            with self.subTest(seed=seed):
+                compact, tree, identifiers, rng = self.random_trees(seed)
+                plain = compact_tree.CompactTree.from_treelib(tree)
+                self.assertSameTree(plain, tree)
+                self.assertSameTree(plain.to_treelib(), tree)
+                # a subclass whose constructor makes the root
+                rooted = extract.CompactRootedTree.from_treelib(tree)
+                self.assertIsInstance(rooted, extract.CompactRootedTree)
+                self.assertSameTree(rooted, tree)
+                self.assertSameTree(rooted.to_treelib(extract.RootedTree()), tree)
+
+    def test_round_trip_other_root(self):
+        tree = treelib.Tree()
+        tree.create_node('Goal', identifier=7, data={'owner': 'A'})
+        tree.create_node('Key Result', identifier=8, parent=7)
+        rooted = extract.CompactRootedTree.from_treelib(tree)
+        self.assertSameTree(rooted, tree)
+        self.assertNotIn(extract.RootedTree.ROOT_ID, rooted)
+        self.assertSameTree(rooted.to_treelib(extract.RootedTree()), tree)
+
+
+if __name__ == '__main__':
+    unittest.main()
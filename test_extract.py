@@ -0,0 +1,351 @@
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import unittest
+import unittest.mock
+
+import extract
+
+
+def make_records(rng, per_table=6):
+    """
+    Return table -> records for a random base laid out as
+    AIRTABLE_SCHEMA says.  Some records link to a parent that isn't in
+    its table, and some to no parent at all.
+    """
+    records = {}
+    for table in extract.AIRTABLE_TABLES:
+        schema = extract.AIRTABLE_TABLE_SCHEMAS[table]
+        parent_table = extract.AIRTABLE_PARENT_TABLES[table]
+        records[table] = []
+        for number in range(per_table):
+            fields = {schema['name_field']: f'{table} {number}'}
+            if schema.get('code_field'):
+                fields[schema['code_field']] = f'{table[0]}-{number}'
+            if parent_table:
+                parent_ids = [record['id'] for record in records[parent_table]]
+                chance = rng.random()
+                if chance < 0.15:
+                    fields[schema['parent_field']] = [f'recGone{table}{number}']
+                elif chance > 0.95:
+                    pass
+                else:
+                    fields[schema['parent_field']] = rng.sample(parent_ids, rng.choice([1, 1, 2]))
+            records[table].append({'id': f'rec{table}{number}', 'fields': fields})
+    return records
+
+
+def two_pass_tree(records):
+    """
+    Build the tree the way get_airtable_tree() used to: each table in
+    order, once the whole of the table above it was in the tree.
+    """
+    tree = extract.RootedTree()
+    for table in extract.AIRTABLE_TABLES:
+        for record in records[table]:
+            name, parent_id, data = extract.airtable_record_to_node(table, record)
+            extract.add_airtable_node(tree, table, name, record['id'], parent_id, data)
+    return tree
+
+
+def shuffled_pages(rng, records, page_size=2):
+    """
+    Return (table, record) in a random interleaving of each table's
+    pages, as iter_airtable_tables() delivers them.
+    """
+    pages = {table: [table_records[start:start + page_size] for start in range(0, len(table_records), page_size)]
+             for table, table_records in records.items()}
+    arrivals = []
+    while pages:
+        table = rng.choice(sorted(pages))
+        arrivals.extend((table, record) for record in pages[table].pop(0))
+        if not pages[table]:
+            del pages[table]
+    return arrivals
+
+
+def shape(tree):
+    """
+    Return identifier -> (parent identifier, tag, data) for tree.
+    """
+    return {node.identifier: (tree.parent(node.identifier).identifier if tree.parent(node.identifier) else None,
+                              node.tag, node.data)
+            for node in tree.all_nodes_itr()}
+
+
+def quiet_extract(test):
+    """
+    Set up extract's module globals for test as main() would, and turn
+    off the warnings about orphans and failed fetches the tests cause.
+    """
+    logging.disable(logging.WARNING)
+    test.addCleanup(logging.disable, logging.NOTSET)
+    for name, value in [('ADD_NODE_TYPE_IN_NAME', True), ('base_id', 'appTest')]:
+        patch = unittest.mock.patch.object(extract, name, value, create=True)
+        patch.start()
+        test.addCleanup(patch.stop)
+
+
+class FakeClient(object):
+    """
+    Stands in for a ServiceClient, answering get_json() from respond(),
+    counting requests, and raising interruption once fail_after
+    requests have been made.
+    """
+
+    def __init__(self, respond, fail_after=None, interruption=Exception):
+        self.respond = respond
+        self.fail_after = fail_after
+        self.interruption = interruption
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def get_json(self, path, params=None, cached=True):
+        with self.lock:
+            if self.fail_after is not None and len(self.requests) >= self.fail_after:
+                raise self.interruption('connection lost')
+            self.requests.append((path, dict(params or {})))
+        return self.respond(path, params or {})
+
+
+def airtable_responder(records, page_size=2):
+    def respond(path, params):
+        if path == 'meta/bases':
+            return {'bases': [{'id': 'appTest', 'name': 'Test base'}]}
+        table = path.split('/')[-1]
+        start = int(params.get('offset', 0))
+        response = {'records': records[table][start:start + page_size]}
+        if start + page_size < len(records[table]):
+            response['offset'] = str(start + page_size)
+        return response
+    return respond
+
+
+def make_goals(rng, count=40):
+    """
+    Return goal ID -> payload for a random BetterWorks goal tree under
+    goal 1.
+    """
+    goals = {1: {'id': 1, 'name': 'Goal 1', 'parent': None, 'children': [], 'owner': {'user': {'name': 'A'}},
+                 'start': 1, 'end': 2, 'is_key_result': False}}
+    for goal_id in range(2, count + 1):
+        parent_id = rng.randrange(1, goal_id)
+        goals[goal_id] = {'id': goal_id, 'name': f'Goal {goal_id}', 'parent': {'id': parent_id}, 'children': [],
+                          'owner': {'user': {'name': rng.choice('AB')}}, 'start': 1, 'end': 2,
+                          'is_key_result': rng.random() < 0.3}
+        goals[parent_id]['children'].append({'id': goal_id})
+    return goals
+
+
+def betterworks_responder(goals):
+    def respond(path, params):
+        if path == 'goals/filter':
+            return {'results': [goal for goal in goals.values()
+                                if goal['parent'] and goal['parent']['id'] == int(params['parent'])],
+                    'more': False}
+        return goals[int(path.split('/')[1])]
+    return respond
+
+
+class AirtableTreeBuilderTest(unittest.TestCase):
+
+    def setUp(self):
+        quiet_extract(self)
+
+    def build(self, arrivals, root_id=None, max_depth=None):
+        tree = extract.RootedTree()
+        builder = extract.AirtableTreeBuilder(tree, root_id, max_depth)
+        for table, record in arrivals:
+            builder.add(table, record)
+        builder.finish()
+        self.assertEqual(builder.parked, {})
+        return tree
+
+    def test_parent_arrives_later(self):
+        outcome = {'id': 'recO', 'fields': {'Name': 'Outcome', 'ID': 'O-1', 'Priority': ['recP']}}
+        deliverable = {'id': 'recK', 'fields': {'KD Budget Name': 'KD', 'K-ID': 'K-1', 'Outcome': ['recO']}}
+        priority = {'id': 'recP', 'fields': {'ID': 'Priority'}}
+        tree = extract.RootedTree()
+        builder = extract.AirtableTreeBuilder(tree)
+        builder.add('KDs', deliverable)
+        builder.add('Outcomes', outcome)
+        # both wait for the priority, the KD behind the outcome
+        self.assertFalse(tree.contains('recO'))
+        self.assertFalse(tree.contains('recK'))
+        builder.add('Priorities', priority)
+        self.assertEqual(tree.parent('recO').identifier, 'recP')
+        self.assertEqual(tree.parent('recK').identifier, 'recO')
+        self.assertEqual(builder.parked, {})
+
+    def test_parent_never_arrives(self):
+        outcome = {'id': 'recO', 'fields': {'Name': 'Outcome', 'ID': 'O-1', 'Priority': ['recGone']}}
+        deliverable = {'id': 'recK', 'fields': {'KD Budget Name': 'KD', 'K-ID': 'K-1', 'Outcome': ['recO']}}
+        tree = extract.RootedTree()
+        builder = extract.AirtableTreeBuilder(tree)
+        builder.add('KDs', deliverable)
+        builder.add('Outcomes', outcome)
+        self.assertEqual(len(tree), 1)
+        builder.finish()
+        # the outcome becomes an orphan, and keeps its KD
+        self.assertEqual(tree.parent('recO').identifier, extract.RootedTree.ROOT_ID)
+        self.assertEqual(tree.parent('recK').identifier, 'recO')
+
+    def test_matches_two_pass_build(self):
+        for seed in range(50):
+            rng = random.Random(seed)
+            records = make_records(rng)
+            with self.subTest(seed=seed):
+                self.assertEqual(shape(self.build(shuffled_pages(rng, records))), shape(two_pass_tree(records)))
+
+    def test_children_first_matches_two_pass_build(self):
+        rng = random.Random(21)
+        records = make_records(rng)
+        arrivals = [(table, record) for table in reversed(extract.AIRTABLE_TABLES) for record in records[table]]
+        self.assertEqual(shape(self.build(arrivals)), shape(two_pass_tree(records)))
+
+    def test_root_id(self):
+        for seed in range(20):
+            rng = random.Random(seed)
+            records = make_records(rng)
+            full = two_pass_tree(records)
+            root_id = rng.choice([record['id'] for record in records['Outcomes']])
+            for max_depth in (None, 1, 2):
+                # root_id's subtree of the full tree, moved under the root
+                node = full.get_node(root_id)
+                expected = {root_id: (extract.RootedTree.ROOT_ID, node.tag, node.data)}
+                depths = {root_id: 1}
+                for node_id in list(full.expand_tree(root_id))[1:]:
+                    parent_id = full.parent(node_id).identifier
+                    if parent_id not in depths or (max_depth and depths[parent_id] >= max_depth):
+                        continue
+                    depths[node_id] = depths[parent_id] + 1
+                    node = full.get_node(node_id)
+                    expected[node_id] = (parent_id, node.tag, node.data)
+                tree = self.build(shuffled_pages(rng, records), root_id, max_depth)
+                with self.subTest(seed=seed, max_depth=max_depth):
+                    result = shape(tree)
+                    del result[extract.RootedTree.ROOT_ID]
+                    self.assertEqual(result, expected)
+
+
+class CheckpointTest(unittest.TestCase):
+
+    KEY = {'type': 'test'}
+
+    def setUp(self):
+        quiet_extract(self)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'tree.snapshot.checkpoint')
+
+    def airtable_tree(self, records, checkpoint=None, fail_after=None):
+        client = FakeClient(airtable_responder(records), fail_after)
+        with unittest.mock.patch.object(extract, 'airtable_client', client, create=True):
+            tree = extract.get_airtable_tree(extract.RootedTree(), checkpoint=checkpoint)
+        return tree, client.requests
+
+    def goal_tree(self, goals, batch, checkpoint=None, fail_after=None):
+        client = FakeClient(betterworks_responder(goals), fail_after, KeyboardInterrupt)
+        crawler = extract.GoalCrawler(max_workers=2, batch=batch, checkpoint=checkpoint)
+        with unittest.mock.patch.object(extract, 'betterworks_client', client, create=True):
+            tree = extract.get_goal_as_tree(1, extract.RootedTree(), crawler)
+        return tree, client.requests
+
+    def tear_last_line(self):
+        # longer than anything the resumed run adds, so that any of it
+        # left behind would show
+        page = json.dumps({'table': 'KDs', 'records': [{'id': f'recKD{number}', 'fields': {}}
+                                                       for number in range(5000)], 'offset': None})
+        with open(self.path, 'a') as file:
+            file.write(page[:len(page) // 2])
+
+    def assertCheckpointReadable(self):
+        with open(self.path, 'rb') as file:
+            for line in file:
+                self.assertTrue(line.endswith(b'\n'))
+                json.loads(line)
+
+    def test_airtable_resume_from_partial_checkpoint(self):
+        records = make_records(random.Random(25))
+        full, full_requests = self.airtable_tree(records)
+        synced_at = '2026-10-01T12:00:00+00:00'
+        with open(self.path, 'w') as file:
+            for entry in [{'key': self.KEY}, {'synced_at': synced_at},
+                          {'table': 'Priorities', 'records': records['Priorities'][:2], 'offset': '2'},
+                          {'table': 'Outcomes', 'records': records['Outcomes'][:2], 'offset': '2'},
+                          {'table': 'Outcomes', 'records': records['Outcomes'][2:4], 'offset': '4'},
+                          {'table': 'Outcomes', 'records': records['Outcomes'][4:], 'offset': None}]:
+                file.write(json.dumps(entry) + '\n')
+        self.tear_last_line()
+
+        checkpoint = extract.Checkpoint(self.path, self.KEY, resume=True)
+        tree, requests = self.airtable_tree(records, checkpoint)
+        checkpoint.close()
+        self.assertEqual(shape(tree), shape(full))
+        self.assertEqual(tree.synced_at.isoformat(), synced_at)
+        # nothing saved is asked for again
+        self.assertNotIn('appTest/Outcomes', [path for path, params in requests])
+        self.assertNotIn(('appTest/Priorities', {'fields[]': extract.AIRTABLE_FIELDS['Priorities']}), requests)
+        self.assertEqual(len(requests), len(full_requests) - 4)
+        # the torn line was replaced by what the resumed run fetched
+        self.assertCheckpointReadable()
+
+    def test_airtable_resume_after_failure(self):
+        records = make_records(random.Random(26), per_table=9)
+        full, full_requests = self.airtable_tree(records)
+        for fail_after in (1, 5, 12, len(full_requests) - 1):
+            with self.subTest(fail_after=fail_after):
+                checkpoint = extract.Checkpoint(self.path, self.KEY, interval=1000)
+                with self.assertRaises(Exception):
+                    self.airtable_tree(records, checkpoint, fail_after)
+                checkpoint.close()
+                with open(self.path) as file:
+                    saved_pages = sum('table' in json.loads(line) for line in file)
+                self.tear_last_line()
+                checkpoint = extract.Checkpoint(self.path, self.KEY, resume=True)
+                tree, requests = self.airtable_tree(records, checkpoint)
+                checkpoint.close()
+                self.assertEqual(shape(tree), shape(full))
+                self.assertEqual(len(requests), len(full_requests) - saved_pages)
+                self.assertCheckpointReadable()
+
+    def test_goal_crawler_resume_after_interruption(self):
+        goals = make_goals(random.Random(27))
+        for batch in (False, True):
+            full, full_requests = self.goal_tree(goals, batch)
+            for fail_after in (2, len(full_requests) // 2, len(full_requests) - 1):
+                with self.subTest(batch=batch, fail_after=fail_after):
+                    checkpoint = extract.Checkpoint(self.path, self.KEY, interval=1000)
+                    with self.assertRaises(KeyboardInterrupt):
+                        self.goal_tree(goals, batch, checkpoint, fail_after)
+                    checkpoint.close()
+                    self.tear_last_line()
+                    checkpoint = extract.Checkpoint(self.path, self.KEY, resume=True)
+                    tree, requests = self.goal_tree(goals, batch, checkpoint)
+                    checkpoint.close()
+                    self.assertEqual(shape(tree), shape(full))
+                    self.assertLess(len(requests), len(full_requests))
+                    self.assertCheckpointReadable()
+
+    def test_other_extraction(self):
+        with open(self.path, 'w') as file:
+            file.write(json.dumps({'key': {'type': 'other'}}) + '\n')
+        with self.assertRaisesRegex(Exception, 'different extraction'):
+            list(extract.Checkpoint(self.path, self.KEY, resume=True).entries())
+
+    def test_not_resuming(self):
+        with open(self.path, 'w') as file:
+            file.write(json.dumps({'key': self.KEY}) + '\n' + json.dumps({'synced_at': 'x'}) + '\n')
+        checkpoint = extract.Checkpoint(self.path, self.KEY)
+        self.assertEqual(list(checkpoint.entries()), [])
+        checkpoint.add({'goal': 1})
+        checkpoint.close()
+        with open(self.path) as file:
+            self.assertEqual([json.loads(line) for line in file], [{'key': self.KEY}, {'goal': 1}])
+
+
+if __name__ == '__main__':
+    unittest.main()
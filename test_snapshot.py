@@ -0,0 +1,188 @@
+import json
+import os
+import struct
+import tempfile
+import unittest
+
+import treelib
+
+import snapshot
+
+
+def sample_tree():
+    tree = treelib.Tree()
+    tree.create_node('Plan', identifier=-1)
+    tree.create_node('Priority: Growth', identifier='recP1', parent=-1, data={'node_type': 'Priorities', 'owner': 'A'})
+    tree.create_node('Priority: Café ☃', identifier='recP2', parent=-1,
+                     data={'node_type': 'Priorities', 'owner': None, 'tags': ['x', 'y'], 'budget': 12.5})
+    tree.create_node('Outcome 1', identifier='recO1', parent='recP1', data={'node_type': 'Outcomes', 'owner': 'A'})
+    tree.create_node('Outcome 2', identifier='recO2', parent='recP1', data={})
+    tree.create_node('Goal', identifier=42, parent='recP2', data={'node_type': 'Goal', 'start': '2026-01-01'})
+    # same tag as a sibling, and data that isn't a dict
+    tree.create_node('Goal', identifier=43, parent='recP2', data=None)
+    tree.create_node('Key Result', identifier=44, parent=42, data={'node_type': 'Key Result', 'owner': 'A'})
+    return tree
+
+
+def walk(tree):
+    queue = [tree.root]
+    for identifier in queue:
+        yield identifier
+        queue.extend(child.identifier for child in tree.children(identifier))
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'tree.snapshot')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def load(self, path=None):
+        loaded = snapshot.Snapshot(path or self.path)
+        self.addCleanup(loaded.close)
+        return loaded
+
+    def test_round_trip(self):
+        tree = sample_tree()
+        snapshot.write_snapshot(tree, self.path, {'synced_at': '2026-10-17T00:00:00+00:00'})
+        self.assertTrue(snapshot.is_snapshot(self.path))
+        loaded = self.load()
+        self.assertEqual(loaded.version, snapshot.VERSION)
+        self.assertEqual(loaded.metadata, {'synced_at': '2026-10-17T00:00:00+00:00'})
+        self.assertEqual(loaded.root, -1)
+        self.assertEqual(len(loaded), len(tree))
+        for identifier in walk(tree):
+            with self.subTest(identifier=identifier):
+                node, loaded_node = tree.get_node(identifier), loaded.get_node(identifier)
+                self.assertEqual(loaded_node.identifier, identifier)
+                self.assertEqual(loaded_node.tag, node.tag)
+                self.assertEqual(loaded_node.data, node.data if isinstance(node.data, dict) else None)
+                parent = tree.parent(identifier)
+                loaded_parent = loaded.parent(identifier)
+                self.assertEqual(loaded_parent.identifier if loaded_parent else None,
+                                 parent.identifier if parent else None)
+                self.assertEqual([child.identifier for child in loaded.children(identifier)],
+                                 [child.identifier for child in tree.children(identifier)])
+        self.assertEqual(sorted(str(node.identifier) for node in loaded.all_nodes_itr()),
+                         sorted(str(identifier) for identifier in walk(tree)))
+        self.assertIn(44, loaded)
+        self.assertNotIn('44', loaded)
+        with self.assertRaises(KeyError):
+            loaded.get_node('missing')
+
+    def test_to_tree(self):
+        tree = sample_tree()
+        snapshot.write_snapshot(tree, self.path)
+        copy = self.load().to_tree(treelib.Tree())
+        self.assertEqual(copy.to_dict(with_data=True), tree.to_dict(with_data=True))
+
+    def test_no_metadata(self):
+        snapshot.write_snapshot(sample_tree(), self.path)
+        self.assertEqual(self.load().metadata, {})
+
+    def test_string_table(self):
+        tree = sample_tree()
+        metadata = {'synced_at': '2026-10-17T00:00:00+00:00'}
+        snapshot.write_snapshot(tree, self.path, metadata)
+        loaded = self.load()
+        expected = {json.dumps(metadata)}
+        for identifier in walk(tree):
+            node = tree.get_node(identifier)
+            expected.add(json.dumps(identifier))
+            expected.add(node.tag)
+            for key, value in (node.data or {}).items():
+                expected.update([key, json.dumps(value)])
+        # each distinct string is stored once
+        strings = [loaded.string(index) for index in range(len(loaded.string_offsets) - 1)]
+        self.assertEqual(len(strings), len(set(strings)))
+        self.assertEqual(set(strings), expected)
+        # and shared by every node that uses it
+        self.assertEqual(loaded.tags[loaded.lookup(42)], loaded.tags[loaded.lookup(43)])
+
+    def test_subtree_digests(self):
+        tree = sample_tree()
+        snapshot.write_snapshot(tree, self.path)
+        other_path = os.path.join(self.directory.name, 'again.snapshot')
+        snapshot.write_snapshot(sample_tree(), other_path)
+        loaded, again = self.load(), self.load(other_path)
+        digests = snapshot.subtree_digests(tree)
+        for identifier in walk(tree):
+            with self.subTest(identifier=identifier):
+                self.assertEqual(loaded.subtree_digest(identifier), digests[identifier])
+                self.assertEqual(again.subtree_digest(identifier), digests[identifier])
+
+        # a change alters the digests of the node and its ancestors only
+        changed = sample_tree()
+        changed.update_node(44, data={'node_type': 'Key Result', 'owner': 'B'})
+        changed_digests = snapshot.subtree_digests(changed)
+        self.assertEqual({identifier for identifier in digests if digests[identifier] != changed_digests[identifier]},
+                         {44, 42, 'recP2', -1})
+
+    def test_digests_ignore_child_order(self):
+        tree = treelib.Tree()
+        tree.create_node('root', identifier=0)
+        tree.create_node('a', identifier=1, parent=0)
+        tree.create_node('b', identifier=2, parent=0)
+        reordered = treelib.Tree()
+        reordered.create_node('root', identifier=0)
+        reordered.create_node('b', identifier=2, parent=0)
+        reordered.create_node('a', identifier=1, parent=0)
+        self.assertEqual(snapshot.subtree_digests(tree)[0], snapshot.subtree_digests(reordered)[0])
+
+    def test_bad_magic(self):
+        snapshot.write_snapshot(sample_tree(), self.path)
+        with open(self.path, 'r+b') as file:
+            file.write(b'NOTSNAP\0')
+        self.assertFalse(snapshot.is_snapshot(self.path))
+        with self.assertRaisesRegex(Exception, 'not a snapshot'):
+            snapshot.Snapshot(self.path)
+
+    def test_unknown_version(self):
+        snapshot.write_snapshot(sample_tree(), self.path)
+        with open(self.path, 'r+b') as file:
+            file.seek(len(snapshot.MAGIC))
+            file.write(struct.pack('<I', snapshot.VERSION + 1))
+        with self.assertRaisesRegex(Exception, f'version {snapshot.VERSION + 1}'):
+            snapshot.Snapshot(self.path)
+
+    def test_lookups_past_recent_ids(self):
+        tree = treelib.Tree()
+        tree.create_node('root', identifier=0)
+        size = snapshot.Snapshot.RECENT_IDS * 3
+        for identifier in range(1, size):
+            # a mix of integer and string identifiers, several levels deep
+            parent = (identifier - 1) // 4
+            tree.create_node(f'node {identifier}', identifier=identifier if identifier % 3 else f'n{identifier}',
+                             parent=parent if parent % 3 or parent == 0 else f'n{parent}', data={'i': identifier})
+        snapshot.write_snapshot(tree, self.path)
+        loaded = self.load()
+
+        # walk the whole tree lazily, as the writers do
+        count = 0
+        stack = [loaded.get_node(loaded.root)]
+        while stack:
+            node = stack.pop()
+            count += 1
+            self.assertEqual(node.tag, tree.get_node(node.identifier).tag)
+            stack.extend(loaded.children(node.identifier))
+        self.assertEqual(count, size)
+        self.assertLessEqual(len(loaded.recent_ids), snapshot.Snapshot.RECENT_IDS)
+
+        # identifiers long since dropped from recent_ids are still found
+        self.assertNotIn(1, loaded.recent_ids)
+        self.assertNotIn('n3', loaded.recent_ids)
+        for identifier in [1, 'n3', 2, size - 1, 'n6', 4097]:
+            with self.subTest(identifier=identifier):
+                self.assertEqual(loaded.get_node(identifier).data, tree.get_node(identifier).data)
+                self.assertEqual([child.identifier for child in loaded.children(identifier)],
+                                 [child.identifier for child in tree.children(identifier)])
+                self.assertEqual(loaded.parent(identifier).identifier, tree.parent(identifier).identifier)
+        for missing in [size, 'n1', '1', None]:
+            self.assertNotIn(missing, loaded)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,214 @@
+import os
+import random
+import tempfile
+import unittest
+
+import treelib
+
+import snapshot
+import treediff
+
+
+def make_tree(nodes):
+    """
+    Build a treelib Tree from (identifier, tag, parent identifier, data)
+    tuples, parents first.
+    """
+    tree = treelib.Tree()
+    for identifier, tag, parent, data in nodes:
+        tree.create_node(tag, identifier=identifier, parent=parent, data=data)
+    return tree
+
+
+def copy_tree(tree):
+    return make_tree([(node.identifier, node.tag, parent.identifier if parent else None,
+                       dict(node.data) if node.data else node.data)
+                      for node, parent in walk(tree)])
+
+
+def walk(tree):
+    """
+    Yield (node, parent node) for every node of tree, parents first.
+    """
+    queue = [(tree.get_node(tree.root), None)]
+    for node, parent in queue:
+        yield node, parent
+        queue.extend((child, node) for child in tree.children(node.identifier))
+
+
+def naive_diff(old_tree, new_tree):
+    """
+    The differences TreeDiff should find, from comparing every node.
+    """
+    old_nodes = {node.identifier: (node, parent) for node, parent in walk(old_tree)}
+    new_nodes = {node.identifier: (node, parent) for node, parent in walk(new_tree)}
+    result = {'added': set(new_nodes) - set(old_nodes), 'removed': set(old_nodes) - set(new_nodes),
+              'renamed': set(), 'moved': set(), 'changed': set()}
+    for identifier in set(old_nodes) & set(new_nodes):
+        (old_node, old_parent), (new_node, new_parent) = old_nodes[identifier], new_nodes[identifier]
+        if old_node.tag != new_node.tag:
+            result['renamed'].add((identifier, old_node.tag, new_node.tag))
+        old_parent_id = old_parent.identifier if old_parent else None
+        new_parent_id = new_parent.identifier if new_parent else None
+        if old_parent_id != new_parent_id:
+            result['moved'].add((identifier, old_parent_id, new_parent_id))
+        if (old_node.data or {}) != (new_node.data or {}):
+            result['changed'].add(identifier)
+    return result
+
+
+def diff_sets(diff):
+    return {'added': set(diff.added), 'removed': set(diff.removed), 'renamed': set(diff.renamed),
+            'moved': set(diff.moved), 'changed': {identifier for identifier, changes in diff.changed}}
+
+
+def random_tree(rng, size):
+    nodes = [(0, 'root', None, None)]
+    for identifier in range(1, size):
+        nodes.append((identifier, f'node {identifier}', rng.randrange(identifier),
+                      {'owner': rng.choice('ABC'), 'end': rng.choice(['2026-06-30', '2026-12-31'])}))
+    return make_tree(nodes)
+
+
+def mutate(rng, tree, changes):
+    """
+    Return a copy of tree with changes random additions, removals,
+    renames, moves and data changes.
+    """
+    tree = copy_tree(tree)
+    next_id = max(node.identifier for node, parent in walk(tree)) + 1
+    for change in range(changes):
+        identifiers = [node.identifier for node, parent in walk(tree) if node.identifier != tree.root]
+        kind = rng.choice(['add', 'remove', 'rename', 'move', 'data'])
+        if kind == 'add' or not identifiers:
+            tree.create_node(f'node {next_id}', identifier=next_id,
+                             parent=rng.choice(identifiers + [tree.root]), data={'owner': 'D'})
+            next_id += 1
+            continue
+        identifier = rng.choice(identifiers)
+        if kind == 'remove':
+            tree.remove_node(identifier)
+        elif kind == 'rename':
+            tree.update_node(identifier, tag=f'{tree.get_node(identifier).tag}*')
+        elif kind == 'move':
+            below = set(tree.subtree(identifier).nodes)
+            targets = [other for other in identifiers + [tree.root] if other not in below]
+            tree.move_node(identifier, rng.choice(targets))
+        else:
+            tree.update_node(identifier, data={'owner': rng.choice('ABCD'), 'end': '2027-03-31'})
+    return tree
+
+
+class TreeDiffTest(unittest.TestCase):
+
+    def setUp(self):
+        self.old_tree = make_tree([
+            ('root', 'Plan', None, None),
+            ('p1', 'Priority 1', 'root', {'owner': 'A'}),
+            ('p2', 'Priority 2', 'root', {'owner': 'B'}),
+            ('o1', 'Outcome 1', 'p1', {'owner': 'A', 'end': '2026-06-30'}),
+            ('o2', 'Outcome 2', 'p1', {'owner': 'A'}),
+            ('o3', 'Outcome 3', 'p2', {'owner': 'B'}),
+            ('k1', 'KD 1', 'o1', None),
+            ('k2', 'KD 2', 'o3', None),
+        ])
+
+    def diff(self, new_tree):
+        return treediff.TreeDiff(self.old_tree, new_tree)
+
+    def test_unchanged(self):
+        diff = self.diff(copy_tree(self.old_tree))
+        self.assertEqual(diff_sets(diff), {'added': set(), 'removed': set(), 'renamed': set(), 'moved': set(),
+                                           'changed': set()})
+        self.assertEqual(diff.compared, 0)
+        self.assertEqual(diff.skipped, 1)
+
+    def test_added(self):
+        new_tree = copy_tree(self.old_tree)
+        new_tree.create_node('KD 3', identifier='k3', parent='o2')
+        new_tree.create_node('Activity 1', identifier='a1', parent='k3')
+        diff = self.diff(new_tree)
+        self.assertEqual(set(diff.added), {'k3', 'a1'})
+        self.assertEqual(diff.removed + diff.renamed + diff.moved + diff.changed, [])
+        self.assertIn('added    k3 "KD 3" under o2 "Outcome 2"', list(diff.lines()))
+
+    def test_removed(self):
+        new_tree = copy_tree(self.old_tree)
+        new_tree.remove_node('o1')
+        diff = self.diff(new_tree)
+        self.assertEqual(set(diff.removed), {'o1', 'k1'})
+        self.assertEqual(diff.added + diff.renamed + diff.moved + diff.changed, [])
+
+    def test_renamed(self):
+        new_tree = copy_tree(self.old_tree)
+        new_tree.update_node('k2', tag='KD 2 (revised)')
+        diff = self.diff(new_tree)
+        self.assertEqual(diff.renamed, [('k2', 'KD 2', 'KD 2 (revised)')])
+        self.assertEqual(diff.added + diff.removed + diff.moved + diff.changed, [])
+
+    def test_moved(self):
+        new_tree = copy_tree(self.old_tree)
+        new_tree.move_node('o1', 'p2')
+        diff = self.diff(new_tree)
+        self.assertEqual(diff.moved, [('o1', 'p1', 'p2')])
+        # its child moved with it, so isn't reported
+        self.assertEqual(diff.added + diff.removed + diff.renamed + diff.changed, [])
+
+    def test_moved_under_an_added_node(self):
+        new_tree = copy_tree(self.old_tree)
+        new_tree.create_node('Outcome 4', identifier='o4', parent='p2')
+        new_tree.move_node('k1', 'o4')
+        diff = self.diff(new_tree)
+        self.assertEqual(diff.added, ['o4'])
+        self.assertEqual(diff.moved, [('k1', 'o1', 'o4')])
+        self.assertEqual(diff.removed, [])
+
+    def test_data_changed(self):
+        new_tree = copy_tree(self.old_tree)
+        new_tree.update_node('o1', data={'owner': 'C', 'start': '2026-01-01'})
+        diff = self.diff(new_tree)
+        self.assertEqual(diff.changed, [('o1', {'owner': ('A', 'C'), 'end': ('2026-06-30', None),
+                                                'start': (None, '2026-01-01')})])
+        self.assertEqual(diff.added + diff.removed + diff.renamed + diff.moved, [])
+
+    def test_as_dict(self):
+        new_tree = copy_tree(self.old_tree)
+        new_tree.move_node('k2', 'o2')
+        new_tree.update_node('p2', tag='Priority Two')
+        self.assertEqual(self.diff(new_tree).as_dict(), {
+            'added': [], 'removed': [], 'changed': [],
+            'renamed': [{'id': 'p2', 'old': 'Priority 2', 'new': 'Priority Two'}],
+            'moved': [{'id': 'k2', 'tag': 'KD 2', 'old_parent': 'o3', 'new_parent': 'o2'}]})
+
+    def test_matches_naive_diff(self):
+        rng = random.Random(16)
+        for trial in range(300):
+            old_tree = random_tree(rng, rng.randrange(1, 60))
+            new_tree = mutate(rng, old_tree, rng.randrange(0, 8))
+            with self.subTest(trial=trial):
+                self.assertEqual(diff_sets(treediff.TreeDiff(old_tree, new_tree)), naive_diff(old_tree, new_tree))
+
+    def test_snapshots_match_naive_diff(self):
+        # the same, with digests read from snapshot files
+        rng = random.Random(160)
+        with tempfile.TemporaryDirectory() as directory:
+            old_path = os.path.join(directory, 'old.snapshot')
+            new_path = os.path.join(directory, 'new.snapshot')
+            for trial in range(30):
+                old_tree = random_tree(rng, rng.randrange(1, 200))
+                new_tree = mutate(rng, old_tree, rng.randrange(0, 8))
+                snapshot.write_snapshot(old_tree, old_path)
+                snapshot.write_snapshot(new_tree, new_path)
+                old_snapshot = snapshot.Snapshot(old_path)
+                new_snapshot = snapshot.Snapshot(new_path)
+                try:
+                    with self.subTest(trial=trial):
+                        self.assertEqual(diff_sets(treediff.TreeDiff(old_snapshot, new_snapshot)),
+                                         naive_diff(old_tree, new_tree))
+                finally:
+                    old_snapshot.close()
+                    new_snapshot.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import io
+import json
+import unittest
+
+import treelib_json_to_d3
+
+# Small enough that every token in the documents below is split across
+# chunk boundaries at some size
+CHUNK_SIZES = [1, 2, 3, 5, 7, 64 * 1024]
+
+DOCUMENTS = [
+    '{}',
+    '[]',
+    '"text"',
+    '0',
+    '-12.5e-3',
+    'true',
+    'null',
+    ' {"a": 1, "b": [true, false, null], "c": {"d": "e"}, "f": []} ',
+    '{"numbers": [0, -1, 12345678901234567890, 3.25, -0.5, 1e10, 2.5E-3, 6.02e+23]}',
+    '[true,false,null,true,false,null]',
+    '{"key": "value", "empty": "", "nested": [[[]], [{}], {"x": [{"y": {}}]}]}',
+    '{"escapes": "quote \\" backslash \\\\ slash \\/ controls \\b\\f\\n\\r\\t"}',
+    '{"unicode \\u00e9": "caf\\u00e9 \\u2603 \\u0000 \\u001f", "raw": "café ☃"}',
+    '{"surrogates": "\\ud83c\\udf33 and \\uD83D\\uDE00", "raw": "\U0001f333"}',
+    '{"tree": {"children": [{"Goal 1": {"children": [{"KR 1": {"data": {"id": 1}}}], "data": {"id": 2}}}]}}',
+    '\n[\n  1 ,\n  "two" ,\r\n\t{ "three" : 3 }\n]\n',
+]
+
+
+def read_document(text, chunk_size):
+    events = treelib_json_to_d3.iter_json_events(io.StringIO(text), chunk_size)
+    value = treelib_json_to_d3.read_json_value(events, *next(events))
+    # and whatever follows it, which should be nothing
+    return value, list(events)
+
+
+class IterJsonEventsTest(unittest.TestCase):
+
+    def test_matches_json_load(self):
+        for text in DOCUMENTS:
+            for chunk_size in CHUNK_SIZES:
+                with self.subTest(text=text, chunk_size=chunk_size):
+                    value, rest = read_document(text, chunk_size)
+                    self.assertEqual(value, json.loads(text))
+                    self.assertEqual(rest, [])
+
+    def test_events(self):
+        text = '{"a": [1, "b"], "c": {}}'
+        expected = [('start_map', None), ('key', 'a'), ('start_array', None), ('value', 1), ('value', 'b'),
+                    ('end_array', None), ('key', 'c'), ('start_map', None), ('end_map', None), ('end_map', None)]
+        for chunk_size in CHUNK_SIZES:
+            with self.subTest(chunk_size=chunk_size):
+                events = treelib_json_to_d3.iter_json_events(io.StringIO(text), chunk_size)
+                self.assertEqual(list(events), expected)
+
+    def test_string_that_looks_like_json(self):
+        text = '{"a": "{\\"b\\": [1, 2]}", "c": "true"}'
+        for chunk_size in CHUNK_SIZES:
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(read_document(text, chunk_size)[0], json.loads(text))
+
+    def test_scalars_split_at_every_position(self):
+        for scalar in ['true', 'false', 'null', '-0.125', '1234567890', '6.02e+23']:
+            text = f'[{scalar}, {scalar}]'
+            for chunk_size in range(1, len(text) + 1):
+                with self.subTest(text=text, chunk_size=chunk_size):
+                    self.assertEqual(read_document(text, chunk_size)[0], json.loads(text))
+
+    def test_truncated_input(self):
+        text = '{"a": [1, true, "caf\\u00e9 \\ud83c\\udf33"], "b": {"c": null}}'
+        for length in range(1, len(text)):
+            for chunk_size in (1, 4, 64 * 1024):
+                with self.subTest(text=text[:length], chunk_size=chunk_size):
+                    with self.assertRaises(ValueError):
+                        read_document(text[:length], chunk_size)
+
+    def test_truncated_scalars(self):
+        for text in ['tru', 'nul', 'fals', '-', '1e', '"abc', '"abc\\', '"\\u00', '"\\ud83c\\udf']:
+            for chunk_size in (1, 2, 64 * 1024):
+                with self.subTest(text=text, chunk_size=chunk_size):
+                    with self.assertRaises(ValueError):
+                        list(treelib_json_to_d3.iter_json_events(io.StringIO(text), chunk_size))
+
+    def test_unclosed_container(self):
+        for text in ['{', '[1, 2', '{"a": {"b": []}']:
+            with self.subTest(text=text):
+                with self.assertRaises(ValueError):
+                    list(treelib_json_to_d3.iter_json_events(io.StringIO(text), 2))
+
+    def test_unexpected_character(self):
+        with self.assertRaises(ValueError):
+            list(treelib_json_to_d3.iter_json_events(io.StringIO('[1, @]'), 2))
+
+
+class SkipJsonValueTest(unittest.TestCase):
+
+    def test_counts_items_and_leaves_the_rest(self):
+        text = '[{"a": [1, 2, {"b": 3}], "c": "x", "d": {}, "e": []}, "after"]'
+        for chunk_size in CHUNK_SIZES:
+            with self.subTest(chunk_size=chunk_size):
+                events = treelib_json_to_d3.iter_json_events(io.StringIO(text), chunk_size)
+                self.assertEqual(next(events), ('start_array', None))
+                self.assertEqual(next(events), ('start_map', None))
+                self.assertEqual(next(events), ('key', 'a'))
+                self.assertEqual(treelib_json_to_d3.skip_json_value(events, next(events)[0]), 3)
+                self.assertEqual(next(events), ('key', 'c'))
+                self.assertEqual(treelib_json_to_d3.skip_json_value(events, next(events)[0]), 0)
+                self.assertEqual(next(events), ('key', 'd'))
+                self.assertEqual(treelib_json_to_d3.skip_json_value(events, next(events)[0]), 0)
+                self.assertEqual(next(events), ('key', 'e'))
+                self.assertEqual(treelib_json_to_d3.skip_json_value(events, next(events)[0]), 0)
+                self.assertEqual(next(events), ('end_map', None))
+                self.assertEqual(next(events), ('value', 'after'))
+
+    def test_truncated_input(self):
+        events = treelib_json_to_d3.iter_json_events(io.StringIO('{"a": [1, 2'), 3)
+        with self.assertRaises(ValueError):
+            treelib_json_to_d3.skip_json_value(events, next(events)[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,215 @@
+import argparse
+import convert
+import json
+import snapshot
+import sys
+
+
+def digest_lookup(tree):
+    """
+    Return a function giving the subtree digest for a node identifier
+    in tree.  Snapshots store their digests; for older snapshots and
+    pickled trees they are computed here, which visits every node once.
+    """
+    if isinstance(tree, snapshot.Snapshot) and tree.hashes is not None:
+        return tree.subtree_digest
+    return snapshot.subtree_digests(tree).get
+
+
+class TreeDiff(object):
+    """
+    The differences between two trees, by node identifier: nodes added,
+    removed, renamed (tag changed), re-parented, or with changed data.
+
+    Both trees are walked down from their roots together, and any pair
+    of nodes whose subtree digests match is skipped along with all its
+    descendents, so the work done grows with the amount of change, not
+    the size of the trees.  A child that is under a node in one tree
+    but not under the same node in the other is held in a pool until
+    it turns up somewhere else in the other tree, which makes it a
+    move, or the walk runs out, which makes it an addition or removal.
+    """
+
+    def __init__(self, old_tree, new_tree):
+        self.old_tree = old_tree
+        self.new_tree = new_tree
+        self.added = []
+        self.removed = []
+        # (identifier, old tag, new tag)
+        self.renamed = []
+        # (identifier, old parent identifier, new parent identifier)
+        self.moved = []
+        # (identifier, {data key: (old value, new value)})
+        self.changed = []
+        self.compared = 0
+        self.skipped = 0
+
+        old_digest = digest_lookup(old_tree)
+        new_digest = digest_lookup(new_tree)
+        matched = set()
+        pairs = [(old_tree.root, new_tree.root)]
+        # nodes not (yet) found in the other tree, and those of them
+        # whose children haven't been pooled yet
+        detached_old = {}
+        detached_new = {}
+        expand_old = []
+        expand_new = []
+        # detached nodes whose children have been pooled; if such a node
+        # is matched after all, its children have to be matched too, even
+        # if its subtree is unchanged
+        expanded = set()
+
+        def pool(node_id, detached, other_detached, expand):
+            if node_id in matched:
+                return
+            if node_id in other_detached:
+                del other_detached[node_id]
+                matched.add(node_id)
+                pairs.append((node_id, node_id))
+                old_parent = old_tree.parent(node_id).identifier
+                new_parent = new_tree.parent(node_id).identifier
+                self.moved.append((node_id, old_parent, new_parent))
+                return
+            detached[node_id] = True
+            expand.append(node_id)
+
+        def expand(tree, node_id, detached, other_detached, queue):
+            if node_id not in detached:
+                return
+            expanded.add(node_id)
+            for child in tree.children(node_id):
+                pool(child.identifier, detached, other_detached, queue)
+
+        while pairs or expand_old or expand_new:
+            if not pairs:
+                # nothing left to compare directly; look one level further
+                # into the detached nodes on each side
+                if expand_old:
+                    expand(old_tree, expand_old.pop(), detached_old, detached_new, expand_old)
+                if expand_new:
+                    expand(new_tree, expand_new.pop(), detached_new, detached_old, expand_new)
+                continue
+
+            old_id, new_id = pairs.pop()
+            if old_digest(old_id) == new_digest(new_id):
+                self.skipped += 1
+                if old_id not in expanded and new_id not in expanded:
+                    continue
+            else:
+                self.compared += 1
+                self.compare_nodes(old_id, new_id)
+
+            old_children = {child.identifier: child for child in old_tree.children(old_id)}
+            new_children = {child.identifier: child for child in new_tree.children(new_id)}
+            for child_id in old_children:
+                if child_id in new_children:
+                    if child_id not in matched:
+                        matched.add(child_id)
+                        detached_old.pop(child_id, None)
+                        detached_new.pop(child_id, None)
+                        pairs.append((child_id, child_id))
+                else:
+                    pool(child_id, detached_old, detached_new, expand_old)
+            for child_id in new_children:
+                if child_id not in old_children:
+                    pool(child_id, detached_new, detached_old, expand_new)
+
+        self.removed = list(detached_old)
+        self.added = list(detached_new)
+
+    def compare_nodes(self, old_id, new_id):
+        old_node = self.old_tree.get_node(old_id)
+        new_node = self.new_tree.get_node(new_id)
+        if old_node.tag != new_node.tag:
+            self.renamed.append((new_id, old_node.tag, new_node.tag))
+        old_data = old_node.data or {}
+        new_data = new_node.data or {}
+        if old_data != new_data:
+            changes = {key: (old_data.get(key), new_data.get(key))
+                       for key in list(old_data) + [key for key in new_data if key not in old_data]
+                       if old_data.get(key) != new_data.get(key)}
+            self.changed.append((new_id, changes))
+
+    def summary(self):
+        return (f'{len(self.added)} added, {len(self.removed)} removed, {len(self.renamed)} renamed, '
+                f'{len(self.moved)} moved, {len(self.changed)} with changed data '
+                f'({self.compared} nodes compared, {self.skipped} unchanged subtrees skipped)')
+
+    def as_dict(self):
+        def parent_of(tree, node_id):
+            parent = tree.parent(node_id)
+            return parent.identifier if parent else None
+
+        return {'added': [{'id': node_id, 'tag': self.new_tree.get_node(node_id).tag,
+                           'parent': parent_of(self.new_tree, node_id)} for node_id in self.added],
+                'removed': [{'id': node_id, 'tag': self.old_tree.get_node(node_id).tag,
+                             'parent': parent_of(self.old_tree, node_id)} for node_id in self.removed],
+                'renamed': [{'id': node_id, 'old': old, 'new': new} for node_id, old, new in self.renamed],
+                'moved': [{'id': node_id, 'tag': self.new_tree.get_node(node_id).tag,
+                           'old_parent': old, 'new_parent': new} for node_id, old, new in self.moved],
+                'changed': [{'id': node_id, 'tag': self.new_tree.get_node(node_id).tag,
+                             'changes': {key: {'old': old, 'new': new} for key, (old, new) in changes.items()}}
+                            for node_id, changes in self.changed]}
+
+    def lines(self):
+        """
+        Yield the differences as lines of text.
+        """
+        def describe(tree, node_id):
+            return f'{node_id} "{tree.get_node(node_id).tag}"'
+
+        for node_id in self.added:
+            parent = self.new_tree.parent(node_id)
+            yield f'added    {describe(self.new_tree, node_id)} under {describe(self.new_tree, parent.identifier)}'
+        for node_id in self.removed:
+            yield f'removed  {describe(self.old_tree, node_id)}'
+        for node_id, old, new in self.renamed:
+            yield f'renamed  {node_id} "{old}" -> "{new}"'
+        for node_id, old_parent, new_parent in self.moved:
+            yield (f'moved    {describe(self.new_tree, node_id)} from {describe(self.old_tree, old_parent)} '
+                   f'to {describe(self.new_tree, new_parent)}')
+        for node_id, changes in self.changed:
+            for key, (old, new) in changes.items():
+                yield f'changed  {describe(self.new_tree, node_id)} {key}: {json.dumps(old)} -> {json.dumps(new)}'
+
+
+def main():
+    """
+    Show what changed between two saved trees from extract.py, e.g. last
+    week's and this week's extraction of the same plan.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('old_file',
+                        type=str,
+                        help='Tree snapshot file from the earlier extraction.')
+
+    parser.add_argument('new_file',
+                        type=str,
+                        help='Tree snapshot file from the later extraction.')
+
+    parser.add_argument('--output_type',
+                        choices=['text', 'json'],
+                        default='text',
+                        help="""Text is one line per difference followed by a summary; JSON
+                        is a dict of lists of differences by kind.""")
+
+    args = vars(parser.parse_args())
+
+    old_tree = convert.load_tree(args.get('old_file'))
+    new_tree = convert.load_tree(args.get('new_file'))
+    diff = TreeDiff(old_tree, new_tree)
+
+    try:
+        if args.get('output_type') == 'json':
+            json.dump(diff.as_dict(), sys.stdout)
+            sys.stdout.write('\n')
+        else:
+            for line in diff.lines():
+                print(line)
+            print(diff.summary())
+    except BrokenPipeError:
+        convert.exit_on_broken_pipe()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,30 @@
 import argparse
+import convert
 import json
+import os
+import re
+import snapshot
+
+
+def d3_name(name, data, trim, overload_name=False):
+    """
+    Return the name to show for a node in d3, shortened to trim
+    characters and, with overload_name, prefixed with its node type and
+    owner.
+    """
+    if trim:
+        pretty_name = name[0:(trim - 1)]
+    else:
+        pretty_name = name
+    if data and overload_name:
+        owner = data.get('owner', None) or ''
+        node_type = data.get('node_type', None)
+        if node_type:
+            node_short = f'{node_type[0]} '
+        else:
+            node_short = None
+        return f'{node_short}[{owner[0:5]}] {pretty_name}'
+    return pretty_name
 
 
 def treelib_to_d3(node, trim, max_depth=None, depth=0, overload_name=False):
@@ -27,31 +52,21 @@ def treelib_to_d3(node, trim, max_depth=None, depth=0, overload_name=False):
                                  "children": [{"name": "KD: B-O2-D1: Brand",
                                                "data": {"node_type": "Projects"}}]}]}]}
     """
+    # treelib writes leaves without data as bare names
+    if isinstance(node, str):
+        return {'name': d3_name(node, None, trim)}
+
     # assume there is only one key/value pair in treelib node, and that
     # the key is the node name, and the value is a dict of its contents
     name = next(iter(node))
-    if trim:
-        pretty_name = name[0:(trim - 1)]
-    else:
-        pretty_name = name
-
-    new_dict = {'name': pretty_name}
-
     node_value = node[name]
 
     # assume that the value of the only key of the treelib node as a dict.
     # if it has a 'data' key, move it and its value up to the node-level dict
     data = node_value.get('data')
+    new_dict = {'name': d3_name(name, data, trim, overload_name)}
     if data:
         new_dict['data'] = data
-        if overload_name:
-            owner = data.get('owner', None)
-            node_type = data.get('node_type', None)
-            if node_type:
-                node_short = f'{node_type[0]} '
-            else:
-                node_short = None
-            new_dict['name'] = f'{node_short}[{owner[0:5]}] {pretty_name}'
     # if there is a children key, assume its value is a list of nodes,
     # recurse through them, rebuild them as a list, and move the 'children'/list
     # key/value pair up to the node-level dict
@@ -60,7 +75,7 @@ def treelib_to_d3(node, trim, max_depth=None, depth=0, overload_name=False):
     if children:
         if max_depth and depth >= max_depth:
             # new_dict['name'] = f'{pretty_name}: {len(children) * "◼"}'
-            new_dict['name'] = f'{pretty_name}'
+            new_dict['name'] = d3_name(name, None, trim)
         else:
             child_list = []
             for child in children:
@@ -69,14 +84,376 @@ def treelib_to_d3(node, trim, max_depth=None, depth=0, overload_name=False):
                                            depth=(depth + 1),
                                            overload_name=overload_name)
                 child_list.append(child_node)
-                new_dict['children'] = child_list
+            new_dict['children'] = child_list
 
     return new_dict
 
 
+def snapshot_to_d3(tree, trim, max_depth=None, overload_name=False, multi_parent='first'):
+    """
+    Given a tree snapshot from extract.py, return the same d3 dict that
+    treelib_to_d3 makes from its treelib json, without the json step.
+    Walks the tree with an explicit stack rather than recursion.  See
+    convert.children_function for multi_parent.
+    """
+    sorted_children = convert.children_function(tree, multi_parent)
+
+    def convert_node(node, depth):
+        data = node.data
+        new_dict = {'name': d3_name(node.tag, data, trim, overload_name)}
+        if data:
+            new_dict['data'] = data
+        children = sorted_children(node)
+        if children and max_depth and depth >= max_depth:
+            new_dict['name'] = d3_name(node.tag, None, trim)
+            children = []
+        return new_dict, children
+
+    root_dict, children = convert_node(tree.get_node(tree.root), 0)
+    stack = [(root_dict, children, 0)]
+    while stack:
+        new_dict, children, depth = stack.pop()
+        if children:
+            new_dict['children'] = []
+        for child in children:
+            child_dict, grandchildren = convert_node(child, depth + 1)
+            new_dict['children'].append(child_dict)
+            stack.append((child_dict, grandchildren, depth + 1))
+    return root_dict
+
+
+JSON_SCALAR = re.compile(r'[-+.0-9eE]+|[a-z]+')
+JSON_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+def iter_json_events(input_file, chunk_size=64 * 1024):
+    """
+    Yield (event, value) pairs for the JSON document in input_file,
+    reading it a chunk at a time instead of loading it whole.  Events
+    are start_map, key, end_map, start_array, end_array and value.
+    Truncated input raises ValueError.
+    """
+    buffer = ''
+    position = 0
+    eof = False
+    containers = []
+    expect_key = False
+
+    while True:
+        position = JSON_WHITESPACE.match(buffer, position).end()
+        if position >= len(buffer) - 1 and not eof:
+            # refill before the buffer runs dry, so no token is cut in half
+            chunk = input_file.read(chunk_size)
+            eof = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        if position >= len(buffer):
+            if containers:
+                raise ValueError('JSON input ended inside a value')
+            return
+
+        char = buffer[position]
+        if char in '{[':
+            containers.append(char)
+            expect_key = char == '{'
+            position += 1
+            yield ('start_map' if char == '{' else 'start_array'), None
+        elif char in '}]':
+            containers.pop()
+            position += 1
+            yield ('end_map' if char == '}' else 'end_array'), None
+        elif char == ',':
+            expect_key = containers[-1] == '{'
+            position += 1
+        elif char == ':':
+            expect_key = False
+            position += 1
+        else:
+            if char == '"':
+                try:
+                    value, end = json.decoder.scanstring(buffer, position + 1)
+                except json.JSONDecodeError:
+                    end = None
+            else:
+                # numbers and true/false/null run until a delimiter
+                match = JSON_SCALAR.match(buffer, position)
+                end = match.end() if match else position
+                if end == position:
+                    raise ValueError(f'Unexpected character {char!r} in JSON input')
+                if end < len(buffer) or eof:
+                    value = json.loads(match.group())
+            if end is None or (end >= len(buffer) and not eof):
+                # the token may continue in the next chunk
+                if eof:
+                    raise ValueError('Unterminated string in JSON input')
+                chunk = input_file.read(chunk_size)
+                eof = not chunk
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+            position = end
+            yield ('key' if expect_key else 'value'), value
+
+
+def read_json_value(events, event, value):
+    """
+    Build the Python value that starts with (event, value), taking the
+    rest of it from events.
+    """
+    if event == 'value':
+        return value
+    result = {} if event == 'start_map' else []
+    stack = [result]
+    key = None
+    for event, value in events:
+        if event == 'key':
+            key = value
+            continue
+        if event in ('end_map', 'end_array'):
+            stack.pop()
+            if not stack:
+                return result
+            continue
+        if event == 'value':
+            item = value
+        else:
+            item = {} if event == 'start_map' else []
+        if isinstance(stack[-1], dict):
+            stack[-1][key] = item
+        else:
+            stack[-1].append(item)
+        if event in ('start_map', 'start_array'):
+            stack.append(item)
+    raise ValueError('JSON input ended inside a value')
+
+
+def skip_json_value(events, event):
+    """
+    Consume the value that starts with event without building it, and
+    return how many items it held if it was a container.
+    """
+    if event == 'value':
+        return 0
+    items = 0
+    depth = 1
+    for event, value in events:
+        if event in ('start_map', 'start_array'):
+            if depth == 1:
+                items += 1
+            depth += 1
+        elif event in ('end_map', 'end_array'):
+            depth -= 1
+            if depth == 0:
+                return items
+        elif event == 'value' and depth == 1:
+            items += 1
+    raise ValueError('JSON input ended inside a value')
+
+
+class D3StreamWriter(object):
+    """
+    Writes d3 hierarchical json to a stream one node at a time.  Call
+    begin_node() when a node starts, nested calls for its children, and
+    end_node() once its name and data are known, which may be after its
+    children.  Each node is written as {"children": [...], "name": ...,
+    "data": ...}; the key order differs from treelib_to_d3's, but d3
+    doesn't mind.
+    """
+
+    def __init__(self, stream, trim, max_depth=None, overload_name=False):
+        self.stream = stream
+        self.trim = trim
+        self.max_depth = max_depth
+        self.overload_name = overload_name
+        # for each open node, whether its "children" list has been started
+        self.open_nodes = []
+
+    def depth(self):
+        return len(self.open_nodes)
+
+    def cuts_children(self, depth):
+        """
+        True if children of a node at this depth are left out.
+        """
+        return bool(self.max_depth) and depth >= self.max_depth
+
+    def begin_node(self):
+        if self.open_nodes:
+            if self.open_nodes[-1]:
+                self.stream.write(', ')
+            else:
+                self.stream.write('"children": [')
+                self.open_nodes[-1] = True
+        self.stream.write('{')
+        self.open_nodes.append(False)
+
+    def end_node(self, name, data, had_children=False):
+        """
+        Finish the current node.  had_children says whether the node had
+        children in the input, even if they were cut by max_depth.
+        """
+        depth = len(self.open_nodes) - 1
+        if self.open_nodes.pop():
+            self.stream.write('], ')
+        if had_children and self.cuts_children(depth):
+            name = d3_name(name, None, self.trim)
+        else:
+            name = d3_name(name, data, self.trim, self.overload_name)
+        self.stream.write(f'"name": {json.dumps(name)}')
+        if data:
+            self.stream.write(f', "data": {json.dumps(data)}')
+        self.stream.write('}')
+
+
+def stream_treelib_to_d3(input_file, output_file, trim, max_depth=None, overload_name=False):
+    """
+    Convert treelib json read from input_file to d3 json written to
+    output_file, as treelib_to_d3 does, but reading the input
+    incrementally and writing each node as soon as it is complete.
+    Walks the input with an explicit stack, so memory stays flat and
+    deep trees can't hit the recursion limit.  Leaf nodes may also be
+    plain strings, as treelib writes them without with_data.
+    """
+    writer = D3StreamWriter(output_file, trim, max_depth, overload_name)
+    events = iter_json_events(input_file)
+    # one entry per open node: [name, data, had_children, reading_children]
+    stack = []
+    event, value = next(events)
+    while True:
+        # event, value is the start of a node
+        if event == 'value':
+            writer.begin_node()
+            writer.end_node(value, None)
+        else:
+            event, name = next(events)  # the node name is its only key
+            next(events)  # start of the node's body
+            writer.begin_node()
+            stack.append([name, None, False, False])
+
+        # carry on until the next node starts, or the input ends
+        while stack:
+            node = stack[-1]
+            event, value = next(events)
+            if node[3]:
+                if event == 'end_array':
+                    node[3] = False
+                    continue
+                break
+            if event == 'key' and value == 'children':
+                event, value = next(events)
+                if writer.cuts_children(writer.depth() - 1):
+                    node[2] = skip_json_value(events, event) > 0
+                else:
+                    node[3] = True
+                    node[2] = True
+            elif event == 'key' and value == 'data':
+                node[1] = read_json_value(events, *next(events))
+            elif event == 'key':
+                skip_json_value(events, next(events)[0])
+            elif event == 'end_map':
+                next(events)  # end of the {name: body} wrapper
+                writer.end_node(node[0], node[1], node[2])
+                stack.pop()
+        if not stack:
+            break
+
+
+def stream_snapshot_to_d3(tree, output_file, trim, max_depth=None, overload_name=False, multi_parent='first'):
+    """
+    Write the d3 json for a tree snapshot straight to output_file,
+    walking it with an explicit stack and never descending past
+    max_depth.
+    """
+    sorted_children = convert.children_function(tree, multi_parent)
+    writer = D3StreamWriter(output_file, trim, max_depth, overload_name)
+    root = tree.get_node(tree.root)
+    writer.begin_node()
+    children = sorted_children(root)
+    stack = [(root, children, iter(children))]
+    while stack:
+        node, children, remaining = stack[-1]
+        child = next(remaining, None)
+        if child is None or writer.cuts_children(len(stack) - 1):
+            stack.pop()
+            writer.end_node(node.tag, node.data, bool(children))
+            continue
+        writer.begin_node()
+        children = sorted_children(child)
+        stack.append((child, children, iter(children)))
+
+
+class D3Writer(convert.TreeWriter):
+    """
+    D3StreamWriter as a convert.TreeWriter, so that convert.py can
+    write d3 json in the same walk as its other formats.  Nodes below
+    max_depth are walked past but not written.
+    """
+
+    def __init__(self, stream, trim, max_depth=None, overload_name=False):
+        super(D3Writer, self).__init__(stream)
+        self.writer = D3StreamWriter(stream, trim, max_depth, overload_name)
+        # depth of each node entered and not yet left
+        self.depths = []
+
+    def written(self, depth):
+        return depth == 0 or not self.writer.cuts_children(depth - 1)
+
+    def enter(self, node, parent_id, is_last, children):
+        self.depths.append(len(is_last))
+        if self.written(len(is_last)):
+            self.writer.begin_node()
+
+    def leave(self, node, children):
+        if self.written(self.depths.pop()):
+            self.writer.end_node(node.tag, node.data, bool(children))
+
+
+def shard_d3(root_dict, output_filename, shard_dir, shard_depth):
+    """
+    Split a d3 dict into a top-level file and shard files, so a viewer
+    can load the top of a big tree quickly and fetch the rest as nodes
+    are expanded.  output_filename holds shard_depth levels, counting
+    the root as the first.  Each node at the bottom of a file that has
+    children gets "child_count" and "shard", the path of a shard file
+    relative to output_filename, instead of "children"; the shard holds
+    the list of those children, again shard_depth levels deep.  Returns
+    how many shard files were written.
+    """
+    os.makedirs(shard_dir, exist_ok=True)
+    shard_prefix = os.path.relpath(shard_dir, os.path.dirname(os.path.abspath(output_filename)))
+    # (nodes to write, filename, whether the file is a bare child list)
+    files = [([root_dict], output_filename, False)]
+    shard_count = 0
+    position = 0
+    while position < len(files):
+        nodes, filename, is_shard = files[position]
+        stack = [(node, 1) for node in reversed(nodes)]
+        while stack:
+            node, depth = stack.pop()
+            children = node.get('children')
+            if not children:
+                continue
+            if depth < shard_depth:
+                stack.extend((child, depth + 1) for child in reversed(children))
+                continue
+            shard_filename = f'{shard_count}.json'
+            shard_count += 1
+            del node['children']
+            node['child_count'] = len(children)
+            node['shard'] = '/'.join((shard_prefix, shard_filename)) if shard_prefix != '.' else shard_filename
+            files.append((children, os.path.join(shard_dir, shard_filename), True))
+        with open(filename, 'w') as file:
+            file.write(json.dumps(nodes if is_shard else nodes[0]))
+        files[position] = None  # written, let it go
+        position += 1
+    return shard_count
+
+
 def main():
     """
-    Convert a treelib json file from extract.py to a d3 hierarchy-style json file.
+    Convert a treelib json file from convert.py, or a tree snapshot file
+    from extract.py, to a d3 hierarchy-style json file.
     """
 
     parser = argparse.ArgumentParser()
@@ -102,6 +479,28 @@ def main():
                         type=int,
                         help='truncate the tree after this many levels.')
 
+    parser.add_argument('--stream',
+                        action='store_true',
+                        help="""Read the input and write the output incrementally, to keep
+                        memory flat for very large trees.""")
+
+    parser.add_argument('--shard_dir',
+                        type=str,
+                        help="""Write the tree below --shard_depth levels into shard files in
+                        this directory, for dndTree.js to load as nodes are expanded.""")
+
+    parser.add_argument('--shard_depth',
+                        type=int,
+                        help='How many levels to put in the top-level file and in each shard',
+                        default=2)
+
+    parser.add_argument('--multi_parent',
+                        choices=convert.MULTI_PARENT_MODES,
+                        default='first',
+                        help="""For snapshot input, how to show Airtable records linked to
+                        more than one parent; see convert.py.  treelib json from
+                        convert.py already has this applied.""")
+
     args = vars(parser.parse_args())
 
     input_filename = args.get('input_filename')
@@ -109,12 +508,44 @@ def main():
     trim = args.get('trim')
     max_depth = args.get('max_depth')
     overload_name = args.get('overload_name')
-    with open(input_filename, 'r') as input_file:
-        data = json.load(input_file)
-        output_dict = treelib_to_d3(data,
-                                    trim=trim,
-                                    max_depth=max_depth,
-                                    overload_name=overload_name)
+    multi_parent = args.get('multi_parent')
+    shard_dir = args.get('shard_dir')
+    if shard_dir and args.get('stream'):
+        parser.error('--shard_dir and --stream can not be used together')
+    if args.get('shard_depth') < 1:
+        parser.error('--shard_depth must be at least 1')
+    if args.get('stream'):
+        with open(output_filename, 'w') as output_file:
+            if snapshot.is_snapshot(input_filename):
+                stream_snapshot_to_d3(snapshot.Snapshot(input_filename), output_file,
+                                      trim=trim,
+                                      max_depth=max_depth,
+                                      overload_name=overload_name,
+                                      multi_parent=multi_parent)
+            else:
+                with open(input_filename, 'r') as input_file:
+                    stream_treelib_to_d3(input_file, output_file,
+                                         trim=trim,
+                                         max_depth=max_depth,
+                                         overload_name=overload_name)
+        return
+
+    if snapshot.is_snapshot(input_filename):
+        output_dict = snapshot_to_d3(snapshot.Snapshot(input_filename),
+                                     trim=trim,
+                                     max_depth=max_depth,
+                                     overload_name=overload_name,
+                                     multi_parent=multi_parent)
+    else:
+        with open(input_filename, 'r') as input_file:
+            data = json.load(input_file)
+            output_dict = treelib_to_d3(data,
+                                        trim=trim,
+                                        max_depth=max_depth,
+                                        overload_name=overload_name)
+    if shard_dir:
+        shard_d3(output_dict, output_filename, shard_dir, args.get('shard_depth'))
+        return
     file = open(output_filename, 'w')
     file.write(json.dumps(output_dict))
 